@@ -1,49 +1,1972 @@
-from flask import Flask, render_template_string, request, redirect, url_for, flash, send_file, jsonify
-import yt_dlp
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, session, g
+from jinja2 import ChoiceLoader, DictLoader
 import os
+import base64
+import glob
+import collections
+import bisect
+import copy
+import functools
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import mimetypes
+import multiprocessing
+import re
+import shutil
+import signal
+import sqlite3
+import struct
+import subprocess
+import sys
 import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from urllib.parse import quote, unquote
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import wrap_file
+
+try:
+    import fcntl
+    import resource
+except ImportError:  # Windows: sem lock entre processos nem limite de memória
+    fcntl = resource = None
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 app.config['DOWNLOAD_FOLDER'] = 'downloads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max request size
+# Quantos downloads rodam ao mesmo tempo e quantos podem aguardar na fila
+app.config['MAX_DOWNLOAD_WORKERS'] = int(os.environ.get('MAX_DOWNLOAD_WORKERS', '2'))
+app.config['MAX_DOWNLOAD_QUEUE'] = int(os.environ.get('MAX_DOWNLOAD_QUEUE', '20'))
+# Playlists e canais: máximo de vídeos por lote e quantos deles baixam ao mesmo tempo
+app.config['MAX_BATCH_SIZE'] = int(os.environ.get('MAX_BATCH_SIZE', '500'))
+app.config['BATCH_CONCURRENCY'] = int(os.environ.get('BATCH_CONCURRENCY', '2'))
+# Onde rodam os downloads: 'inline' (pool supervisionado por um dos workers web)
+# ou 'external' (processo à parte: `python app.py downloader`)
+app.config['DOWNLOAD_RUNNER'] = os.environ.get('DOWNLOAD_RUNNER', 'inline')
+# Limites de cada download: tempo em segundos e memória em MB (0 = sem limite)
+app.config['DOWNLOAD_TIMEOUT'] = int(os.environ.get('DOWNLOAD_TIMEOUT', '3600'))
+app.config['DOWNLOAD_MEMORY_LIMIT'] = int(os.environ.get('DOWNLOAD_MEMORY_LIMIT', '0'))
+# Perfil de desempenho dos downloads (ver PERFIS_DOWNLOAD): 'default' ou 'fast'
+app.config['DOWNLOAD_PROFILE'] = os.environ.get('DOWNLOAD_PROFILE', 'default')
+# Fragmentos baixados ao mesmo tempo por stream (0 = o valor do perfil)
+app.config['DOWNLOAD_FRAGMENTS'] = int(os.environ.get('DOWNLOAD_FRAGMENTS', '0'))
+# Teto de conexões simultâneas somando todos os downloads em andamento
+app.config['MAX_DOWNLOAD_CONNECTIONS'] = int(os.environ.get('MAX_DOWNLOAD_CONNECTIONS', '16'))
+# Conversões do ffmpeg (perfis de saída, ver PERFIS_SAIDA) ao mesmo tempo e a
+# prioridade delas (nice); rodam fora dos slots de download
+app.config['MAX_TRANSCODE_WORKERS'] = int(os.environ.get('MAX_TRANSCODE_WORKERS', '1'))
+app.config['TRANSCODE_NICE'] = int(os.environ.get('TRANSCODE_NICE', '10'))
+# Carregar o yt-dlp já na importação (útil com o preload_app do gunicorn:
+# os workers herdam os módulos do processo mestre por copy-on-write)
+app.config['PRELOAD_YT_DLP'] = os.environ.get('PRELOAD_YT_DLP', '0') == '1'
+# Estado compartilhado entre os workers do gunicorn ('sqlite' ou 'memory')
+app.config['JOB_STORE'] = os.environ.get('JOB_STORE', 'sqlite')
+app.config['STATE_FOLDER'] = os.path.join(app.config['DOWNLOAD_FOLDER'], '.state')
+# Jobs terminados expiram após JOB_TTL segundos; acima de MAX_TRACKED_JOBS
+# registros, os terminados mais antigos são descartados (0 = sem limite)
+app.config['JOB_TTL'] = int(os.environ.get('JOB_TTL', str(24 * 60 * 60)))
+app.config['MAX_TRACKED_JOBS'] = int(os.environ.get('MAX_TRACKED_JOBS', '10000'))
+# Limite de requisições por cliente (token bucket), no formato 'N/S': rajadas
+# de até N requisições e, em média, N a cada S segundos ('0' = sem limite).
+# 'submit' vale para novos downloads (/download e POST /api/jobs) e 'files'
+# para a entrega de arquivos (/download_file e /export.zip)
+app.config['RATE_LIMIT_SUBMIT'] = os.environ.get('RATE_LIMIT_SUBMIT', '10/60')
+app.config['RATE_LIMIT_FILES'] = os.environ.get('RATE_LIMIT_FILES', '120/60')
+# Como identificar o cliente: 'ip' ou 'session' (cookie; útil com muitos
+# usuários atrás do mesmo IP). Atrás de proxies reversos, TRUSTED_PROXIES diz
+# quantos deles acrescentam o X-Forwarded-For (traefik/nginx na frente = 1)
+app.config['RATE_LIMIT_KEY'] = os.environ.get('RATE_LIMIT_KEY', 'ip')
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', '0'))
+# Entrega dos arquivos: 'direct' (pelo próprio worker), 'x-accel' (nginx) ou 'x-sendfile' (Apache/lighttpd)
+app.config['FILE_DELIVERY'] = os.environ.get('FILE_DELIVERY', 'direct')
+# Location interna do nginx que aponta para a pasta de downloads
+app.config['X_ACCEL_PREFIX'] = os.environ.get('X_ACCEL_PREFIX', '/protected-downloads/')
+# Caminho da pasta de downloads como o proxy a enxerga (modo x-sendfile)
+app.config['X_SENDFILE_ROOT'] = os.environ.get('X_SENDFILE_ROOT', os.path.abspath(app.config['DOWNLOAD_FOLDER']))
+# Limites de espaço da pasta de downloads em bytes (0 = 80%/72% da capacidade do volume)
+app.config['STORAGE_HIGH_WATER'] = int(os.environ.get('STORAGE_HIGH_WATER', '0'))
+app.config['STORAGE_LOW_WATER'] = int(os.environ.get('STORAGE_LOW_WATER', '0'))
+
+if app.config['TRUSTED_PROXIES']:
+    # request.remote_addr passa a ser o cliente informado pelos proxies confiáveis
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
 
 # Criar pasta de downloads se não existir
 if not os.path.exists(app.config['DOWNLOAD_FOLDER']):
     os.makedirs(app.config['DOWNLOAD_FOLDER'])
 
-# Armazenar status de downloads em andamento
-download_status = {}
+# Métricas (/metrics) no modo multiprocesso do prometheus_client: cada processo
+# (workers do gunicorn, supervisor dos downloads) grava seus contadores em
+# arquivos mmap numa pasta e /metrics soma todos. Precisa estar definido antes
+# da importação. Cada container tem a sua subpasta (METRICS_INSTANCE, um nome
+# fixo por serviço no docker-compose) no volume compartilhado: os PIDs de
+# containers diferentes se repetem (o processo principal de cada um é o PID 1)
+# e não podem dividir os mesmos arquivos. O /metrics lê as subpastas de todos,
+# só para leitura. PROMETHEUS_MULTIPROC_DIR, se definido, é a pasta raiz.
+if os.environ.get('BAIXADOR_METRICAS') is None:
+    # Primeiro processo a importar o app neste container (o mestre do gunicorn
+    # com preload, `python app.py downloader`): os arquivos de uma execução
+    # anterior desta instância são descartados, os das outras ficam. Workers
+    # e processos de download herdam as variáveis e usam a pasta como está.
+    os.environ['BAIXADOR_METRICAS'] = os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.path.join(
+        app.config['DOWNLOAD_FOLDER'], '.state', 'metrics'
+    )
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = os.path.join(
+        os.environ['BAIXADOR_METRICAS'], os.path.basename(os.environ.get('METRICS_INSTANCE') or 'default')
+    )
+    shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+app.config['METRICS_FOLDER'] = os.environ['BAIXADOR_METRICAS']
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest  # noqa: E402
+from prometheus_client import multiprocess  # noqa: E402
+from prometheus_client.core import GaugeMetricFamily  # noqa: E402
+
+_BUCKETS_ETAPA = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+_BUCKETS_VELOCIDADE = tuple(2 ** n * 1024 for n in range(6, 18, 2))  # 64 KiB/s a 64 MiB/s
+
+METRICA_JOBS_INICIADOS = Counter('baixador_jobs_started_total', 'Jobs retirados da fila pelo scheduler')
+METRICA_JOBS_FINALIZADOS = Counter('baixador_jobs_finished_total', 'Jobs terminados, por resultado', ['result'])
+METRICA_TENTATIVAS = Counter(
+    'baixador_download_attempts_total',
+    'Tentativas de download por estratégia de formato e resultado', ['strategy', 'result'],
+)
+METRICA_EXTRACAO = Histogram('baixador_extract_seconds', 'Tempo de extração das informações do vídeo', buckets=_BUCKETS_ETAPA)
+METRICA_DOWNLOAD = Histogram('baixador_download_seconds', 'Tempo de download (sem o merge)', buckets=_BUCKETS_ETAPA)
+METRICA_MERGE = Histogram('baixador_merge_seconds', 'Tempo de merge de áudio e vídeo pelo ffmpeg', buckets=_BUCKETS_ETAPA)
+METRICA_CONVERSAO = Histogram('baixador_transcode_seconds', 'Tempo de conversão para o perfil de saída', buckets=_BUCKETS_ETAPA)
+METRICA_VELOCIDADE = Histogram(
+    'baixador_download_speed_bytes', 'Velocidade média de cada download (bytes/s)', buckets=_BUCKETS_VELOCIDADE
+)
+METRICA_BYTES = Counter('baixador_downloaded_bytes_total', 'Bytes gravados por downloads concluídos')
+METRICA_LIMITADAS = Counter('baixador_rate_limited_total', 'Requisições recusadas pelo limite por cliente', ['bucket'])
+METRICA_REQUISICOES = Histogram(
+    'baixador_http_request_duration_seconds',
+    'Tempo de cada rota até o envio dos cabeçalhos (respostas em streaming não incluem o corpo)',
+    ['endpoint', 'method', 'status'],
+)
+
+class JobStore:
+    """
+    Interface do armazenamento de status dos downloads
+    
+    Cada registro é um dict serializável em JSON com pelo menos a chave
+    'status'. A implementação precisa ser visível por todos os workers do
+    gunicorn: SQLite num volume compartilhado, Redis (HGET/HMGET/pipeline
+    para os registros e um sorted set para a fila), etc.
+    
+    Jobs terminados expiram `ttl` segundos depois da última atualização e,
+    acima de `max_registros`, os terminados mais antigos são descartados
+    primeiro. Jobs na fila ou baixando nunca são descartados.
+    """
+    
+    # Status de jobs que já terminaram (podem expirar)
+    finalizados = ('completed', 'error')
+    # Status de jobs em andamento: no máximo um por vídeo, nunca expiram
+    em_andamento = ('queued', 'downloading', 'transcode_queued', 'transcoding')
+    # Intervalo mínimo entre limpezas feitas ao criar jobs
+    intervalo_limpeza = 60
+    
+    def __init__(self, ttl=0, max_registros=0):
+        self.ttl = ttl
+        self.max_registros = max_registros
+        self._proxima_limpeza = 0
+    
+    def get(self, download_id):
+        """Retorna o registro ou None"""
+        return self.get_many([download_id]).get(download_id)
+    
+    def get_many(self, download_ids):
+        """Retorna {download_id: registro} apenas para os ids existentes"""
+        raise NotImplementedError
+    
+    def set(self, download_id, registro):
+        self.set_many({download_id: registro})
+    
+    def set_many(self, registros):
+        """Grava (substituindo) vários registros de uma vez"""
+        raise NotImplementedError
+    
+    def update(self, download_id, **campos):
+        self.update_many({download_id: campos})
+    
+    def update_many(self, atualizacoes):
+        """Mescla campos em vários registros existentes de uma vez"""
+        raise NotImplementedError
+    
+    def count(self, status, batched=True):
+        """Quantidade de registros com o status informado (batched=False ignora os itens de lotes)"""
+        raise NotImplementedError
+    
+    def total(self):
+        """Quantidade de registros armazenados"""
+        raise NotImplementedError
+    
+    def list_by_status(self, statuses):
+        """Retorna {download_id: registro} dos registros com um dos status informados"""
+        raise NotImplementedError
+    
+    def queue_position(self, download_id):
+        """Posição (1 = próximo) entre os registros 'queued', ou None"""
+        return self.queue_positions([download_id]).get(download_id)
+    
+    def queue_positions(self, download_ids):
+        """
+        Retorna {download_id: posição} para os ids que estão na fila, na
+        ordem em que claim_next() os tiraria se nada mais mudasse (rodízio
+        entre clientes). O limite de itens por lote não entra na conta.
+        """
+        fila = sorted(self.list_by_status(('queued',)).items(), key=lambda item: item[1].get('queued_at', 0))
+        ativos = {}
+        for registro in self.list_by_status(('downloading',)).values():
+            ativos[registro.get('client')] = ativos.get(registro.get('client'), 0) + 1
+        return self._posicoes_no_rodizio(((i, r.get('client')) for i, r in fila), ativos, download_ids)
+    
+    @staticmethod
+    def _posicoes_no_rodizio(fila, ativos, download_ids):
+        """
+        Simula claim_next() sobre `fila` ((id, cliente) do mais antigo ao mais
+        novo), partindo de `ativos` ({cliente: jobs baixando})
+        """
+        por_cliente = {}
+        for ordem, (download_id, cliente) in enumerate(fila):
+            por_cliente.setdefault(cliente, collections.deque()).append((ordem, download_id))
+        # (jobs do cliente em andamento, ordem do próximo job dele, cliente)
+        vez = [(ativos.get(c, 0), jobs[0][0], i, c) for i, (c, jobs) in enumerate(por_cliente.items())]
+        heapq.heapify(vez)
+        procurados = set(download_ids)
+        posicoes = {}
+        posicao = 0
+        while vez and len(posicoes) < len(procurados):
+            em_andamento, _, desempate, cliente = heapq.heappop(vez)
+            jobs = por_cliente[cliente]
+            _, download_id = jobs.popleft()
+            posicao += 1
+            if download_id in procurados:
+                posicoes[download_id] = posicao
+            if jobs:
+                heapq.heappush(vez, (em_andamento + 1, jobs[0][0], desempate, cliente))
+        return posicoes
+    
+    def claim(self, download_id, registro):
+        """
+        Grava um novo job, a menos que já exista um em andamento para o
+        mesmo 'video_id' (operação atômica)
+        
+        Returns:
+            str: Id do job responsável pelo vídeo (o novo ou o existente)
+        """
+        raise NotImplementedError
+    
+    def claim_many(self, registros):
+        """
+        claim() de vários jobs (na ordem do dict); jobs do mesmo vídeo no
+        mesmo lote ficam com o primeiro
+        
+        Returns:
+            dict: {download_id: id do job responsável pelo vídeo}
+        """
+        return {download_id: self.claim(download_id, registro) for download_id, registro in registros.items()}
+    
+    def claim_next(self, max_por_lote=0, de='queued', para='downloading', **campos):
+        """
+        Tira da fila um job `de` e o marca como `para`, mesclando `campos`
+        (operação atômica: cada job vai para um só executor). A fila de
+        conversões usa de='transcode_queued', para='transcoding'.
+        
+        Rodízio entre clientes ('client'): o escolhido é o job mais antigo do
+        cliente com menos jobs em `para`, para que quem enfileirou muitos
+        vídeos não ocupe todos os slots enquanto os outros esperam.
+        
+        Itens de um lote ('batch_id') são pulados enquanto o lote já tiver
+        `max_por_lote` itens em `para` (0 = sem limite).
+        
+        Returns:
+            tuple: (id, registro atualizado) ou None se a fila estiver vazia
+        """
+        raise NotImplementedError
+    
+    def requeue(self, download_id, de='downloading', para='queued', **campos):
+        """
+        Devolve à fila, na posição original, um job que ainda está em `de`
+        (ex.: o processo que o executava morreu)
+        
+        Returns:
+            bool: False se o job não estava mais em `de`
+        """
+        raise NotImplementedError
+    
+    def find_by_video(self, video_id, statuses):
+        """Job mais recente do vídeo com um dos status informados: (id, registro) ou None"""
+        raise NotImplementedError
+    
+    def find_by_videos(self, video_ids, statuses):
+        """find_by_video() de vários vídeos: {video_id: (id, registro)} dos encontrados"""
+        encontrados = {}
+        for video_id in set(video_ids):
+            existente = self.find_by_video(video_id, statuses)
+            if existente:
+                encontrados[video_id] = existente
+        return encontrados
+    
+    def purge(self):
+        """
+        Remove os jobs terminados que expiraram (TTL) e, se ainda houver
+        mais que `max_registros`, os terminados mais antigos; soma os
+        removidos ao contador 'jobs_evicted'
+        
+        Returns:
+            int: Quantidade de registros removidos
+        """
+        raise NotImplementedError
+    
+    def _limpar_se_preciso(self):
+        # Chamado a cada job novo; a limpeza roda no máximo uma vez por intervalo
+        agora = time.time()
+        if (self.ttl or self.max_registros) and agora >= self._proxima_limpeza:
+            self._proxima_limpeza = agora + self.intervalo_limpeza
+            self.purge()
+    
+    def incr(self, nome, valor=1):
+        """Incrementa um contador compartilhado"""
+        raise NotImplementedError
+    
+    def counters(self):
+        """Retorna {nome: valor} de todos os contadores"""
+        raise NotImplementedError
+
+class JobRecord:
+    """
+    Registro de um job no armazenamento em memória
+    
+    Os campos conhecidos ficam em slots (sem um dict por instância); chaves
+    fora da lista vão para `extras`, criado só quando necessário.
+    """
+    
+    CAMPOS = (
+        'status', 'message', 'url', 'video_id', 'queued_at', 'started_at', 'wait_time',
+        'filename', 'expected_filename', 'format_id', 'progress', 'attempts', 'runner_pid', 'batch_id',
+        'client',
+    )
+    __slots__ = CAMPOS + ('updated_at', 'extras')
+    
+    def __init__(self, registro):
+        self.extras = None
+        self.update(registro)
+    
+    def update(self, campos):
+        for chave, valor in campos.items():
+            if chave in JobRecord.CAMPOS:
+                setattr(self, chave, valor)
+            else:
+                if self.extras is None:
+                    self.extras = {}
+                self.extras[chave] = valor
+        self.updated_at = time.time()
+    
+    def get(self, chave, padrao=None):
+        if chave in JobRecord.CAMPOS:
+            return getattr(self, chave, padrao)
+        return self.extras.get(chave, padrao) if self.extras else padrao
+    
+    def as_dict(self):
+        registro = {}
+        for chave in JobRecord.CAMPOS:
+            try:
+                registro[chave] = getattr(self, chave)
+            except AttributeError:
+                pass
+        if self.extras:
+            registro.update(self.extras)
+        return registro
+
+class MemoryJobStore(JobStore):
+    """Armazenamento em memória, visível apenas no processo atual"""
+    
+    def __init__(self, ttl=0, max_registros=0):
+        super().__init__(ttl, max_registros)
+        self._registros = {}
+        self._contadores = {}
+        self._lock = threading.Lock()
+    
+    def get_many(self, download_ids):
+        with self._lock:
+            return {i: self._registros[i].as_dict() for i in download_ids if i in self._registros}
+    
+    def set_many(self, registros):
+        with self._lock:
+            for download_id, registro in registros.items():
+                self._registros[download_id] = JobRecord(registro)
+    
+    def update_many(self, atualizacoes):
+        with self._lock:
+            for download_id, campos in atualizacoes.items():
+                if download_id in self._registros:
+                    self._registros[download_id].update(campos)
+    
+    def count(self, status, batched=True):
+        with self._lock:
+            return sum(
+                1 for r in self._registros.values()
+                if r.status == status and (batched or r.get('batch_id') is None)
+            )
+    
+    def total(self):
+        return len(self._registros)
+    
+    def list_by_status(self, statuses):
+        with self._lock:
+            return {i: r.as_dict() for i, r in self._registros.items() if r.status in statuses}
+    
+    def queue_positions(self, download_ids):
+        with self._lock:
+            fila = sorted(
+                (r.get('queued_at', 0), i, r.get('client'))
+                for i, r in self._registros.items() if r.status == 'queued'
+            )
+            ativos = {}
+            for r in self._registros.values():
+                if r.status == 'downloading':
+                    ativos[r.get('client')] = ativos.get(r.get('client'), 0) + 1
+        return self._posicoes_no_rodizio(((i, c) for _, i, c in fila), ativos, download_ids)
+    
+    def claim(self, download_id, registro):
+        with self._lock:
+            video_id = registro.get('video_id')
+            if video_id:
+                existente = self._buscar_video(video_id, self.em_andamento)
+                if existente:
+                    return existente[0]
+            self._registros[download_id] = JobRecord(registro)
+        # O teto vale já: num processo de longa duração a memória não cresce além dele
+        if self.max_registros and len(self._registros) > self.max_registros:
+            self.purge()
+        else:
+            self._limpar_se_preciso()
+        return download_id
+    
+    def claim_next(self, max_por_lote=0, de='queued', para='downloading', **campos):
+        with self._lock:
+            baixando = {}
+            por_cliente = {}
+            for r in self._registros.values():
+                if r.status == para:
+                    por_cliente[r.get('client')] = por_cliente.get(r.get('client'), 0) + 1
+                    if r.get('batch_id'):
+                        baixando[r.batch_id] = baixando.get(r.batch_id, 0) + 1
+            fila = [
+                (por_cliente.get(r.get('client'), 0), r.get('queued_at', 0), i) for i, r in self._registros.items()
+                if r.status == de
+                and not (max_por_lote and baixando.get(r.get('batch_id'), 0) >= max_por_lote)
+            ]
+            if not fila:
+                return None
+            download_id = min(fila)[2]
+            registro = self._registros[download_id]
+            registro.update(dict(campos, status=para))
+            return download_id, registro.as_dict()
+    
+    def requeue(self, download_id, de='downloading', para='queued', **campos):
+        with self._lock:
+            registro = self._registros.get(download_id)
+            if not registro or registro.status != de:
+                return False
+            registro.update(dict(campos, status=para))
+            return True
+    
+    def find_by_video(self, video_id, statuses):
+        with self._lock:
+            existente = self._buscar_video(video_id, statuses)
+            return (existente[0], existente[1].as_dict()) if existente else None
+    
+    def _buscar_video(self, video_id, statuses):
+        # Dicts preservam a ordem de inserção: o último encontrado é o mais recente
+        encontrado = None
+        for download_id, r in self._registros.items():
+            if r.get('video_id') == video_id and r.status in statuses:
+                encontrado = (download_id, r)
+        return encontrado
+    
+    def purge(self):
+        agora = time.time()
+        with self._lock:
+            finalizados = [
+                (r.updated_at, i) for i, r in self._registros.items() if r.status in self.finalizados
+            ]
+            expirados = {i for atualizado, i in finalizados if self.ttl and atualizado < agora - self.ttl}
+            excesso = len(self._registros) - len(expirados) - self.max_registros
+            if self.max_registros and excesso > 0:
+                # Remove um pouco além do teto para não ordenar a cada job novo
+                excesso += self.max_registros // 10
+                restantes = sorted(f for f in finalizados if f[1] not in expirados)
+                expirados.update(i for _, i in restantes[:excesso])
+            for download_id in expirados:
+                del self._registros[download_id]
+            if expirados:
+                self._contadores['jobs_evicted'] = self._contadores.get('jobs_evicted', 0) + len(expirados)
+        return len(expirados)
+    
+    def incr(self, nome, valor=1):
+        with self._lock:
+            self._contadores[nome] = self._contadores.get(nome, 0) + valor
+    
+    def counters(self):
+        with self._lock:
+            return dict(self._contadores)
+
+class SQLiteDatabase:
+    """
+    Base dos armazenamentos em arquivo SQLite (modo WAL)
+    
+    Com o arquivo no volume de downloads, todos os workers enxergam os mesmos
+    dados. Leituras não bloqueiam escritas (WAL) e cada thread de cada
+    processo usa a sua própria conexão.
+    """
+    
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._local = threading.local()
+        with self._transacao() as conn:
+            self._criar_esquema(conn)
+    
+    def _criar_esquema(self, conn):
+        raise NotImplementedError
+    
+    @staticmethod
+    def _adicionar_colunas(conn, tabela, colunas):
+        # Migração simples para bancos criados por versões anteriores;
+        # retorna as colunas que não existiam
+        existentes = {linha[1] for linha in conn.execute(f'PRAGMA table_info({tabela})')}
+        adicionadas = [nome for nome in colunas if nome not in existentes]
+        for nome in adicionadas:
+            conn.execute(f'ALTER TABLE {tabela} ADD COLUMN {nome} {colunas[nome]}')
+        return adicionadas
+    
+    def _conexao(self):
+        # Uma conexão por thread e por processo (conexões não sobrevivem ao fork)
+        if getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.caminho, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return self._local.conn
+    
+    @contextmanager
+    def _transacao(self):
+        conn = self._conexao()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+class SQLiteJobStore(SQLiteDatabase, JobStore):
+    """
+    Armazenamento de status num arquivo SQLite
+    
+    As gravações em lote usam uma única transação; os contadores ficam numa
+    tabela à parte.
+    """
+    
+    _em_andamento_sql = ', '.join(f"'{status}'" for status in JobStore.em_andamento)
+    
+    def __init__(self, caminho, ttl=0, max_registros=0):
+        JobStore.__init__(self, ttl, max_registros)
+        SQLiteDatabase.__init__(self, caminho)
+    
+    def _criar_esquema(self, conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                data TEXT NOT NULL,
+                video_id TEXT,
+                batch_id TEXT,
+                client TEXT
+            )
+        ''')
+        self._adicionar_colunas(conn, 'jobs', {'video_id': 'TEXT', 'batch_id': 'TEXT', 'client': 'TEXT'})
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_video ON jobs (video_id, created_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (status, updated_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id, status)')
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_client ON jobs (client, status)')
+        # No máximo um job em andamento por vídeo (o índice antigo não
+        # conhecia os status de conversão)
+        conn.execute('DROP INDEX IF EXISTS jobs_video_ativo')
+        conn.execute(f'''
+            CREATE UNIQUE INDEX IF NOT EXISTS jobs_video_em_andamento ON jobs (video_id)
+            WHERE status IN ({self._em_andamento_sql})
+        ''')
+        conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+    
+    def get_many(self, download_ids):
+        download_ids = list(download_ids)
+        if not download_ids:
+            return {}
+        marcadores = ','.join('?' * len(download_ids))
+        linhas = self._conexao().execute(
+            f'SELECT id, data FROM jobs WHERE id IN ({marcadores})', download_ids
+        )
+        return {download_id: json.loads(data) for download_id, data in linhas}
+    
+    def set_many(self, registros):
+        agora = time.time()
+        with self._transacao() as conn:
+            conn.executemany(
+                '''
+                INSERT INTO jobs (id, status, created_at, updated_at, data, video_id, batch_id) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    status = excluded.status, updated_at = excluded.updated_at,
+                    data = excluded.data, video_id = excluded.video_id, batch_id = excluded.batch_id
+                ''',
+                [
+                    (
+                        download_id, r['status'], r.get('queued_at', agora), agora, json.dumps(r),
+                        r.get('video_id'), r.get('batch_id'),
+                    )
+                    for download_id, r in registros.items()
+                ]
+            )
+    
+    def update_many(self, atualizacoes):
+        agora = time.time()
+        with self._transacao() as conn:
+            atuais = self._ler(conn, atualizacoes)
+            linhas = []
+            for download_id, campos in atualizacoes.items():
+                if download_id in atuais:
+                    registro = atuais[download_id]
+                    registro.update(campos)
+                    linhas.append((registro['status'], agora, json.dumps(registro), registro.get('video_id'), download_id))
+            conn.executemany(
+                'UPDATE jobs SET status = ?, updated_at = ?, data = ?, video_id = ? WHERE id = ?', linhas
+            )
+    
+    def _ler(self, conn, download_ids):
+        download_ids = list(download_ids)
+        marcadores = ','.join('?' * len(download_ids))
+        linhas = conn.execute(f'SELECT id, data FROM jobs WHERE id IN ({marcadores})', download_ids)
+        return {download_id: json.loads(data) for download_id, data in linhas}
+    
+    def count(self, status, batched=True):
+        sql = 'SELECT COUNT(*) FROM jobs WHERE status = ?'
+        if not batched:
+            sql += ' AND batch_id IS NULL'
+        return self._conexao().execute(sql, (status,)).fetchone()[0]
+    
+    def total(self):
+        return self._conexao().execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+    
+    def list_by_status(self, statuses):
+        marcadores = ','.join('?' * len(statuses))
+        linhas = self._conexao().execute(f'SELECT id, data FROM jobs WHERE status IN ({marcadores})', tuple(statuses))
+        return {download_id: json.loads(data) for download_id, data in linhas}
+    
+    def claim(self, download_id, registro):
+        return self.claim_many({download_id: registro})[download_id]
+    
+    def claim_many(self, registros):
+        responsaveis = {}
+        with self._transacao() as conn:
+            for download_id, registro in registros.items():
+                responsaveis[download_id] = self._inserir_job(conn, download_id, registro)
+        self._limpar_se_preciso()
+        return responsaveis
+    
+    def _inserir_job(self, conn, download_id, registro):
+        video_id = registro.get('video_id')
+        if video_id:
+            existente = conn.execute(
+                f"SELECT id FROM jobs WHERE video_id = ? AND status IN ({self._em_andamento_sql})",
+                (video_id,)
+            ).fetchone()
+            if existente:
+                return existente[0]
+        agora = time.time()
+        conn.execute(
+            '''
+            INSERT INTO jobs (id, status, created_at, updated_at, data, video_id, batch_id, client)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''',
+            (
+                download_id, registro['status'], registro.get('queued_at', agora), agora,
+                json.dumps(registro), video_id, registro.get('batch_id'), registro.get('client'),
+            )
+        )
+        return download_id
+    
+    def claim_next(self, max_por_lote=0, de='queued', para='downloading', **campos):
+        # Leitura sem lock primeiro: com a fila vazia, o polling dos executores
+        # não abre transações de escrita
+        vazia = self._conexao().execute("SELECT 1 FROM jobs WHERE status = ? LIMIT 1", (de,)).fetchone() is None
+        if vazia:
+            return None
+        with self._transacao() as conn:
+            linha = conn.execute(
+                '''
+                SELECT id, data FROM jobs AS job
+                WHERE status = ? AND (
+                    ? = 0 OR batch_id IS NULL OR (
+                        SELECT COUNT(*) FROM jobs AS item
+                        WHERE item.batch_id = job.batch_id AND item.status = ?
+                    ) < ?
+                )
+                ORDER BY (
+                    SELECT COUNT(*) FROM jobs AS ativo WHERE ativo.client IS job.client AND ativo.status = ?
+                ), created_at
+                LIMIT 1
+                ''',
+                (de, max_por_lote, para, max_por_lote, para)
+            ).fetchone()
+            if not linha:
+                return None
+            registro = json.loads(linha[1])
+            registro.update(campos, status=para)
+            conn.execute(
+                'UPDATE jobs SET status = ?, updated_at = ?, data = ? WHERE id = ?',
+                (registro['status'], time.time(), json.dumps(registro), linha[0])
+            )
+        return linha[0], registro
+    
+    def requeue(self, download_id, de='downloading', para='queued', **campos):
+        with self._transacao() as conn:
+            linha = conn.execute(
+                "SELECT data FROM jobs WHERE id = ? AND status = ?", (download_id, de)
+            ).fetchone()
+            if not linha:
+                return False
+            registro = json.loads(linha[0])
+            registro.update(campos, status=para)
+            # created_at fica como estava: o job volta para a sua posição na fila
+            conn.execute(
+                'UPDATE jobs SET status = ?, updated_at = ?, data = ? WHERE id = ?',
+                (registro['status'], time.time(), json.dumps(registro), download_id)
+            )
+        return True
+    
+    def queue_positions(self, download_ids):
+        conn = self._conexao()
+        fila = conn.execute("SELECT id, client FROM jobs WHERE status = 'queued' ORDER BY created_at").fetchall()
+        ativos = dict(conn.execute("SELECT client, COUNT(*) FROM jobs WHERE status = 'downloading' GROUP BY client"))
+        return self._posicoes_no_rodizio(fila, ativos, download_ids)
+    
+    def find_by_videos(self, video_ids, statuses):
+        video_ids = list(set(video_ids))
+        if not video_ids:
+            return {}
+        marcadores_video = ','.join('?' * len(video_ids))
+        marcadores = ','.join('?' * len(statuses))
+        linhas = self._conexao().execute(
+            f'''
+            SELECT video_id, id, data FROM jobs
+            WHERE video_id IN ({marcadores_video}) AND status IN ({marcadores})
+            ORDER BY created_at
+            ''',
+            (*video_ids, *statuses)
+        )
+        # Em ordem de criação: o último de cada vídeo é o mais recente
+        return {video_id: (download_id, json.loads(data)) for video_id, download_id, data in linhas}
+    
+    def find_by_video(self, video_id, statuses):
+        marcadores = ','.join('?' * len(statuses))
+        linha = self._conexao().execute(
+            f'''
+            SELECT id, data FROM jobs WHERE video_id = ? AND status IN ({marcadores})
+            ORDER BY created_at DESC LIMIT 1
+            ''',
+            (video_id, *statuses)
+        ).fetchone()
+        return (linha[0], json.loads(linha[1])) if linha else None
+    
+    def purge(self):
+        marcadores = ','.join('?' * len(self.finalizados))
+        with self._transacao() as conn:
+            removidos = 0
+            if self.ttl:
+                removidos += conn.execute(
+                    f'DELETE FROM jobs WHERE status IN ({marcadores}) AND updated_at < ?',
+                    (*self.finalizados, time.time() - self.ttl)
+                ).rowcount
+            if self.max_registros:
+                excesso = conn.execute('SELECT COUNT(*) FROM jobs').fetchone()[0] - self.max_registros
+                if excesso > 0:
+                    removidos += conn.execute(
+                        f'''
+                        DELETE FROM jobs WHERE id IN (
+                            SELECT id FROM jobs WHERE status IN ({marcadores})
+                            ORDER BY updated_at LIMIT ?
+                        )
+                        ''',
+                        (*self.finalizados, excesso)
+                    ).rowcount
+            if removidos:
+                conn.execute(
+                    '''
+                    INSERT INTO counters (name, value) VALUES ('jobs_evicted', ?)
+                    ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+                    ''',
+                    (removidos,)
+                )
+        return removidos
+    
+    def incr(self, nome, valor=1):
+        with self._transacao() as conn:
+            conn.execute(
+                '''
+                INSERT INTO counters (name, value) VALUES (?, ?)
+                ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+                ''',
+                (nome, valor)
+            )
+    
+    def counters(self):
+        return dict(self._conexao().execute('SELECT name, value FROM counters'))
+
+def create_job_store(tipo):
+    """Cria o armazenamento de status configurado em JOB_STORE"""
+    ttl = app.config['JOB_TTL']
+    max_registros = app.config['MAX_TRACKED_JOBS']
+    if tipo == 'memory':
+        return MemoryJobStore(ttl, max_registros)
+    if tipo == 'sqlite':
+        os.makedirs(app.config['STATE_FOLDER'], exist_ok=True)
+        return SQLiteJobStore(os.path.join(app.config['STATE_FOLDER'], 'jobs.sqlite3'), ttl, max_registros)
+    raise ValueError(f'JOB_STORE desconhecido: {tipo}')
+
+# Status dos downloads (compartilhado entre os workers do gunicorn)
+download_status = create_job_store(app.config['JOB_STORE'])
+
+class RateLimiter:
+    """
+    Limite de requisições por cliente (token bucket)
+    
+    Cada chave (tipo de requisição + cliente) tem um balde de até
+    `capacidade` fichas, que voltam continuamente à taxa de `capacidade` a
+    cada `periodo` segundos. Cada requisição gasta `custo` fichas e é
+    recusada se não houver o bastante: rajadas curtas passam e o uso
+    contínuo fica limitado à taxa média. Um balde cheio equivale a um balde
+    inexistente, então só os clientes ativos ocupam espaço.
+    """
+    
+    # Intervalo entre as remoções de baldes cheios
+    intervalo_limpeza = 60
+    
+    def consume(self, chave, capacidade, periodo, custo=1):
+        """
+        Gasta `custo` fichas do balde de `chave`, se houver
+        
+        Returns:
+            tuple: (permitido, fichas restantes, segundos até o balde
+            encher, segundos até haver `custo` fichas; 0 se permitido)
+        """
+        raise NotImplementedError
+    
+    @staticmethod
+    def _gastar(fichas, atualizado, agora, capacidade, periodo, custo):
+        taxa = capacidade / periodo
+        fichas = min(capacidade, fichas + (agora - atualizado) * taxa)
+        permitido = fichas >= custo
+        if permitido:
+            fichas -= custo
+        espera = 0 if permitido else (custo - fichas) / taxa
+        return permitido, fichas, (capacidade - fichas) / taxa, espera
+
+class MemoryRateLimiter(RateLimiter):
+    """Baldes num dict do processo (JOB_STORE=memory: um único processo)"""
+    
+    def __init__(self):
+        self._baldes = {}
+        self._lock = threading.Lock()
+        self._ultima_limpeza = time.time()
+    
+    def consume(self, chave, capacidade, periodo, custo=1):
+        agora = time.time()
+        with self._lock:
+            fichas, atualizado, _ = self._baldes.get(chave, (capacidade, agora, agora))
+            resultado = self._gastar(fichas, atualizado, agora, capacidade, periodo, custo)
+            self._baldes[chave] = (resultado[1], agora, agora + resultado[2])
+            if agora - self._ultima_limpeza > self.intervalo_limpeza:
+                self._ultima_limpeza = agora
+                self._baldes = {c: b for c, b in self._baldes.items() if b[2] > agora}
+        return resultado
+
+class SQLiteRateLimiter(SQLiteDatabase, RateLimiter):
+    """Baldes num arquivo SQLite, compartilhados por todos os workers do gunicorn"""
+    
+    def __init__(self, caminho):
+        self._ultima_limpeza = time.time()
+        super().__init__(caminho)
+    
+    def _criar_esquema(self, conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                full_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS buckets_full_at ON buckets (full_at)')
+    
+    def consume(self, chave, capacidade, periodo, custo=1):
+        with self._transacao() as conn:
+            # Relógio lido dentro da transação: as atualizações de um balde ficam em ordem
+            agora = time.time()
+            linha = conn.execute('SELECT tokens, updated_at FROM buckets WHERE key = ?', (chave,)).fetchone()
+            fichas, atualizado = linha or (capacidade, agora)
+            resultado = self._gastar(fichas, atualizado, agora, capacidade, periodo, custo)
+            conn.execute(
+                '''
+                INSERT INTO buckets (key, tokens, updated_at, full_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    tokens = excluded.tokens, updated_at = excluded.updated_at, full_at = excluded.full_at
+                ''',
+                (chave, resultado[1], agora, agora + resultado[2])
+            )
+            if agora - self._ultima_limpeza > self.intervalo_limpeza:
+                self._ultima_limpeza = agora
+                conn.execute('DELETE FROM buckets WHERE full_at <= ?', (agora,))
+        return resultado
+
+def create_rate_limiter(tipo):
+    """Cria o limitador no mesmo tipo de armazenamento do JOB_STORE"""
+    if tipo == 'memory':
+        return MemoryRateLimiter()
+    os.makedirs(app.config['STATE_FOLDER'], exist_ok=True)
+    return SQLiteRateLimiter(os.path.join(app.config['STATE_FOLDER'], 'ratelimit.sqlite3'))
+
+def _ler_limite(valor):
+    """'N/S' -> (N, S), ou None se não houver limite"""
+    capacidade, _, periodo = valor.partition('/')
+    capacidade = int(capacidade or 0)
+    if capacidade <= 0:
+        return None
+    return capacidade, float(periodo or 60)
+
+# Limites por cliente (compartilhados entre os workers do gunicorn)
+rate_limiter = create_rate_limiter(app.config['JOB_STORE'])
+LIMITES = {
+    'submit': _ler_limite(app.config['RATE_LIMIT_SUBMIT']),
+    'files': _ler_limite(app.config['RATE_LIMIT_FILES']),
+}
+
+class LibraryIndex(SQLiteDatabase):
+    """
+    Índice em disco dos vídeos concluídos
+    
+    Guarda id do vídeo, título, tamanho, duração, formato, hash do conteúdo
+    (SHA-256 e CRC-32) e datas de criação e de último acesso, com os totais
+    mantidos por triggers: `bytes` soma todos os arquivos e `stored_bytes`
+    conta uma vez cada conteúdo (nomes que são hardlinks do mesmo objeto). É
+    atualizado pelo download_worker e pelo delete_file; alterações feitas por
+    fora da aplicação entram na reconciliação, que só percorre a pasta quando
+    o mtime dela muda.
+    """
+    
+    # Chave de ordenação da API -> coluna do índice
+    ordenacoes = {
+        'date': 'created_at',
+        'size': 'size',
+        'title': 'title',
+    }
+    
+    def __init__(self, caminho, pasta):
+        self.pasta = pasta
+        super().__init__(caminho)
+    
+    def _criar_esquema(self, conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                video_id TEXT,
+                title TEXT,
+                duration REAL,
+                format TEXT,
+                sha256 TEXT,
+                crc32 INTEGER
+            )
+        ''')
+        self._adicionar_colunas(conn, 'files', {
+            'video_id': 'TEXT', 'title': 'TEXT', 'duration': 'REAL', 'format': 'TEXT',
+            'sha256': 'TEXT', 'crc32': 'INTEGER',
+        })
+        conn.execute('CREATE INDEX IF NOT EXISTS files_last_access ON files (last_access)')
+        conn.execute('CREATE INDEX IF NOT EXISTS files_created_at ON files (created_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS files_video ON files (video_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS files_size ON files (size)')
+        conn.execute('CREATE INDEX IF NOT EXISTS files_title ON files (title COLLATE NOCASE)')
+        conn.execute('CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256)')
+        self._criar_busca(conn)
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS storage_totals (id INTEGER PRIMARY KEY CHECK (id = 1), '
+            'bytes INTEGER NOT NULL, files INTEGER NOT NULL, stored_bytes INTEGER NOT NULL DEFAULT 0)'
+        )
+        conn.execute('INSERT OR IGNORE INTO storage_totals (id, bytes, files) VALUES (1, 0, 0)')
+        if self._adicionar_colunas(conn, 'storage_totals', {'stored_bytes': 'INTEGER NOT NULL DEFAULT 0'}):
+            # Antes do armazenamento por conteúdo cada arquivo ocupava o próprio espaço
+            conn.execute('UPDATE storage_totals SET stored_bytes = bytes')
+        conn.execute('CREATE TABLE IF NOT EXISTS library_meta (key TEXT PRIMARY KEY, value TEXT)')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS files_insert AFTER INSERT ON files BEGIN
+                UPDATE storage_totals SET bytes = bytes + new.size, files = files + 1;
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS files_delete AFTER DELETE ON files BEGIN
+                UPDATE storage_totals SET bytes = bytes - old.size, files = files - 1;
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS files_update AFTER UPDATE OF size ON files BEGIN
+                UPDATE storage_totals SET bytes = bytes - old.size + new.size;
+            END
+        ''')
+        # Um conteúdo ocupa espaço enquanto houver pelo menos um nome para ele
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS files_stored_insert AFTER INSERT ON files BEGIN
+                UPDATE storage_totals SET stored_bytes = stored_bytes + new.size
+                WHERE new.sha256 IS NULL
+                    OR NOT EXISTS (SELECT 1 FROM files WHERE sha256 = new.sha256 AND rowid != new.rowid);
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS files_stored_delete AFTER DELETE ON files BEGIN
+                UPDATE storage_totals SET stored_bytes = stored_bytes - old.size
+                WHERE old.sha256 IS NULL OR NOT EXISTS (SELECT 1 FROM files WHERE sha256 = old.sha256);
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS files_stored_update AFTER UPDATE OF size, sha256 ON files BEGIN
+                UPDATE storage_totals SET stored_bytes = stored_bytes
+                    - CASE WHEN old.sha256 IS NULL
+                        OR NOT EXISTS (SELECT 1 FROM files WHERE sha256 = old.sha256 AND rowid != old.rowid)
+                        THEN old.size ELSE 0 END
+                    + CASE WHEN new.sha256 IS NULL
+                        OR NOT EXISTS (SELECT 1 FROM files WHERE sha256 = new.sha256 AND rowid != new.rowid)
+                        THEN new.size ELSE 0 END;
+            END
+        ''')
+    
+    def _criar_busca(self, conn):
+        # Índice FTS5 de trigramas sobre o título: busca por trecho sem
+        # varrer a tabela. Os rowids de `files` só mudariam num VACUUM, que a
+        # aplicação não executa.
+        existia = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'files_fts'").fetchone()
+        try:
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS files_fts "
+                "USING fts5(title, content='files', content_rowid='rowid', tokenize='trigram')"
+            )
+        except sqlite3.OperationalError:
+            # SQLite sem FTS5/trigram: a busca cai para uma varredura simples
+            self._fts = False
+            return
+        self._fts = True
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS files_fts_insert AFTER INSERT ON files BEGIN
+                INSERT INTO files_fts (rowid, title) VALUES (new.rowid, new.title);
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS files_fts_delete AFTER DELETE ON files BEGIN
+                INSERT INTO files_fts (files_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS files_fts_update AFTER UPDATE OF title ON files BEGIN
+                INSERT INTO files_fts (files_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+                INSERT INTO files_fts (rowid, title) VALUES (new.rowid, new.title);
+            END
+        ''')
+        if not existia:
+            conn.execute("INSERT INTO files_fts (files_fts) VALUES ('rebuild')")
+    
+    def add(self, filename, video_id=None, title=None, duration=None, formato=None, sha256=None, crc32=None):
+        """Registra (ou atualiza) um vídeo concluído"""
+        try:
+            st = os.stat(os.path.join(self.pasta, filename))
+        except FileNotFoundError:
+            return
+        agora = time.time()
+        with self._transacao() as conn:
+            conn.execute(
+                '''
+                INSERT INTO files (name, size, created_at, last_access, video_id, title, duration, format, sha256, crc32)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    size = excluded.size, created_at = excluded.created_at, last_access = excluded.last_access,
+                    video_id = excluded.video_id, title = excluded.title,
+                    duration = excluded.duration, format = excluded.format,
+                    sha256 = excluded.sha256, crc32 = excluded.crc32
+                ''',
+                (
+                    filename, st.st_size, agora, agora, video_id, title or os.path.splitext(filename)[0],
+                    duration, formato, sha256, crc32,
+                )
+            )
+    
+    def touch(self, *filenames):
+        """Atualiza o último acesso (chamado a cada entrega do arquivo)"""
+        agora = time.time()
+        with self._transacao() as conn:
+            conn.executemany('UPDATE files SET last_access = ? WHERE name = ?', [(agora, f) for f in filenames])
+    
+    def set_crc32(self, filename, crc32, tamanho):
+        """
+        Guarda o CRC-32 calculado depois (vídeos de antes do armazenamento por
+        conteúdo ou copiados para a pasta) e o tamanho a que ele corresponde;
+        crc32=None marca o vídeo para ser calculado de novo
+        """
+        with self._transacao() as conn:
+            conn.execute('UPDATE files SET crc32 = ?, size = ? WHERE name = ?', (crc32, tamanho, filename))
+    
+    def missing_crc32(self, limite):
+        """Nomes dos vídeos ainda sem CRC-32, dos acessados há menos tempo primeiro"""
+        return [nome for (nome,) in self._conexao().execute(
+            'SELECT name FROM files WHERE crc32 IS NULL ORDER BY last_access DESC LIMIT ?',
+            (limite,)
+        )]
+    
+    def remove(self, filename):
+        """Remove o registro; retorna False se ele já não existia"""
+        with self._transacao() as conn:
+            return conn.execute('DELETE FROM files WHERE name = ?', (filename,)).rowcount > 0
+    
+    def get(self, filename):
+        """Registro de um vídeo pelo nome, ou None"""
+        linha = self._conexao().execute(
+            f'SELECT {self._colunas} FROM files WHERE name = ?', (filename,)
+        ).fetchone()
+        return self._como_dict(linha) if linha else None
+    
+    def get_many(self, ids):
+        """Registros pelo 'id' (rowid), na ordem pedida; ids inexistentes são ignorados"""
+        if not ids:
+            return []
+        marcadores = ','.join('?' * len(ids))
+        linhas = self._conexao().execute(
+            f'SELECT {self._colunas} FROM files WHERE rowid IN ({marcadores})', ids
+        )
+        registros = {r['id']: r for r in map(self._como_dict, linhas)}
+        return [registros[i] for i in ids if i in registros]
+    
+    def totals(self):
+        total, arquivos, armazenados = self._conexao().execute(
+            'SELECT bytes, files, stored_bytes FROM storage_totals'
+        ).fetchone()
+        return {'bytes': total, 'files': arquivos, 'stored_bytes': armazenados, 'dedup_saved_bytes': total - armazenados}
+    
+    def search(self, sort='date', descending=True, limit=50, after=None, query=None):
+        """
+        Página de vídeos ordenada por um índice, com paginação por cursor
+        
+        Args:
+            sort: 'date', 'size' ou 'title'
+            descending: Ordem decrescente
+            limit: Máximo de itens
+            after: (valor da ordenação, nome) do último item da página anterior
+            query: Trecho do título (substring pelo índice de trigramas;
+                termos com menos de 3 letras buscam por prefixo)
+        """
+        coluna = self.ordenacoes[sort]
+        if sort == 'title':
+            coluna += ' COLLATE NOCASE'
+        direcao, comparacao = ('DESC', '<') if descending else ('ASC', '>')
+        condicoes, parametros = [], []
+        
+        if query and len(query) >= 3 and self._fts:
+            condicoes.append('rowid IN (SELECT rowid FROM files_fts WHERE files_fts MATCH ?)')
+            parametros.append('"' + query.replace('"', '""') + '"')
+        elif query and len(query) >= 3:
+            condicoes.append('instr(lower(title), lower(?)) > 0')
+            parametros.append(query)
+        elif query:
+            # Intervalo no índice de título (COLLATE NOCASE)
+            condicoes.append('title >= ? COLLATE NOCASE AND title < ? COLLATE NOCASE')
+            parametros += [query, query + '\U0010ffff']
+        
+        if after is not None:
+            valor, nome = after
+            condicoes.append(f'({coluna} {comparacao} ? OR ({coluna} = ? AND name {comparacao} ?))')
+            parametros += [valor, valor, nome]
+        
+        where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+        linhas = self._conexao().execute(
+            f'''
+            SELECT {self._colunas} FROM files
+            {where} ORDER BY {coluna} {direcao}, name {direcao} LIMIT ?
+            ''',
+            (*parametros, limit)
+        )
+        return [self._como_dict(linha) for linha in linhas]
+    
+    def find_by_video(self, video_id):
+        """Arquivo mais recente do vídeo na biblioteca, ou None"""
+        return self.find_by_videos([video_id]).get(video_id)
+    
+    def find_by_videos(self, video_ids):
+        """Arquivo mais recente de cada vídeo na biblioteca: {video_id: nome}"""
+        video_ids = list(set(video_ids))
+        if not video_ids:
+            return {}
+        marcadores = ','.join('?' * len(video_ids))
+        linhas = self._conexao().execute(
+            f'SELECT video_id, name FROM files WHERE video_id IN ({marcadores}) ORDER BY created_at', video_ids
+        )
+        return dict(linhas)
+    
+    def least_recently_used(self, antes_de):
+        """(nome, tamanho, sha256) dos vídeos sem acesso desde `antes_de`, do mais antigo ao mais novo"""
+        return self._conexao().execute(
+            'SELECT name, size, sha256 FROM files WHERE last_access < ? ORDER BY last_access',
+            (antes_de,)
+        ).fetchall()
+    
+    _colunas = 'rowid, name, size, created_at, last_access, video_id, title, duration, format, sha256, crc32'
+    
+    @staticmethod
+    def _como_dict(linha):
+        rowid, nome, tamanho, criado, acesso, video_id, titulo, duracao, formato, sha256, crc32 = linha
+        return {
+            'id': rowid,
+            'filename': nome,
+            'size': tamanho,
+            'created_at': criado,
+            'last_access': acesso,
+            'video_id': video_id,
+            'title': titulo,
+            'duration': duracao,
+            'format': formato,
+            'sha256': sha256,
+            'crc32': crc32,
+        }
+    
+    def reconcile(self, protegidos=()):
+        """
+        Sincroniza o índice com a pasta (arquivos copiados ou apagados por
+        fora da aplicação). Só percorre a pasta se o mtime dela mudou desde a
+        última reconciliação feita por qualquer worker.
+        """
+        mtime = str(os.stat(self.pasta).st_mtime_ns)
+        linha = self._conexao().execute("SELECT value FROM library_meta WHERE key = 'folder_mtime'").fetchone()
+        if linha and linha[0] == mtime:
+            return
+        
+        no_disco = {}
+        with os.scandir(self.pasta) as entradas:
+            for entrada in entradas:
+                if entrada.is_file() and _arquivo_de_video(entrada.name):
+                    no_disco[entrada.name] = entrada.stat()
+        registrados = dict(self._conexao().execute('SELECT name, size FROM files'))
+        
+        with self._transacao() as conn:
+            conn.executemany(
+                '''
+                INSERT OR IGNORE INTO files (name, size, created_at, last_access, title)
+                VALUES (?, ?, ?, ?, ?)
+                ''',
+                [
+                    (nome, st.st_size, st.st_mtime, st.st_mtime, os.path.splitext(nome)[0])
+                    for nome, st in no_disco.items()
+                    if nome not in registrados and nome not in protegidos
+                ]
+            )
+            conn.executemany(
+                'DELETE FROM files WHERE name = ?',
+                [(nome,) for nome in registrados if nome not in no_disco]
+            )
+            # Arquivo trocado por fora: o CRC-32 antigo deixa de valer
+            conn.executemany(
+                'UPDATE files SET size = ?, crc32 = NULL WHERE name = ?',
+                [
+                    (st.st_size, nome) for nome, st in no_disco.items()
+                    if nome in registrados and registrados[nome] != st.st_size
+                ]
+            )
+            conn.execute(
+                "INSERT INTO library_meta (key, value) VALUES ('folder_mtime', ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                (mtime,)
+            )
+
+# Bloco de leitura ao calcular o hash de um arquivo
+BLOCO_HASH = 1024 * 1024
+# Sufixo ' [id]' do nome usado pelo yt-dlp durante o download (ver baixar_video_youtube)
+_SUFIXO_DE_TRABALHO = re.compile(r' \[[\w-]+\](?=\.\w+$)')
+
+def hash_arquivo(caminho):
+    """SHA-256 (hex) e CRC-32 do arquivo, numa única leitura"""
+    sha256 = hashlib.sha256()
+    crc32 = 0
+    buffer = bytearray(BLOCO_HASH)
+    visao = memoryview(buffer)
+    with open(caminho, 'rb') as f:
+        while True:
+            lidos = f.readinto(buffer)
+            if not lidos:
+                break
+            sha256.update(visao[:lidos])
+            crc32 = zlib.crc32(visao[:lidos], crc32)
+    return sha256.hexdigest(), crc32
+
+def nome_pelo_titulo(nome_trabalho):
+    """'Título [id].mp4' -> 'Título.mp4'"""
+    return _SUFIXO_DE_TRABALHO.sub('', nome_trabalho)
+
+class ContentStore:
+    """
+    Armazenamento dos vídeos concluídos por conteúdo
+    
+    Cada conteúdo fica uma única vez em .objects/<xx>/<sha256>, e os nomes
+    visíveis na pasta de downloads (pelo título) são hardlinks para ele:
+    os mesmos bytes baixados de novo (outra estratégia de formato, outro
+    pedido) não ocupam espaço, e vídeos diferentes com o mesmo título
+    ganham nomes distintos ('Título (2).mp4') em vez de se sobrescreverem.
+    
+    Um objeto sem nenhum outro link (st_nlink == 1) não é mais usado e é
+    apagado por liberar() ou pela coleta periódica.
+    """
+    
+    def __init__(self, pasta):
+        self.pasta = pasta
+        self.objetos = os.path.join(pasta, '.objects')
+    
+    def caminho_objeto(self, sha256):
+        return os.path.join(self.objetos, sha256[:2], sha256)
+    
+    def armazenar(self, nome_trabalho, video_id=None):
+        """
+        Move um download concluído para o armazenamento por conteúdo
+        
+        Args:
+            nome_trabalho: Arquivo gravado pelo yt-dlp ('Título [id].mp4')
+            video_id: Id canônico do vídeo; um nome do mesmo vídeo com outro
+                conteúdo (baixado de novo) é substituído em vez de duplicado
+        
+        Returns:
+            tuple: (nome final, sha256, crc32)
+        """
+        caminho = os.path.join(self.pasta, nome_trabalho)
+        sha256, crc32 = hash_arquivo(caminho)
+        objeto = self.caminho_objeto(sha256)
+        os.makedirs(os.path.dirname(objeto), exist_ok=True)
+        try:
+            os.link(caminho, objeto)
+        except FileExistsError:
+            # Os mesmos bytes já estão armazenados: a cópia nova é descartada
+            pass
+        
+        base, ext = os.path.splitext(nome_pelo_titulo(nome_trabalho))
+        for n in itertools.count(1):
+            nome = f'{base}{ext}' if n == 1 else f'{base} ({n}){ext}'
+            destino = os.path.join(self.pasta, nome)
+            if nome == nome_trabalho:
+                # Sem sufixo (job retomado de uma versão anterior): troca pelo link do objeto
+                self._substituir(objeto, destino)
+                break
+            try:
+                os.link(objeto, destino)
+                break
+            except FileExistsError:
+                pass
+            if os.path.samestat(os.stat(destino), os.stat(objeto)):
+                break
+            existente = library.get(nome)
+            if video_id and existente and existente['video_id'] == video_id:
+                self._substituir(objeto, destino)
+                if existente['sha256']:
+                    self.liberar(existente['sha256'])
+                break
+        
+        if nome != nome_trabalho:
+            os.remove(caminho)
+        return nome, sha256, crc32
+    
+    def _substituir(self, objeto, destino):
+        """Aponta `destino` para o objeto de forma atômica"""
+        temporario = os.path.join(self.pasta, f'.link-{uuid.uuid4().hex}')
+        os.link(objeto, temporario)
+        os.replace(temporario, destino)
+    
+    def remover(self, nome, sha256=None):
+        """
+        Apaga um nome da pasta de downloads e, se era o último, o objeto
+        
+        Returns:
+            int: Bytes liberados no disco
+        """
+        caminho = os.path.join(self.pasta, nome)
+        try:
+            st = os.stat(caminho)
+            os.remove(caminho)
+        except FileNotFoundError:
+            return 0
+        if sha256:
+            return self.liberar(sha256)
+        return st.st_size if st.st_nlink == 1 else 0
+    
+    def liberar(self, sha256):
+        """Apaga o objeto se nenhum nome aponta mais para ele; retorna os bytes liberados"""
+        objeto = self.caminho_objeto(sha256)
+        try:
+            st = os.stat(objeto)
+            if st.st_nlink > 1:
+                return 0
+            os.remove(objeto)
+        except FileNotFoundError:
+            return 0
+        return st.st_size
+    
+    def collect_garbage(self, idade_minima):
+        """
+        Apaga objetos sem nenhum nome (vídeos apagados por fora da aplicação)
+        
+        O ctime muda a cada link criado ou removido; objetos mexidos há menos
+        de `idade_minima` segundos ficam para a próxima coleta, para não
+        disputar com um armazenar() em andamento.
+        
+        Returns:
+            int: Bytes liberados
+        """
+        limite = time.time() - idade_minima
+        liberados = 0
+        if not os.path.isdir(self.objetos):
+            return 0
+        for prefixo in os.scandir(self.objetos):
+            if not prefixo.is_dir():
+                continue
+            for entrada in os.scandir(prefixo.path):
+                st = entrada.stat()
+                if st.st_nlink == 1 and st.st_ctime < limite:
+                    try:
+                        os.remove(entrada.path)
+                    except FileNotFoundError:
+                        continue
+                    liberados += st.st_size
+        return liberados
+
+class StorageManager:
+    """
+    Controle de espaço da pasta de downloads
+    
+    Usa o índice da biblioteca (tamanho e último acesso de cada vídeo).
+    Quando o total passa do limite máximo, apaga os vídeos usados há mais
+    tempo até voltar ao limite mínimo. Arquivos de downloads em andamento e
+    vídeos acessados há pouco nunca são apagados.
+    """
+    
+    # Vídeos acessados há menos que isso não são removidos (ex.: tela /ready aberta)
+    idade_minima = 10 * 60
+    # Intervalo entre rodadas da thread de manutenção
+    intervalo = 60
+    # Intervalo entre varreduras de arquivos parciais órfãos
+    intervalo_orfaos = 10 * 60
+    # Tempo máximo por rodada calculando CRC-32 que faltam (exportação ZIP)
+    tempo_crc32 = 30
+    
+    def __init__(self, biblioteca, conteudo, pasta, limite_maximo=0, limite_minimo=0, caminho_lock=None):
+        self.biblioteca = biblioteca
+        self.conteudo = conteudo
+        self.pasta = pasta
+        self._limite_maximo = limite_maximo
+        self._limite_minimo = limite_minimo
+        self.caminho_lock = caminho_lock
+        self._trava = None
+        self._pid = None
+    
+    @property
+    def limite_maximo(self):
+        """Limite em bytes; se não configurado, 80% da capacidade do volume"""
+        if self._limite_maximo:
+            return self._limite_maximo
+        return int(shutil.disk_usage(self.pasta).total * 0.8)
+    
+    @property
+    def limite_minimo(self):
+        return self._limite_minimo or int(self.limite_maximo * 0.9)
+    
+    def stats(self):
+        totais = self.biblioteca.totals()
+        totais['high_water'] = self.limite_maximo
+        totais['low_water'] = self.limite_minimo
+        return totais
+    
+    def protected_files(self):
+        """Arquivos ligados a downloads que ainda não terminaram"""
+        protegidos = set()
+        for registro in download_status.list_by_status(JobStore.em_andamento).values():
+            for campo in ('filename', 'expected_filename', 'source_filename'):
+                if registro.get(campo):
+                    protegidos.add(registro[campo])
+        return protegidos
+    
+    def evict_if_needed(self):
+        """
+        Apaga os vídeos usados há mais tempo enquanto o total estiver acima
+        do limite mínimo, se o limite máximo tiver sido ultrapassado
+        
+        Returns:
+            list: Nomes dos arquivos removidos
+        """
+        # Espaço realmente ocupado: conteúdos repetidos contam uma vez
+        total = self.biblioteca.totals()['stored_bytes']
+        if total <= self.limite_maximo:
+            return []
+        
+        alvo = self.limite_minimo
+        protegidos = self.protected_files()
+        removidos = []
+        for filename, tamanho, sha256 in self.biblioteca.least_recently_used(time.time() - self.idade_minima):
+            if total <= alvo:
+                break
+            if filename in protegidos:
+                continue
+            # Apagar o registro primeiro: se outro worker estiver removendo o
+            # mesmo arquivo, só um deles segue adiante
+            if not self.biblioteca.remove(filename):
+                continue
+            # Um nome que compartilha o conteúdo com outro não libera espaço
+            total -= self.conteudo.remover(filename, sha256)
+            removidos.append(filename)
+        if removidos:
+            app.logger.info('Espaço em disco: %d vídeo(s) removido(s) por LRU', len(removidos))
+        return removidos
+    
+    def collect_orphans(self):
+        """
+        Apaga arquivos parciais que não pertencem a nenhum job da fila ou em
+        andamento (ex.: downloads que falharam ou foram descartados)
+        
+        Os parciais de jobs ainda no journal ficam: o yt-dlp continua deles
+        quando o job for retomado.
+        
+        Returns:
+            list: Nomes dos arquivos removidos
+        """
+        prefixos = tuple(os.path.splitext(nome)[0] + '.' for nome in self.protected_files())
+        limite = time.time() - self.idade_minima
+        removidos = []
+        with os.scandir(self.pasta) as entradas:
+            for entrada in entradas:
+                nome = entrada.name
+                if nome.startswith('.') or not _arquivo_parcial(nome) or not entrada.is_file():
+                    continue
+                if (prefixos and nome.startswith(prefixos)) or entrada.stat().st_mtime > limite:
+                    continue
+                try:
+                    os.remove(entrada.path)
+                except FileNotFoundError:
+                    continue
+                removidos.append(nome)
+        if removidos:
+            app.logger.info('Arquivos parciais órfãos removidos: %d', len(removidos))
+        liberados = self.conteudo.collect_garbage(self.idade_minima)
+        if liberados:
+            app.logger.info('Conteúdos sem nenhum nome removidos: %s', _formatar_bytes(liberados))
+        return removidos
+    
+    def fill_crc32(self):
+        """
+        Calcula o CRC-32 dos vídeos que ainda não o têm no índice, para que
+        /export.zip não precise ler arquivos inteiros durante a requisição.
+        Para depois de `tempo_crc32` segundos; o resto fica para a próxima rodada.
+        
+        Returns:
+            int: Quantidade de vídeos indexados
+        """
+        fim = time.monotonic() + self.tempo_crc32
+        protegidos = self.protected_files()
+        indexados = 0
+        for filename in self.biblioteca.missing_crc32(100):
+            if time.monotonic() >= fim:
+                break
+            if filename in protegidos:
+                continue
+            caminho = os.path.join(self.pasta, filename)
+            try:
+                tamanho = os.path.getsize(caminho)
+                _, crc32 = hash_arquivo(caminho)
+                if os.path.getsize(caminho) != tamanho:
+                    continue  # Ainda sendo escrito: fica para a próxima rodada
+            except FileNotFoundError:
+                continue
+            self.biblioteca.set_crc32(filename, crc32, tamanho)
+            indexados += 1
+        return indexados
+    
+    def ensure_running(self):
+        """
+        Inicia a thread de manutenção (uma por processo, após o fork do
+        gunicorn); só a do processo que obtiver o lock faz as rodadas
+        """
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        thread = threading.Thread(target=self._loop, name='storage-manager')
+        thread.daemon = True
+        thread.start()
+    
+    def _travar(self):
+        """Bloqueia até este processo ser o único a fazer a manutenção; retorna o arquivo do lock"""
+        if not self.caminho_lock or not fcntl:
+            return None
+        arquivo = open(self.caminho_lock, 'a')
+        # O lock é liberado pelo sistema quando o processo termina
+        fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX)
+        return arquivo
+    
+    def _loop(self):
+        # Um processo só (entre workers e containers): os demais esperam o
+        # lock, sem repetir a leitura dos mesmos arquivos no fill_crc32()
+        self._trava = self._travar()
+        proxima_coleta = 0
+        while True:
+            try:
+                self.biblioteca.reconcile(self.protected_files())
+                self.evict_if_needed()
+                self.fill_crc32()
+                if time.time() >= proxima_coleta:
+                    self.collect_orphans()
+                    proxima_coleta = time.time() + self.intervalo_orfaos
+            except Exception as e:
+                app.logger.warning('Falha na manutenção da pasta de downloads: %s', e)
+            time.sleep(self.intervalo)
+
+# Streams de um formato 'vídeo+áudio' antes do merge ('X.f137.mp4') e saída
+# temporária do ffmpeg ('X.temp.mp4')
+_PARTE_DE_FORMATO = re.compile(r'\.(f\d[\w-]*|temp)\.\w+$')
+
+def _arquivo_parcial(filename):
+    """Arquivo intermediário do yt-dlp/ffmpeg (.part, fragmentos, .ytdl...)"""
+    return (
+        filename.endswith(('.part', '.ytdl', '.temp'))
+        or '.part-Frag' in filename
+        or _PARTE_DE_FORMATO.search(filename) is not None
+    )
+
+def _arquivo_de_video(filename):
+    """Ignora arquivos internos e temporários do yt-dlp/ffmpeg"""
+    return not filename.startswith('.') and not _arquivo_parcial(filename)
+
+os.makedirs(app.config['STATE_FOLDER'], exist_ok=True)
+library = LibraryIndex(os.path.join(app.config['STATE_FOLDER'], 'library.sqlite3'), app.config['DOWNLOAD_FOLDER'])
+conteudo = ContentStore(app.config['DOWNLOAD_FOLDER'])
+storage = StorageManager(
+    library,
+    conteudo,
+    app.config['DOWNLOAD_FOLDER'],
+    app.config['STORAGE_HIGH_WATER'],
+    app.config['STORAGE_LOW_WATER'],
+    caminho_lock=os.path.join(app.config['STATE_FOLDER'], 'storage.lock'),
+)
+
+# Extratores do yt-dlp usados pela aplicação (vídeos, playlists e canais).
+# Os demais (~1800) nunca são carregados.
+EXTRATORES = ['Youtube', 'YoutubeTab', 'YoutubePlaylist']
+
+_yt_dlp = None
+_yt_dlp_lock = threading.Lock()
+
+def carregar_yt_dlp():
+    """
+    Importa o yt-dlp na primeira utilização
+    
+    Requisições que só listam ou entregam vídeos não pagam o custo da
+    importação; o primeiro download (ou o preload) paga uma vez por processo.
+    """
+    global _yt_dlp
+    if _yt_dlp is None:
+        with _yt_dlp_lock:
+            if _yt_dlp is None:
+                import yt_dlp
+                _yt_dlp = yt_dlp
+    return _yt_dlp
+
+def criar_ydl(opcoes):
+    """YoutubeDL registrando só os extratores de EXTRATORES"""
+    yt_dlp = carregar_yt_dlp()
+    ydl = yt_dlp.YoutubeDL(opcoes, auto_init=False)
+    for nome in EXTRATORES:
+        ydl.get_info_extractor(nome)
+    return ydl
+
+def preload_yt_dlp():
+    """Carrega o yt-dlp e os módulos reais dos extratores (ex.: no mestre do gunicorn)"""
+    with criar_ydl({'quiet': True}):
+        pass
+
+def canonical_video_id(url):
+    """
+    Normaliza a URL para o id do vídeo usado pelo extrator do yt-dlp
+    
+    `youtu.be/X`, `watch?v=X&t=30` e `shorts/X` viram todos 'youtube:X'.
+    
+    Returns:
+        str: Id canônico ou None se a URL não for de um vídeo reconhecido
+    """
+    extrator = carregar_yt_dlp().extractor.get_info_extractor('Youtube')
+    # _match_valid_url e não suitable(): 'watch?v=X&list=Y' é o vídeo X
+    # (baixado com noplaylist), não a playlist
+    encontrado = extrator._match_valid_url(url)
+    if encontrado is None:
+        return None
+    return f"youtube:{encontrado.group('id')}"
+
+def is_batch_url(url):
+    """Se a URL é de uma playlist ou canal do YouTube (e não de um vídeo)"""
+    if canonical_video_id(url) is not None:
+        return False
+    extratores = carregar_yt_dlp().extractor
+    return any(extratores.get_info_extractor(nome).suitable(url) for nome in ('YoutubeTab', 'YoutubePlaylist'))
+
+def find_cached_download(video_id):
+    """Id de um download já concluído desse vídeo cujo arquivo ainda existe, ou None"""
+    return find_cached_downloads([video_id]).get(video_id)
+
+def find_cached_downloads(video_ids):
+    """
+    find_cached_download() de vários vídeos, com uma consulta ao armazenamento
+    de status e outra à biblioteca
+    
+    Returns:
+        dict: {video_id: id do download concluído} dos vídeos disponíveis
+    """
+    pasta = app.config['DOWNLOAD_FOLDER']
+    encontrados = {}
+    for video_id, (download_id, registro) in download_status.find_by_videos(video_ids, ('completed',)).items():
+        if os.path.isfile(os.path.join(pasta, registro.get('filename', ''))):
+            encontrados[video_id] = download_id
+    
+    # O job pode ter expirado (JOB_TTL) com o vídeo ainda na biblioteca
+    faltando = [v for v in video_ids if v not in encontrados]
+    novos = {}
+    for video_id, filename in library.find_by_videos(faltando).items():
+        if not os.path.isfile(os.path.join(pasta, filename)):
+            continue
+        download_id = str(uuid.uuid4())
+        novos[download_id] = {
+            'status': 'completed',
+            'message': 'Vídeo já disponível',
+            'queued_at': time.time(),
+            'video_id': video_id,
+            'filename': filename,
+        }
+        encontrados[video_id] = download_id
+    if novos:
+        download_status.set_many(novos)
+    return encontrados
+
+# Perfis de desempenho dos downloads:
+#   fragmentos: fragmentos DASH/HLS baixados ao mesmo tempo por stream
+#   streams_paralelos: baixa vídeo e áudio ao mesmo tempo antes do merge
+#   http_chunk_size: tamanho das requisições Range (o YouTube limita a
+#     velocidade de respostas longas; pedaços de 10 MiB evitam isso)
+#   buffersize: bloco inicial de leitura (o yt-dlp começa em 1 KiB e cresce)
+PERFIS_DOWNLOAD = {
+    'default': {'fragmentos': 1, 'streams_paralelos': False, 'http_chunk_size': None, 'buffersize': None},
+    'fast': {'fragmentos': 4, 'streams_paralelos': True, 'http_chunk_size': 10 * 1024 * 1024, 'buffersize': 64 * 1024},
+}
+
+def perfil_download(nome=None):
+    """
+    Opções do yt-dlp para o perfil de desempenho configurado
+    
+    Os fragmentos por stream são limitados para que, com todos os
+    MAX_DOWNLOAD_WORKERS ocupados, o total de conexões não passe de
+    MAX_DOWNLOAD_CONNECTIONS.
+    
+    Returns:
+        tuple: (opções do yt-dlp, se os streams devem ser baixados em paralelo)
+    """
+    nome = nome or app.config['DOWNLOAD_PROFILE']
+    if nome not in PERFIS_DOWNLOAD:
+        raise ValueError(f'DOWNLOAD_PROFILE desconhecido: {nome}')
+    perfil = PERFIS_DOWNLOAD[nome]
+    streams = 2 if perfil['streams_paralelos'] else 1
+    por_job = app.config['MAX_DOWNLOAD_CONNECTIONS'] // (app.config['MAX_DOWNLOAD_WORKERS'] * streams)
+    fragmentos = max(1, min(app.config['DOWNLOAD_FRAGMENTS'] or perfil['fragmentos'], por_job))
+    
+    opcoes = {'concurrent_fragment_downloads': fragmentos}
+    if perfil['http_chunk_size']:
+        opcoes['http_chunk_size'] = perfil['http_chunk_size']
+    if perfil['buffersize']:
+        opcoes['buffersize'] = perfil['buffersize']
+    return opcoes, perfil['streams_paralelos']
+
+class DownloadsParalelos:
+    """
+    Baixa ao mesmo tempo os streams de um formato 'vídeo+áudio'
+    
+    O yt-dlp chama `dl()` para cada stream em sequência e só depois roda o
+    merge. Aqui cada stream da junção (arquivo '<nome>.f<format_id>.<ext>')
+    começa numa thread e `post_process()` espera todos terminarem antes de
+    entregar os arquivos ao merge.
+    """
+    
+    def __init__(self, ydl):
+        self._dl = ydl.dl
+        self._post_process = ydl.post_process
+        self._pendentes = []
+        ydl.dl = self.dl
+        ydl.post_process = self.post_process
+    
+    def dl(self, name, info, subtitle=False, test=False):
+        parte = f".f{info.get('format_id')}."
+        if subtitle or test or parte not in os.path.basename(name):
+            return self._dl(name, info, subtitle=subtitle, test=test)
+        pendente = {'erro': None, 'sucesso': False}
+        
+        def baixar():
+            try:
+                pendente['sucesso'] = self._dl(name, info)[0]
+            except BaseException as e:
+                pendente['erro'] = e
+        
+        pendente['thread'] = threading.Thread(target=baixar, name=f'stream-{info.get("format_id")}', daemon=True)
+        pendente['thread'].start()
+        self._pendentes.append(pendente)
+        return True, True
+    
+    def aguardar(self):
+        """Espera os streams em andamento; propaga a primeira falha"""
+        pendentes, self._pendentes = self._pendentes, []
+        for pendente in pendentes:
+            pendente['thread'].join()
+        for pendente in pendentes:
+            if pendente['erro'] is not None:
+                raise pendente['erro']
+            if not pendente['sucesso']:
+                raise carregar_yt_dlp().utils.DownloadError('Falha ao baixar um dos streams do vídeo')
+    
+    def post_process(self, *args, **kwargs):
+        self.aguardar()
+        return self._post_process(*args, **kwargs)
+
+# Modo streaming: o ffmpeg baixa e junta os streams gravando MP4 fragmentado,
+# que só cresce no fim do arquivo e já pode ser reproduzido desde o começo
+FORMATO_STREAMING = 'bv*[ext=mp4]+ba[ext=m4a]/b[ext=mp4]'
+OPCOES_STREAMING = {
+    'external_downloader': {'default': 'ffmpeg'},
+    'external_downloader_args': {'ffmpeg_o': ['-movflags', '+frag_keyframe+empty_moov+default_base_moof']},
+}
+
+# Perfis de saída escolhidos pelo usuário:
+#   formato: seletor do yt-dlp com só os streams necessários (None = melhor vídeo)
+#   ext: extensão do arquivo entregue (None = a do download)
+#   ffmpeg: argumentos da conversão feita depois do download (None = sem conversão)
+#   aceita: extensões baixadas que já servem sem conversão
+PERFIS_SAIDA = {
+    'video': {
+        'nome': 'Vídeo (melhor qualidade)', 'formato': None, 'ext': None, 'ffmpeg': None, 'aceita': (),
+    },
+    '480p': {
+        'nome': 'Vídeo até 480p', 'formato': 'bv*[height<=480]+ba/b[height<=480]/wv*+ba/w',
+        'ext': None, 'ffmpeg': None, 'aceita': (),
+    },
+    '480p-leve': {
+        'nome': 'Vídeo 480p compacto (~1 Mbps)', 'formato': 'bv*[height<=480]+ba/b[height<=480]/wv*+ba/w',
+        'ext': 'mp4', 'aceita': (),
+        'ffmpeg': [
+            '-vf', 'scale=-2:min(480\\,ih)', '-c:v', 'libx264', '-preset', 'veryfast',
+            '-b:v', '800k', '-maxrate', '1000k', '-bufsize', '2000k',
+            '-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart',
+        ],
+    },
+    'm4a': {
+        'nome': 'Áudio M4A', 'formato': 'bestaudio[ext=m4a]/bestaudio/best',
+        'ext': 'm4a', 'ffmpeg': ['-vn', '-c:a', 'aac', '-b:a', '160k'], 'aceita': ('m4a',),
+    },
+    'mp3': {
+        'nome': 'Áudio MP3', 'formato': 'bestaudio/best',
+        'ext': 'mp3', 'ffmpeg': ['-vn', '-c:a', 'libmp3lame', '-b:a', '192k'], 'aceita': ('mp3',),
+    },
+}
+PERFIL_PADRAO = 'video'
 
-def baixar_video_youtube(url, pasta_destino='downloads'):
+def chave_do_video(video_id, perfil=PERFIL_PADRAO):
+    """
+    Chave de cache e de deduplicação de um vídeo num perfil de saída: o MP3
+    de um vídeo não serve para quem pediu o vídeo, e vice-versa
+    """
+    if video_id is None or perfil == PERFIL_PADRAO:
+        return video_id
+    return f'{video_id}/{perfil}'
+
+def baixar_video_youtube(url, pasta_destino='downloads', progresso=None, formato_anterior=None, streaming=False,
+                         perfil=PERFIL_PADRAO):
     """
     Baixa um vídeo do YouTube
     
     Args:
         url: URL do vídeo do YouTube
         pasta_destino: Pasta onde o vídeo será salvo
+        progresso: ProgressReporter opcional que recebe os hooks do yt-dlp
+        formato_anterior: Formato escolhido numa execução interrompida (ex.: '137+140'),
+            tentado antes dos demais para continuar dos arquivos .part
+        streaming: Grava o arquivo de forma que /stream possa entregá-lo
+            enquanto ele é baixado (ver FORMATO_STREAMING)
+        perfil: Perfil de saída (PERFIS_SAIDA); o seletor dele é tentado
+            antes de 'best' e 'worst'. A conversão fica para executar_conversao()
     
     Returns:
-        dict: Informações do vídeo baixado ou None em caso de erro
+        dict: Informações do vídeo baixado ou None em caso de erro; em
+        'metrics', os tempos de cada etapa e o resultado de cada estratégia
     """
+    yt_dlp = carregar_yt_dlp()
+    medicoes = {'strategies': []}
+    
     # Criar pasta de destino se não existir
     if not os.path.exists(pasta_destino):
         os.makedirs(pasta_destino)
     
     # Estratégias de formato para tentar (em ordem de preferência)
+    formato = PERFIS_SAIDA[perfil]['formato']
     estrategias_formato = [
-        'bestvideo+bestaudio/best',  # Vídeo + áudio separados
+        formato or 'bestvideo+bestaudio/best',  # Vídeo + áudio separados (ou o do perfil)
         'best',  # Melhor formato único
         'worst',  # Qualquer formato disponível
     ]
+    if streaming:
+        estrategias_formato.insert(0, FORMATO_STREAMING)
+    retomado = None
+    if formato_anterior and formato_anterior not in estrategias_formato:
+        retomado = formato_anterior
+        estrategias_formato.insert(0, formato_anterior)
+    
+    opcoes_desempenho, streams_paralelos = perfil_download()
     
     # Opções base
     opcoes_base = {
-        'outtmpl': os.path.join(pasta_destino, '%(title)s.%(ext)s'),
+        **opcoes_desempenho,
+        # Nome único por vídeo e perfil enquanto baixa; ContentStore.armazenar() dá o nome final pelo título
+        'outtmpl': os.path.join(
+            pasta_destino,
+            '%(title)s [%(id)s].%(ext)s' if perfil == PERFIL_PADRAO else f'%(title)s [%(id)s-{perfil}].%(ext)s',
+        ),
         'quiet': True,
         'no_warnings': False,
         'ignoreerrors': False,
+        # Só o vídeo, mesmo que a URL tenha '&list=' (playlists viram lotes)
+        'noplaylist': True,
+        # Continuar de arquivos .part deixados por uma execução interrompida
+        'continuedl': True,
         # Opções para contornar problemas do YouTube
         'extractor_args': {
             'youtube': {
@@ -51,279 +1974,978 @@ def baixar_video_youtube(url, pasta_destino='downloads'):
             }
         },
     }
+    def medir_merge(d):
+        if d.get('postprocessor') != 'Merger':
+            return
+        if d['status'] == 'started':
+            medicoes['_inicio_merge'] = time.perf_counter()
+        elif d['status'] == 'finished' and '_inicio_merge' in medicoes:
+            medicoes['merge_seconds'] = time.perf_counter() - medicoes.pop('_inicio_merge')
+    
+    opcoes_base['postprocessor_hooks'] = [medir_merge]
+    if progresso is not None:
+        opcoes_base['progress_hooks'] = [progresso.download_hook]
+        opcoes_base['postprocessor_hooks'].append(progresso.postprocessor_hook)
+    
+    # Extrair as informações do vídeo uma única vez; as estratégias de
+    # formato abaixo reaproveitam esse resultado e só repetem o download
+    inicio = time.perf_counter()
+    try:
+        with criar_ydl(opcoes_base) as ydl:
+            info_extraida = ydl.extract_info(url, download=False, process=False)
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e),
+            'metrics': medicoes,
+        }
+    medicoes['extract_seconds'] = time.perf_counter() - inicio
     
     # Tentar cada estratégia de formato
     for i, formato in enumerate(estrategias_formato, 1):
+        # O formato retomado varia por vídeo; agrupado para não multiplicar as séries
+        estrategia = 'retomado' if formato == retomado else formato
+        inicio = time.perf_counter()
+        medicoes.pop('merge_seconds', None)
         opcoes = opcoes_base.copy()
         opcoes['format'] = formato
+        if streaming:
+            opcoes.update(OPCOES_STREAMING)
         
-        # Adicionar merge apenas para primeira estratégia
-        if i == 1:
+        # Adicionar merge apenas para formatos com vídeo e áudio separados
+        if '+' in formato:
             opcoes['merge_output_format'] = 'mp4'
         
         try:
-            with yt_dlp.YoutubeDL(opcoes) as ydl:
-                info = ydl.extract_info(url, download=True)
+            with criar_ydl(opcoes) as ydl:
+                # No streaming o ffmpeg já baixa vídeo e áudio juntos
+                paralelos = None
+                if streams_paralelos and '+' in formato and not streaming:
+                    paralelos = DownloadsParalelos(ydl)
+                if progresso is not None:
+                    progresso.acompanhar(ydl)
+                try:
+                    # process_ie_result altera o dict recebido, então cada tentativa usa uma cópia
+                    info = ydl.process_ie_result(copy.deepcopy(info_extraida), download=True)
+                finally:
+                    # Se o yt-dlp parou antes do merge, não deixa streams soltos
+                    if paralelos is not None:
+                        paralelos.aguardar()
+                medicoes['strategies'].append([estrategia, 'completed'])
+                medicoes['download_seconds'] = time.perf_counter() - inicio - medicoes.get('merge_seconds', 0)
                 return {
                     'success': True,
                     'title': info.get('title', 'Sem título'),
-                    'filename': os.path.basename(ydl.prepare_filename(info))
+                    'filename': os.path.basename(ydl.prepare_filename(info)),
+                    'video_id': f"{info.get('extractor_key', '').lower()}:{info.get('id')}",
+                    'duration': info.get('duration'),
+                    'format': info.get('format'),
+                    'metrics': medicoes,
                 }
             
         except yt_dlp.utils.DownloadError as e:
+            medicoes['strategies'].append([estrategia, 'error'])
             if i < len(estrategias_formato):
                 continue
             else:
                 return {
                     'success': False,
-                    'error': str(e)
+                    'error': str(e),
+                    'metrics': medicoes,
                 }
         except Exception as e:
+            medicoes['strategies'].append([estrategia, 'error'])
             if i < len(estrategias_formato):
                 continue
             else:
                 return {
                     'success': False,
-                    'error': str(e)
+                    'error': str(e),
+                    'metrics': medicoes,
                 }
     
     return {
         'success': False,
-        'error': 'Todas as estratégias de download falharam'
+        'error': 'Todas as estratégias de download falharam',
+        'metrics': medicoes,
     }
 
-def download_worker(url, download_id):
-    """Worker thread para download assíncrono"""
-    download_status[download_id] = {'status': 'downloading', 'message': 'Iniciando download...'}
-    result = baixar_video_youtube(url, app.config['DOWNLOAD_FOLDER'])
-    
-    if result['success']:
-        download_status[download_id] = {
-            'status': 'completed',
-            'message': f"Download concluído: {result['title']}",
-            'filename': result['filename']
-        }
-    else:
-        download_status[download_id] = {
-            'status': 'error',
-            'message': f"Erro: {result.get('error', 'Erro desconhecido')}"
-        }
+def _formatar_bytes(valor):
+    for unidade in ('B', 'KiB', 'MiB', 'GiB'):
+        if valor < 1024 or unidade == 'GiB':
+            return f'{valor:.1f} {unidade}'
+        valor /= 1024
 
-HTML_TEMPLATE = '''
-<!DOCTYPE html>
-<html lang="pt-BR">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Baixador de Videos do Mozão</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #ffeef5 0%, #ffd6e8 100%);
-            min-height: 100vh;
-            padding: 20px;
-        }
-        
-        .container {
-            max-width: 900px;
-            margin: 0 auto;
-            background: white;
-            border-radius: 20px;
-            box-shadow: 0 10px 40px rgba(255, 105, 180, 0.2);
-            padding: 40px;
-            margin-top: 20px;
-        }
-        
-        h1 {
-            color: #ff69b4;
-            text-align: center;
-            font-size: 2.5em;
-            margin-bottom: 10px;
-            text-shadow: 2px 2px 4px rgba(255, 105, 180, 0.2);
-        }
-        
-        .subtitle {
-            text-align: center;
-            color: #d63384;
-            font-size: 1.1em;
-            margin-bottom: 30px;
-            font-style: italic;
-        }
-        
-        .form-group {
-            margin-bottom: 25px;
-        }
-        
-        label {
-            display: block;
-            color: #c2185b;
-            font-weight: bold;
-            margin-bottom: 8px;
-            font-size: 1.1em;
-        }
-        
-        input[type="text"] {
-            width: 100%;
-            padding: 15px;
-            border: 2px solid #ffb3d9;
-            border-radius: 10px;
-            font-size: 1em;
-            transition: border-color 0.3s;
-        }
-        
-        input[type="text"]:focus {
-            outline: none;
-            border-color: #ff69b4;
-            box-shadow: 0 0 10px rgba(255, 105, 180, 0.3);
-        }
-        
-        .btn {
-            background: linear-gradient(135deg, #ff69b4 0%, #ff1493 100%);
-            color: white;
-            padding: 15px 30px;
-            border: none;
-            border-radius: 10px;
-            font-size: 1.1em;
-            font-weight: bold;
-            cursor: pointer;
-            transition: transform 0.2s, box-shadow 0.2s;
-            width: 100%;
-            margin-top: 15px;
-        }
-        
-        .btn-container .btn {
-            margin-top: 0;
-        }
-        
-        .btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 5px 20px rgba(255, 105, 180, 0.4);
-        }
-        
-        .btn:active {
-            transform: translateY(0);
-        }
-        
-        .btn-secondary {
-            background: linear-gradient(135deg, #ffb3d9 0%, #ff91c4 100%);
-            display: block;
-            text-align: center;
-            text-decoration: none;
-        }
-        
-        form {
-            margin-bottom: 0;
-        }
-        
-        .btn-container {
-            display: flex;
-            flex-direction: column;
-            gap: 15px;
-            margin-top: 15px;
-        }
-        
-        .alert {
-            padding: 15px;
-            border-radius: 10px;
-            margin-bottom: 20px;
-        }
-        
-        .alert-success {
-            background-color: #d4edda;
-            border: 2px solid #c3e6cb;
-            color: #155724;
-        }
-        
-        .alert-error {
-            background-color: #f8d7da;
-            border: 2px solid #f5c6cb;
-            color: #721c24;
-        }
+class ProgressReporter:
+    """
+    Converte os hooks do yt-dlp em atualizações do status do job
+    
+    As gravações no armazenamento são limitadas a uma a cada `intervalo`
+    segundos; mudanças de fase (download → merge) são gravadas na hora.
+    """
+    
+    intervalo = 0.5
+    
+    def __init__(self, download_id):
+        self.download_id = download_id
+        self._ultima_gravacao = 0
+        self._fase = None
+        # Situação de cada stream (vídeo, áudio), que podem baixar ao mesmo tempo
+        self._streams = {}
+        self._lock = threading.Lock()
+    
+    def download_hook(self, d):
+        if d['status'] not in ('downloading', 'finished'):
+            return
+        with self._lock:
+            baixados_stream = d.get('downloaded_bytes') or 0
+            if d['status'] == 'finished':
+                baixados_stream = baixados_stream or d.get('total_bytes') or 0
+            self._streams[d.get('filename')] = {
+                'baixados': baixados_stream,
+                'total': d.get('total_bytes') or d.get('total_bytes_estimate') or baixados_stream,
+                'velocidade': d.get('speed') if d['status'] == 'downloading' else None,
+                'eta': d.get('eta') if d['status'] == 'downloading' else None,
+            }
+            if d['status'] != 'downloading':
+                return
+            streams = list(self._streams.values())
+            baixados = sum(s['baixados'] for s in streams)
+            total = sum(s['total'] for s in streams)
+            velocidades = [s['velocidade'] for s in streams if s['velocidade']]
+            etas = [s['eta'] for s in streams if s['eta'] is not None]
+            
+            progresso = {
+                'phase': 'download',
+                'downloaded_bytes': baixados,
+                'total_bytes': total or None,
+                'speed': sum(velocidades) if velocidades else None,
+                'eta': max(etas) if etas else None,
+            }
+            mensagem = f'Baixando: {_formatar_bytes(baixados)}'
+            if progresso['total_bytes']:
+                progresso['percent'] = round(100 * baixados / progresso['total_bytes'], 1)
+                mensagem = f"Baixando: {progresso['percent']}% de {_formatar_bytes(progresso['total_bytes'])}"
+            if progresso['speed']:
+                mensagem += f" a {_formatar_bytes(progresso['speed'])}/s"
+            self._publicar(progresso, mensagem)
+    
+    def acompanhar(self, ydl):
+        """
+        Registra no journal o formato escolhido e o arquivo final antes de o
+        download começar, para que um job interrompido seja retomado a
+        partir dos mesmos arquivos .part
+        """
+        processar = ydl.process_info
         
-        .alert-info {
-            background-color: #d1ecf1;
-            border: 2px solid #bee5eb;
-            color: #0c5460;
-        }
+        def process_info(info_dict):
+            download_status.update(
+                self.download_id,
+                format_id=info_dict.get('format_id'),
+                expected_filename=os.path.basename(ydl.prepare_filename(info_dict)),
+            )
+            return processar(info_dict)
         
-        .videos-list {
-            margin-top: 30px;
+        ydl.process_info = process_info
+    
+    def postprocessor_hook(self, d):
+        if d['status'] != 'started':
+            return
+        with self._lock:
+            baixados = sum(s['baixados'] for s in self._streams.values())
+            if d.get('postprocessor') == 'Merger':
+                self._publicar({'phase': 'merge', 'downloaded_bytes': baixados}, 'Juntando áudio e vídeo...')
+            else:
+                self._publicar({'phase': 'postprocess', 'downloaded_bytes': baixados}, 'Finalizando o arquivo...')
+    
+    def _publicar(self, progresso, mensagem):
+        agora = time.time()
+        if progresso['phase'] == self._fase and agora - self._ultima_gravacao < self.intervalo:
+            return
+        self._fase = progresso['phase']
+        self._ultima_gravacao = agora
+        download_status.update(self.download_id, progress=progresso, message=mensagem)
+
+def resolver_lote(url, download_id, perfil=PERFIL_PADRAO, cliente=None):
+    """
+    Lista os vídeos de uma playlist/canal (extração "flat", sem visitar
+    cada vídeo) e cria um job por vídeo, ligado ao lote por 'batch_id'
+    
+    Os itens herdam o perfil de saída e o cliente do lote. Vídeos já na biblioteca
+    nesse perfil não são baixados de novo, e os que já estão na fila ou
+    baixando por outro pedido entram no lote como estão.
+    """
+    opcoes = {
+        'quiet': True,
+        'extract_flat': 'in_playlist',
+        'playlistend': app.config['MAX_BATCH_SIZE'],
+    }
+    try:
+        with criar_ydl(opcoes) as ydl:
+            info = ydl.extract_info(url, download=False)
+    except Exception as e:
+        download_status.update(download_id, status='error', message=f'Erro: {str(e)}')
+        return
+    
+    itens = []
+    pulados = 0
+    vistos = set()
+    for entrada in info.get('entries') or []:
+        video_id = canonical_video_id((entrada or {}).get('url') or '')
+        if video_id is None or video_id in vistos:
+            continue
+        video_id = chave_do_video(video_id, perfil)
+        vistos.add(video_id)
+        existente = find_cached_download(video_id)
+        if existente:
+            itens.append(existente)
+            pulados += 1
+            continue
+        item = {
+            'status': 'queued',
+            'message': 'Aguardando na fila...',
+            'queued_at': time.time(),
+            'url': entrada['url'],
+            'video_id': video_id,
+            'batch_id': download_id,
+            'title': entrada.get('title'),
+            'client': cliente,
         }
+        if perfil != PERFIL_PADRAO:
+            item['profile'] = perfil
+        itens.append(download_status.claim(str(uuid.uuid4()), item))
+    
+    if not itens:
+        download_status.update(download_id, status='error', message='Erro: nenhum vídeo encontrado na playlist')
+        return
+    download_status.update(
+        download_id,
+        status='batch',
+        title=info.get('title'),
+        children=itens,
+        skipped=pulados,
+        message=f'{len(itens)} vídeos na fila',
+    )
+    atualizar_lote(download_id)
+
+def progresso_do_lote(registro):
+    """Resumo dos itens de um lote: quantidade por status e bytes baixados"""
+    itens = registro.get('children') or []
+    registros = download_status.get_many(itens)
+    resumo = {
+        'total': len(itens), 'skipped': registro.get('skipped', 0),
+        'queued': 0, 'downloading': 0, 'completed': 0, 'error': 0, 'downloaded_bytes': 0,
+    }
+    for item_id in itens:
+        item = registros.get(item_id)
+        # Item que já expirou (JOB_TTL) tinha terminado
+        estado = item['status'] if item else 'completed'
+        resumo[estado] = resumo.get(estado, 0) + 1
+        if item:
+            resumo['downloaded_bytes'] += (item.get('progress') or {}).get('downloaded_bytes') or 0
+    terminados = resumo['completed'] + resumo['error']
+    resumo['percent'] = round(100 * terminados / resumo['total'], 1) if resumo['total'] else 100.0
+    return resumo
+
+def atualizar_lote(batch_id):
+    """Encerra o lote quando todos os itens tiverem terminado; retorna o resumo ou None"""
+    registro = download_status.get(batch_id)
+    if not registro or registro.get('children') is None:
+        return None
+    resumo = progresso_do_lote(registro)
+    if registro['status'] == 'batch' and not any(resumo.get(estado) for estado in JobStore.em_andamento):
+        download_status.update(
+            batch_id,
+            status='completed' if resumo['completed'] else 'error',
+            message=f"{resumo['completed']} de {resumo['total']} vídeos baixados",
+        )
+    return resumo
+
+def download_worker(url, download_id):
+    """Executa um download da fila e registra o resultado"""
+    status = download_status.get(download_id) or {}
+    inicio = time.time()
+    espera = round(inicio - status.get('queued_at', inicio), 2)
+    download_status.update(
+        download_id,
+        status='downloading',
+        message='Iniciando download...',
+        started_at=inicio,
+        wait_time=espera,
+    )
+    if status.get('batch'):
+        resolver_lote(url, download_id, status.get('profile', PERFIL_PADRAO), status.get('client'))
+        return
+    try:
+        executar_download(url, download_id, status)
+    finally:
+        if status.get('batch_id'):
+            atualizar_lote(status['batch_id'])
+
+def executar_download(url, download_id, status):
+    """
+    Baixa um único vídeo e registra o resultado no job
+    
+    Se o perfil de saída pedir conversão, o job passa para a fila de
+    conversões ('transcode_queued') em vez de terminar aqui.
+    """
+    perfil = status.get('profile', PERFIL_PADRAO)
+    result = baixar_video_youtube(
+        url, app.config['DOWNLOAD_FOLDER'], ProgressReporter(download_id),
+        formato_anterior=status.get('format_id'),
+        streaming=bool(status.get('stream')),
+        perfil=perfil,
+    )
+    if result['success'] and status.get('video_id'):
+        # A biblioteca guarda a chave do perfil (ver chave_do_video)
+        result['video_id'] = status['video_id']
+    
+    if result['success'] and precisa_converter(PERFIS_SAIDA[perfil], result['filename']):
+        download_status.update(
+            download_id,
+            status='transcode_queued',
+            message='Aguardando a conversão...',
+            source_filename=result['filename'],
+            result={k: result.get(k) for k in ('title', 'video_id', 'duration', 'format')},
+            progress={'phase': 'transcode', 'percent': 0.0},
+            metrics=result.get('metrics'),
+        )
+    elif result['success']:
+        concluir_download(download_id, result, result.get('metrics'))
+    else:
+        download_status.update(
+            download_id,
+            status='error',
+            message=f"Erro: {result.get('error', 'Erro desconhecido')}",
+            metrics=result.get('metrics'),
+        )
+
+def concluir_download(download_id, result, medicoes=None):
+    """Guarda o arquivo final no armazenamento por conteúdo e na biblioteca e encerra o job"""
+    try:
+        tamanho = os.path.getsize(os.path.join(app.config['DOWNLOAD_FOLDER'], result['filename']))
+    except OSError:
+        tamanho = None
+    sha256 = crc32 = None
+    if tamanho is not None:
+        try:
+            result['filename'], sha256, crc32 = conteudo.armazenar(result['filename'], result.get('video_id'))
+        except OSError as e:
+            # Ex.: sistema de arquivos sem hardlinks; o vídeo fica com o nome de trabalho
+            app.logger.warning('Falha ao armazenar %s por conteúdo: %s', result['filename'], e)
+    download_status.update(
+        download_id,
+        status='completed',
+        message=f"Download concluído: {result['title']}",
+        filename=result['filename'],
+        sha256=sha256,
+        progress={'phase': 'done', 'downloaded_bytes': tamanho, 'total_bytes': tamanho, 'percent': 100.0},
+        metrics=dict(medicoes or {}, bytes=tamanho),
+    )
+    library.add(
+        result['filename'],
+        video_id=result.get('video_id'),
+        title=result['title'],
+        duration=result.get('duration'),
+        formato=result.get('format'),
+        sha256=sha256,
+        crc32=crc32,
+    )
+    storage.evict_if_needed()
+
+def precisa_converter(perfil, filename):
+    """Se o arquivo baixado ainda precisa passar pelo ffmpeg para o perfil"""
+    if not perfil['ffmpeg']:
+        return False
+    return os.path.splitext(filename)[1].lstrip('.').lower() not in perfil['aceita']
+
+def _prefixo_prioridade(nice):
+    """nice/ionice na frente do comando: conversões só usam CPU e disco que sobrarem"""
+    prefixo = []
+    if nice and shutil.which('nice'):
+        prefixo += ['nice', '-n', str(nice)]
+    if shutil.which('ionice'):
+        # Classe idle: o disco fica para os downloads e as respostas HTTP
+        prefixo += ['ionice', '-c', '3']
+    return prefixo
+
+def executar_conversao(download_id, registro, tempo_limite=0, nice=0):
+    """
+    Converte o arquivo baixado para o perfil do job e conclui o job
+    
+    O ffmpeg roda como processo próprio (grupo de processos separado, em
+    prioridade baixa); esta função só acompanha o progresso pela saída
+    `-progress` e encerra o grupo se o tempo limite estourar.
+    """
+    perfil = PERFIS_SAIDA[registro['profile']]
+    pasta = app.config['DOWNLOAD_FOLDER']
+    origem = registro['source_filename']
+    base = os.path.splitext(origem)[0]
+    # '.temp.' é reconhecido como parcial (protegido enquanto o job existir)
+    temporario = os.path.join(pasta, f"{base}.temp.{perfil['ext']}")
+    final = f"{base}.{perfil['ext']}"
+    duracao = (registro.get('result') or {}).get('duration') or 0
+    try:
+        # Resto de uma tentativa anterior, talvez ainda aberto por um ffmpeg órfão
+        os.remove(temporario)
+    except FileNotFoundError:
+        pass
+    
+    comando = _prefixo_prioridade(nice) + [
+        'ffmpeg', '-y', '-nostdin', '-hide_banner', '-loglevel', 'error',
+        '-i', os.path.join(pasta, origem), *perfil['ffmpeg'],
+        '-progress', 'pipe:1', '-nostats', temporario,
+    ]
+    inicio = time.perf_counter()
+    processo = subprocess.Popen(
+        comando, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True,
+        text=True, errors='replace',
+    )
+    # O stderr é esvaziado por uma thread à parte, guardando só as últimas
+    # linhas: com o pipe cheio o ffmpeg pararia e o progresso nunca terminaria
+    erros = collections.deque(maxlen=20)
+    leitor_erros = threading.Thread(target=erros.extend, args=(processo.stderr,), daemon=True)
+    leitor_erros.start()
+    # O tempo limite é verificado por um timer: a leitura do progresso bloqueia
+    estourou = threading.Event()
+    
+    def encerrar():
+        estourou.set()
+        try:
+            os.killpg(processo.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    
+    timer = threading.Timer(tempo_limite, encerrar) if tempo_limite else None
+    if timer:
+        timer.daemon = True
+        timer.start()
+    ultima_gravacao = 0
+    try:
+        for linha in processo.stdout:
+            chave, _, valor = linha.strip().partition('=')
+            if chave != 'out_time_us' or not duracao or not valor.isdigit():
+                continue
+            agora = time.time()
+            if agora - ultima_gravacao < ProgressReporter.intervalo:
+                continue
+            ultima_gravacao = agora
+            percentual = min(round(int(valor) / 1e6 / duracao * 100, 1), 99.9)
+            download_status.update(
+                download_id, message=f'Convertendo: {percentual}%',
+                progress={'phase': 'transcode', 'percent': percentual},
+            )
+        processo.wait()
+        leitor_erros.join()
+    finally:
+        if timer:
+            timer.cancel()
+    
+    if estourou.is_set() or processo.returncode != 0:
+        motivo = (
+            f'a conversão excedeu o tempo limite de {tempo_limite} segundos' if estourou.is_set()
+            else ([e.strip() for e in erros if e.strip()] or [f'ffmpeg terminou com código {processo.returncode}'])[-1]
+        )
+        # O job termina com erro: nem o temporário nem o arquivo baixado serão usados
+        for caminho in (temporario, os.path.join(pasta, origem)):
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+        download_status.update(download_id, status='error', message=f'Erro na conversão: {motivo}')
+        return
+    
+    os.replace(temporario, os.path.join(pasta, final))
+    if final != origem:
+        os.remove(os.path.join(pasta, origem))
+    medicoes = dict(registro.get('metrics') or {}, transcode_seconds=time.perf_counter() - inicio)
+    concluir_download(download_id, dict(registro['result'], filename=final), medicoes)
+
+def registrar_metricas_job(download_id):
+    """
+    Converte as medições gravadas no job em métricas
+    
+    Chamado pelo supervisor depois de cada etapa (download, conversão); só
+    conta quando o job terminou de vez. O processo filho
+    de cada job só grava no armazenamento de status, e assim não deixa
+    arquivos de métricas próprios na pasta do modo multiprocesso.
+    """
+    registro = download_status.get(download_id) or {}
+    if registro.get('status') not in JobStore.finalizados:
+        return
+    METRICA_JOBS_FINALIZADOS.labels(result=registro['status']).inc()
+    medicoes = registro.get('metrics') or {}
+    for estrategia, resultado in medicoes.get('strategies', []):
+        METRICA_TENTATIVAS.labels(strategy=estrategia, result=resultado).inc()
+    for chave, histograma in (
+        ('extract_seconds', METRICA_EXTRACAO),
+        ('download_seconds', METRICA_DOWNLOAD),
+        ('merge_seconds', METRICA_MERGE),
+        ('transcode_seconds', METRICA_CONVERSAO),
+    ):
+        if medicoes.get(chave) is not None:
+            histograma.observe(medicoes[chave])
+    if medicoes.get('bytes'):
+        METRICA_BYTES.inc(medicoes['bytes'])
+        if medicoes.get('download_seconds'):
+            METRICA_VELOCIDADE.observe(medicoes['bytes'] / medicoes['download_seconds'])
+
+def _caminho_lock_job(download_id):
+    return os.path.join(app.config['STATE_FOLDER'], 'running', f'{download_id}.lock')
+
+@contextmanager
+def travar_job(download_id):
+    """Mantém um lock em arquivo enquanto este processo executa o job"""
+    if not fcntl:
+        yield
+        return
+    caminho = _caminho_lock_job(download_id)
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    with open(caminho, 'a') as arquivo:
+        fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+
+def job_em_execucao(download_id):
+    """Se algum processo (de qualquer container no mesmo volume) executa o job"""
+    if not fcntl:
+        return False
+    try:
+        arquivo = open(_caminho_lock_job(download_id), 'r')
+    except FileNotFoundError:
+        return False
+    with arquivo:
+        try:
+            fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(arquivo.fileno(), fcntl.LOCK_UN)
+        return False
+
+def executar_job(url, download_id, limite_memoria=0):
+    """Ponto de entrada do processo filho que executa um download"""
+    # Grupo de processos próprio: ao estourar o tempo, o supervisor encerra
+    # também o ffmpeg que o yt-dlp tiver aberto
+    os.setsid()
+    if limite_memoria and resource:
+        # Herdado pelo ffmpeg; acima disso as alocações falham só neste processo
+        resource.setrlimit(resource.RLIMIT_AS, (limite_memoria, limite_memoria))
+    with travar_job(download_id):
+        download_worker(url, download_id)
+
+class DownloadScheduler:
+    """
+    Fila limitada de downloads atendida por um pool de processos
+    
+    O submit() só grava o job como 'queued' no armazenamento de status. Um
+    supervisor retira os jobs de lá (claim_next) e roda cada download num
+    processo filho, com limite de tempo e de memória: a extração do yt-dlp
+    não disputa o GIL com as requisições e um processo que trave ou morra
+    derruba apenas o próprio job.
+    
+    Só um supervisor fica ativo por vez (lock em arquivo na pasta de estado):
+    num dos workers do gunicorn (DOWNLOAD_RUNNER=inline) ou num processo à
+    parte, `python app.py downloader` (DOWNLOAD_RUNNER=external). Se ele
+    cair, outro processo assume a fila.
+    
+    O armazenamento de status funciona como journal: jobs 'downloading' cujo
+    processo não existe mais (reinício do container, worker morto) voltam
+    para a fila e continuam dos arquivos .part, com o mesmo formato.
+    """
+    
+    # Intervalo de consulta à fila quando ela está vazia
+    intervalo_fila = 1.0
+    # Intervalo entre verificações de jobs órfãos
+    intervalo_recuperacao = 60
+    # Quantas vezes um job interrompido é retomado antes de ser dado como erro
+    max_tentativas = 3
+    # Tempo entre o SIGTERM e o SIGKILL de um download que estourou o limite
+    tolerancia_termino = 5
+    
+    def __init__(self, num_workers, max_fila, tempo_limite=0, limite_memoria=0, caminho_lock=None, max_por_lote=0,
+                 num_conversores=1, nice_conversao=0):
+        self.num_workers = num_workers
+        self.num_conversores = num_conversores
+        self.nice_conversao = nice_conversao
+        self.max_fila = max_fila
+        self.max_por_lote = max_por_lote
+        self.tempo_limite = tempo_limite
+        self.limite_memoria = limite_memoria
+        self.caminho_lock = caminho_lock
+        # Com o armazenamento em memória, um processo filho não teria como
+        # publicar o progresso: os downloads rodam em threads
+        self.isolar = not isinstance(download_status, MemoryJobStore)
+        self._acordar = threading.Event()
+        self._acordar_conversao = threading.Event()
+        self._lock = threading.Lock()
+        self._ativos = 0
+        self._em_execucao = set()
+        self._supervisor = False
+        # Arquivo do lock de supervisor: aberto enquanto o processo viver
+        self._trava = None
+        self._contexto = None
+        # Threads não sobrevivem ao fork do gunicorn: o supervisor é criado
+        # sob demanda, uma vez por processo
+        self._pid = None
+    
+    def ensure_running(self):
+        """Inicia (uma vez por processo) a thread que disputa o papel de supervisor"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._ativos = 0
+            self._em_execucao = set()
+            self._supervisor = False
+            thread = threading.Thread(target=self._supervisionar, name='download-supervisor')
+            thread.daemon = True
+            thread.start()
+    
+    def run_forever(self):
+        """Executa o supervisor no processo atual (entrypoint `downloader`)"""
+        self._pid = os.getpid()
+        self._supervisionar()
+    
+    def submit(self, url, download_id, video_id=None, lote=False, stream=False, perfil=PERFIL_PADRAO, cliente=None):
+        """
+        Coloca um download na fila
         
-        .video-item {
-            background: #fff5f9;
-            border: 2px solid #ffb3d9;
-            border-radius: 10px;
-            padding: 15px;
-            margin-bottom: 15px;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
+        Se o mesmo vídeo já estiver na fila ou baixando, o pedido é anexado
+        ao job existente em vez de criar outro. Com `lote=True` (playlist ou
+        canal) o job lista os vídeos e cria um item na fila para cada um;
+        com `stream=True` o vídeo pode ser entregue enquanto baixa (/stream).
+        `perfil` é o perfil de saída (PERFIS_SAIDA); `video_id` deve ser a
+        chave do vídeo nesse perfil (chave_do_video). `cliente`
+        (identificar_cliente) é quem pediu, para o rodízio da fila.
         
-        .video-item:hover {
-            border-color: #ff69b4;
-            box-shadow: 0 3px 10px rgba(255, 105, 180, 0.2);
-        }
+        Returns:
+            tuple: (id do job, posição na fila). A posição é None se a fila
+            estiver cheia e 0 se o job já estiver baixando
+        """
+        if video_id:
+            existente = download_status.find_by_video(video_id, JobStore.em_andamento)
+            if existente:
+                download_status.incr('cache_inflight_hits')
+                return existente[0], download_status.queue_position(existente[0]) or 0
         
-        .video-name {
-            color: #c2185b;
-            font-weight: bold;
-            flex: 1;
-            word-break: break-word;
-        }
+        # O limite da fila vale para todos os workers do gunicorn; um lote
+        # conta como um pedido, não pelos vídeos que tiver
+        if download_status.count('queued', batched=False) >= self.max_fila:
+            return download_id, None
+        registro_id = download_status.claim(download_id, self._novo_registro(url, video_id, lote, stream, perfil, cliente))
+        if registro_id != download_id:
+            # Outro worker enfileirou o mesmo vídeo entre a busca e o claim
+            download_status.incr('cache_inflight_hits')
+            return registro_id, download_status.queue_position(registro_id) or 0
+        if video_id:
+            download_status.incr('cache_misses')
+        # Se o supervisor estiver neste processo, não espera a próxima consulta
+        self._acordar.set()
+        return download_id, download_status.queue_position(download_id) or 0
+    
+    def submit_many(self, pedidos, cliente=None):
+        """
+        submit() de vários downloads: uma consulta para os jobs em andamento,
+        uma transação para gravar os novos e uma para as posições na fila
         
-        .video-actions {
-            display: flex;
-            gap: 10px;
-        }
+        Args:
+            pedidos: Lista de (url, download_id, video_id, lote, stream, perfil)
+            cliente: Quem fez os pedidos (ver submit())
         
-        .btn-small {
-            padding: 8px 15px;
-            font-size: 0.9em;
-            width: auto;
-            margin: 0;
-        }
+        Returns:
+            list: (id do job, posição, novo) na ordem dos pedidos. A posição
+            é None para os que não couberam na fila; `novo` é False quando o
+            pedido foi anexado a um job que já existia
+        """
+        video_ids = [pedido[2] for pedido in pedidos if pedido[2]]
+        existentes = download_status.find_by_videos(video_ids, JobStore.em_andamento) if video_ids else {}
+        vagas = self.max_fila - download_status.count('queued', batched=False)
         
-        .btn-danger {
-            background: linear-gradient(135deg, #ff4757 0%, #ff3838 100%);
-        }
+        novos = {}
+        # Vídeo repetido na mesma requisição fica com o primeiro job
+        por_video = {video_id: existente[0] for video_id, existente in existentes.items()}
+        escolhidos = []
+        for url, download_id, video_id, lote, stream, perfil in pedidos:
+            if video_id in por_video:
+                escolhidos.append((por_video[video_id], False))
+            elif vagas <= 0:
+                escolhidos.append((download_id, None))
+            else:
+                vagas -= 1
+                novos[download_id] = self._novo_registro(url, video_id, lote, stream, perfil, cliente)
+                if video_id:
+                    por_video[video_id] = download_id
+                escolhidos.append((download_id, True))
         
-        .loading {
-            text-align: center;
-            color: #ff69b4;
-            font-size: 1.2em;
-            margin: 20px 0;
-        }
+        # Outro worker pode ter enfileirado o mesmo vídeo nesse meio-tempo
+        responsaveis = download_status.claim_many(novos) if novos else {}
+        anexados = sum(1 for novo in escolhidos if novo[1] is False)
+        anexados += sum(1 for i, responsavel in responsaveis.items() if responsavel != i)
+        perdidos = sum(1 for i, r in responsaveis.items() if r == i and novos[i].get('video_id'))
+        if anexados:
+            download_status.incr('cache_inflight_hits', anexados)
+        if perdidos:
+            download_status.incr('cache_misses', perdidos)
+        if novos:
+            self._acordar.set()
         
-        .spinner {
-            border: 4px solid #ffb3d9;
-            border-top: 4px solid #ff69b4;
-            border-radius: 50%;
-            width: 40px;
-            height: 40px;
-            animation: spin 1s linear infinite;
-            margin: 20px auto;
+        ids = [responsaveis.get(i, i) for i, _ in escolhidos]
+        posicoes = download_status.queue_positions(ids)
+        resultado = []
+        for download_id, (pedido_id, novo) in zip(ids, escolhidos):
+            if novo is None:
+                resultado.append((download_id, None, False))
+            else:
+                resultado.append((download_id, posicoes.get(download_id, 0), novo and download_id == pedido_id))
+        return resultado
+    
+    @staticmethod
+    def _novo_registro(url, video_id, lote=False, stream=False, perfil=PERFIL_PADRAO, cliente=None):
+        registro = {
+            'status': 'queued',
+            'message': 'Aguardando na fila...',
+            'queued_at': time.time(),
+            'url': url,
+            'video_id': video_id,
+            'client': cliente,
         }
-        
-        @keyframes spin {
-            0% { transform: rotate(0deg); }
-            100% { transform: rotate(360deg); }
+        if perfil != PERFIL_PADRAO:
+            registro['profile'] = perfil
+        if lote:
+            registro['batch'] = True
+        elif stream and perfil == PERFIL_PADRAO:
+            # O modo streaming entrega o vídeo como baixado, sem conversão
+            registro['stream'] = True
+        return registro
+    
+    def position(self, download_id):
+        """Posição de um download na fila (1 = próximo) ou None se não estiver na fila"""
+        return download_status.queue_position(download_id)
+    
+    def stats(self):
+        with self._lock:
+            ativos_locais = self._ativos
+            supervisor = self._supervisor
+        return {
+            'queue_depth': download_status.count('queued'),
+            'active': download_status.count('downloading'),
+            'transcode_queue_depth': download_status.count('transcode_queued'),
+            'transcoding': download_status.count('transcoding'),
+            'local_active': ativos_locais,
+            'supervisor': supervisor,
+            'isolated': self.isolar,
+            'workers': self.num_workers,
+            'transcode_workers': self.num_conversores,
+            'max_queue': self.max_fila,
         }
+    
+    def _supervisionar(self):
+        self._trava = self._travar()
+        with self._lock:
+            self._supervisor = True
+        if self.isolar:
+            # forkserver: os filhos nascem de um processo limpo (sem as threads
+            # do servidor web) que já importou a aplicação
+            metodo = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._contexto = multiprocessing.get_context(metodo)
+            if metodo == 'forkserver':
+                self._contexto.set_forkserver_preload([__name__])
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._loop, name=f'download-slot-{i}')
+            thread.daemon = True
+            thread.start()
+        for i in range(self.num_conversores):
+            thread = threading.Thread(target=self._loop_conversao, name=f'transcode-slot-{i}')
+            thread.daemon = True
+            thread.start()
+        # Mantém o supervisor vivo (no entrypoint `downloader` é a thread principal)
+        while True:
+            try:
+                self.recover()
+            except Exception as e:
+                app.logger.warning('Falha ao recuperar jobs interrompidos: %s', e)
+            time.sleep(self.intervalo_recuperacao)
+    
+    def recover(self):
+        """
+        Devolve à fila os jobs 'downloading' que nenhum processo executa, e à
+        fila de conversões os 'transcoding' que este supervisor não executa
+        (as conversões só rodam no supervisor), e encerra os lotes cujos
+        itens já terminaram
         
-        .empty-state {
-            text-align: center;
-            color: #d63384;
-            padding: 40px;
-            font-style: italic;
-        }
-    </style>
+        Returns:
+            list: Ids dos jobs retomados
+        """
+        retomados = []
+        for download_id, registro in download_status.list_by_status(('downloading',)).items():
+            with self._lock:
+                if download_id in self._em_execucao:
+                    continue
+            if job_em_execucao(download_id):
+                continue
+            tentativas = registro.get('attempts', 0) + 1
+            if tentativas > self.max_tentativas:
+                download_status.update(
+                    download_id, status='error',
+                    message='Erro: o download foi interrompido várias vezes',
+                )
+                continue
+            if download_status.requeue(download_id, attempts=tentativas, message='Retomando o download...'):
+                retomados.append(download_id)
+        for download_id, registro in download_status.list_by_status(('transcoding',)).items():
+            with self._lock:
+                if download_id in self._em_execucao:
+                    continue
+            tentativas = registro.get('attempts', 0) + 1
+            if tentativas > self.max_tentativas:
+                download_status.update(
+                    download_id, status='error',
+                    message='Erro: a conversão foi interrompida várias vezes',
+                )
+                continue
+            if download_status.requeue(
+                download_id, de='transcoding', para='transcode_queued',
+                attempts=tentativas, message='Retomando a conversão...',
+            ):
+                retomados.append(download_id)
+        if retomados:
+            app.logger.info('Jobs interrompidos devolvidos à fila: %d', len(retomados))
+            self._acordar.set()
+            self._acordar_conversao.set()
+        # Lotes com itens compartilhados com outros pedidos terminam sem passar
+        # por atualizar_lote() no download_worker; encerra-os aqui
+        for batch_id in download_status.list_by_status(('batch',)):
+            atualizar_lote(batch_id)
+        return retomados
+    
+    def _travar(self):
+        """Bloqueia até este processo ser o único supervisor; retorna o arquivo do lock"""
+        if not self.caminho_lock or not fcntl:
+            return None
+        arquivo = open(self.caminho_lock, 'a')
+        # O lock é liberado pelo sistema quando o processo termina
+        fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX)
+        return arquivo
+    
+    def _loop(self):
+        while True:
+            # Claim e registro local juntos: recover() nunca vê o job sem dono
+            with self._lock:
+                job = download_status.claim_next(
+                    max_por_lote=self.max_por_lote, message='Iniciando download...', runner_pid=os.getpid()
+                )
+                if job:
+                    self._em_execucao.add(job[0])
+                    self._ativos += 1
+            if not job:
+                self._acordar.wait(self.intervalo_fila)
+                self._acordar.clear()
+                continue
+            download_id, registro = job
+            METRICA_JOBS_INICIADOS.inc()
+            try:
+                self._executar(registro['url'], download_id)
+            except Exception as e:
+                download_status.update(download_id, status='error', message=f'Erro: {str(e)}')
+            finally:
+                registrar_metricas_job(download_id)
+                with self._lock:
+                    self._em_execucao.discard(download_id)
+                    self._ativos -= 1
+                # O download pode ter deixado o job na fila de conversões
+                self._acordar_conversao.set()
+    
+    def _loop_conversao(self):
+        while True:
+            with self._lock:
+                job = download_status.claim_next(
+                    de='transcode_queued', para='transcoding',
+                    message='Convertendo...', runner_pid=os.getpid(),
+                )
+                if job:
+                    self._em_execucao.add(job[0])
+            if not job:
+                self._acordar_conversao.wait(self.intervalo_fila)
+                self._acordar_conversao.clear()
+                continue
+            download_id, registro = job
+            try:
+                executar_conversao(download_id, registro, self.tempo_limite, self.nice_conversao)
+            except Exception as e:
+                download_status.update(download_id, status='error', message=f'Erro na conversão: {str(e)}')
+            finally:
+                registrar_metricas_job(download_id)
+                with self._lock:
+                    self._em_execucao.discard(download_id)
+                if registro.get('batch_id'):
+                    atualizar_lote(registro['batch_id'])
+    
+    def _executar(self, url, download_id):
+        if not self.isolar:
+            download_worker(url, download_id)
+            return
+        processo = self._contexto.Process(
+            target=executar_job,
+            args=(url, download_id, self.limite_memoria),
+            name=f'download-{download_id}',
+        )
+        processo.start()
+        processo.join(self.tempo_limite or None)
+        if processo.is_alive():
+            self._encerrar(processo)
+            download_status.update(
+                download_id, status='error',
+                message=f'Erro: o download excedeu o tempo limite de {self.tempo_limite} segundos',
+            )
+            return
+        if processo.exitcode != 0:
+            # O filho morreu sem registrar o resultado (falta de memória, sinal...)
+            registro = download_status.get(download_id) or {}
+            if registro.get('status') == 'downloading':
+                download_status.update(
+                    download_id, status='error',
+                    message=f'Erro: o processo do download terminou inesperadamente (código {processo.exitcode})',
+                )
+    
+    def _encerrar(self, processo):
+        for sinal in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(processo.pid, sinal)
+            except (ProcessLookupError, PermissionError):
+                pass
+            processo.join(self.tolerancia_termino)
+            if not processo.is_alive():
+                return
+
+scheduler = DownloadScheduler(
+    app.config['MAX_DOWNLOAD_WORKERS'],
+    app.config['MAX_DOWNLOAD_QUEUE'],
+    tempo_limite=app.config['DOWNLOAD_TIMEOUT'],
+    limite_memoria=app.config['DOWNLOAD_MEMORY_LIMIT'] * 1024 * 1024,
+    caminho_lock=os.path.join(app.config['STATE_FOLDER'], 'downloader.lock'),
+    max_por_lote=app.config['BATCH_CONCURRENCY'],
+    num_conversores=app.config['MAX_TRANSCODE_WORKERS'],
+    nice_conversao=app.config['TRANSCODE_NICE'],
+)
+
+if app.config['PRELOAD_YT_DLP']:
+    preload_yt_dlp()
+
+HTML_TEMPLATE = '''
+<!DOCTYPE html>
+<html lang="pt-BR">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Baixador de Videos do Mozão</title>
+    <link rel="stylesheet" href="{{ asset_url('style.css') }}">
 </head>
 <body>
     <div class="container">
@@ -342,12 +2964,23 @@ HTML_TEMPLATE = '''
         
         <form method="POST" action="/download" id="downloadForm">
             <div class="form-group">
-                <label for="url">URL do Vídeo do YouTube:</label>
+                <label for="url">URL do Vídeo, Playlist ou Canal do YouTube:</label>
                 <input type="text" id="url" name="url" placeholder="https://www.youtube.com/watch?v=..." required>
             </div>
+            <div class="form-group">
+                <label for="profile">Formato:</label>
+                <select id="profile" name="profile">
+                    {% for chave, perfil in perfis_saida.items() %}
+                    <option value="{{ chave }}"{% if chave == perfil_padrao %} selected{% endif %}>{{ perfil.nome }}</option>
+                    {% endfor %}
+                </select>
+            </div>
+            <div class="form-group">
+                <label class="checkbox"><input type="checkbox" name="stream" value="1"> Começar a salvar enquanto o vídeo é baixado (só no formato padrão)</label>
+            </div>
             <div class="btn-container">
-                <button type="submit" class="btn">📥 Baixar Vídeo</button>
-                <a href="/videos" class="btn btn-secondary">📋 Ver Vídeos Baixados</a>
+                <button type="submit" class="btn btn-block">📥 Baixar Vídeo</button>
+                <a href="/videos" class="btn btn-secondary btn-block">📋 Ver Vídeos Baixados</a>
             </div>
         </form>
         
@@ -373,144 +3006,153 @@ VIDEOS_TEMPLATE = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Vídeos Baixados - Baixador de Videos do Mozão</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #ffeef5 0%, #ffd6e8 100%);
-            min-height: 100vh;
-            padding: 20px;
-        }
-        
-        .container {
-            max-width: 900px;
-            margin: 0 auto;
-            background: white;
-            border-radius: 20px;
-            box-shadow: 0 10px 40px rgba(255, 105, 180, 0.2);
-            padding: 40px;
-            margin-top: 20px;
-        }
-        
-        h1 {
-            color: #ff69b4;
-            text-align: center;
-            font-size: 2.5em;
-            margin-bottom: 10px;
-            text-shadow: 2px 2px 4px rgba(255, 105, 180, 0.2);
-        }
-        
-        .subtitle {
-            text-align: center;
-            color: #d63384;
-            font-size: 1.1em;
-            margin-bottom: 30px;
-            font-style: italic;
-        }
-        
-        .btn {
-            background: linear-gradient(135deg, #ff69b4 0%, #ff1493 100%);
-            color: white;
-            padding: 15px 30px;
-            border: none;
-            border-radius: 10px;
-            font-size: 1.1em;
-            font-weight: bold;
-            cursor: pointer;
-            transition: transform 0.2s, box-shadow 0.2s;
-            text-decoration: none;
-            display: inline-block;
-            margin-bottom: 20px;
-        }
+    <link rel="stylesheet" href="{{ asset_url('style.css') }}">
+</head>
+<body>
+    <div class="container">
+        <h1>Baixador de Videos do Mozão</h1>
+        <p class="subtitle">ferramenta de download de videos do Mozão</p>
         
-        .btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 5px 20px rgba(255, 105, 180, 0.4);
-        }
+        <a href="/" class="btn btn-back">🏠 Voltar</a>
         
-        .videos-list {
-            margin-top: 30px;
-        }
+        <div class="search-bar">
+            <input type="text" id="search" placeholder="Buscar pelo título...">
+            <select id="sort">
+                <option value="date">Mais recentes</option>
+                <option value="title">Título</option>
+                <option value="size">Tamanho</option>
+            </select>
+        </div>
         
-        .video-item {
-            background: #fff5f9;
-            border: 2px solid #ffb3d9;
-            border-radius: 10px;
-            padding: 15px;
-            margin-bottom: 15px;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
+        <div class="export-bar" id="exportBar" style="display: none;">
+            <span id="exportCount"></span>
+            <a href="#" class="btn btn-small" id="export">📦 Baixar selecionados (.zip)</a>
+        </div>
         
-        .video-item:hover {
-            border-color: #ff69b4;
-            box-shadow: 0 3px 10px rgba(255, 105, 180, 0.2);
-        }
+        <div class="videos-list" id="videos"></div>
+        <div class="empty-state" id="empty" style="display: none;">
+            Nenhum vídeo baixado ainda. <a href="/">Voltar para baixar um vídeo</a>
+        </div>
+        <div id="sentinel"></div>
+    </div>
+    
+    <script>
+        const lista = document.getElementById('videos');
+        let nextCursor = null;
+        let carregando = false;
+        let fim = false;
+        let geracao = 0;
+        // Ids marcados para exportar; continuam marcados ao buscar ou reordenar
+        const selecionados = new Set();
         
-        .video-name {
-            color: #c2185b;
-            font-weight: bold;
-            flex: 1;
-            word-break: break-word;
+        function atualizarExportacao() {
+            document.getElementById('exportBar').style.display = selecionados.size ? 'flex' : 'none';
+            document.getElementById('exportCount').textContent = selecionados.size + ' selecionado(s)';
+            document.getElementById('export').href = '/export.zip?ids=' + Array.from(selecionados).join(',');
         }
         
-        .video-actions {
-            display: flex;
-            gap: 10px;
+        function criarItem(video) {
+            const item = document.createElement('div');
+            item.className = 'video-item';
+            
+            const marcar = document.createElement('input');
+            marcar.type = 'checkbox';
+            marcar.className = 'video-select';
+            marcar.checked = selecionados.has(video.id);
+            marcar.addEventListener('change', () => {
+                if (marcar.checked) {
+                    selecionados.add(video.id);
+                } else {
+                    selecionados.delete(video.id);
+                }
+                atualizarExportacao();
+            });
+            item.appendChild(marcar);
+            
+            const nome = document.createElement('div');
+            nome.className = 'video-name';
+            nome.textContent = video.filename;
+            item.appendChild(nome);
+            
+            const acoes = document.createElement('div');
+            acoes.className = 'video-actions';
+            const baixar = document.createElement('a');
+            baixar.href = video.download_url;
+            baixar.className = 'btn btn-small';
+            baixar.textContent = '⬇️ Baixar';
+            acoes.appendChild(baixar);
+            
+            const form = document.createElement('form');
+            form.method = 'POST';
+            form.action = '/delete/' + encodeURIComponent(video.filename);
+            form.style.display = 'inline';
+            form.onsubmit = () => confirm('Tem certeza que deseja deletar este vídeo?');
+            const deletar = document.createElement('button');
+            deletar.type = 'submit';
+            deletar.className = 'btn btn-small btn-danger';
+            deletar.textContent = '🗑️ Deletar';
+            form.appendChild(deletar);
+            acoes.appendChild(form);
+            
+            item.appendChild(acoes);
+            return item;
         }
         
-        .btn-small {
-            padding: 8px 15px;
-            font-size: 0.9em;
-            width: auto;
-            margin: 0;
+        function carregarPagina() {
+            if (carregando || fim) {
+                return;
+            }
+            carregando = true;
+            const minhaGeracao = geracao;
+            const params = new URLSearchParams({sort: document.getElementById('sort').value, limit: 50});
+            const busca = document.getElementById('search').value.trim();
+            if (busca) {
+                params.set('q', busca);
+            }
+            if (nextCursor) {
+                params.set('cursor', nextCursor);
+            }
+            
+            fetch('/api/videos?' + params)
+                .then(response => response.json())
+                .then(data => {
+                    if (minhaGeracao !== geracao) {
+                        return; // Busca mudou enquanto a página carregava
+                    }
+                    data.items.forEach(video => lista.appendChild(criarItem(video)));
+                    nextCursor = data.next_cursor;
+                    fim = !nextCursor;
+                    document.getElementById('empty').style.display = lista.children.length ? 'none' : 'block';
+                })
+                .catch(error => console.error('Erro:', error))
+                .finally(() => {
+                    carregando = false;
+                });
         }
         
-        .btn-danger {
-            background: linear-gradient(135deg, #ff4757 0%, #ff3838 100%);
+        function recomecar() {
+            geracao++;
+            lista.innerHTML = '';
+            nextCursor = null;
+            fim = false;
+            carregando = false;
+            carregarPagina();
         }
         
-        .empty-state {
-            text-align: center;
-            color: #d63384;
-            padding: 40px;
-            font-style: italic;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>Baixador de Videos do Mozão</h1>
-        <p class="subtitle">ferramenta de download de videos do Mozão</p>
+        let espera = null;
+        document.getElementById('search').addEventListener('input', () => {
+            clearTimeout(espera);
+            espera = setTimeout(recomecar, 300);
+        });
+        document.getElementById('sort').addEventListener('change', recomecar);
         
-        <a href="/" class="btn">🏠 Voltar</a>
-        
-        <div class="videos-list">
-            {% if videos %}
-                {% for video in videos %}
-                <div class="video-item">
-                    <div class="video-name">{{ video }}</div>
-                    <div class="video-actions">
-                        <a href="/download_file/{{ video|urlencode }}" class="btn btn-small">⬇️ Baixar</a>
-                        <form method="POST" action="/delete/{{ video|urlencode }}" style="display: inline;" onsubmit="return confirm('Tem certeza que deseja deletar este vídeo?');">
-                            <button type="submit" class="btn btn-small btn-danger">🗑️ Deletar</button>
-                        </form>
-                    </div>
-                </div>
-                {% endfor %}
-            {% else %}
-                <div class="empty-state">
-                    Nenhum vídeo baixado ainda. <a href="/">Voltar para baixar um vídeo</a>
-                </div>
-            {% endif %}
-        </div>
-    </div>
+        // Carregar a próxima página quando o fim da lista aparecer na tela
+        new IntersectionObserver(entries => {
+            if (entries[0].isIntersecting) {
+                carregarPagina();
+            }
+        }).observe(document.getElementById('sentinel'));
+    </script>
 </body>
 </html>
 '''
@@ -522,81 +3164,13 @@ DOWNLOAD_WAIT_TEMPLATE = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Preparando Vídeo - Baixador de Videos do Mozão</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #ffeef5 0%, #ffd6e8 100%);
-            min-height: 100vh;
-            padding: 20px;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-        }
-        
-        .container {
-            max-width: 600px;
-            background: white;
-            border-radius: 20px;
-            box-shadow: 0 10px 40px rgba(255, 105, 180, 0.2);
-            padding: 40px;
-            text-align: center;
-        }
-        
-        h1 {
-            color: #ff69b4;
-            font-size: 2em;
-            margin-bottom: 20px;
-        }
-        
-        .spinner {
-            border: 4px solid #ffb3d9;
-            border-top: 4px solid #ff69b4;
-            border-radius: 50%;
-            width: 60px;
-            height: 60px;
-            animation: spin 1s linear infinite;
-            margin: 30px auto;
-        }
-        
-        @keyframes spin {
-            0% { transform: rotate(0deg); }
-            100% { transform: rotate(360deg); }
-        }
-        
-        .message {
-            color: #c2185b;
-            font-size: 1.2em;
-            margin-top: 20px;
-        }
-        
-        .error {
-            color: #d32f2f;
-            background: #ffebee;
-            padding: 15px;
-            border-radius: 10px;
-            margin-top: 20px;
-        }
-        
-        .success {
-            color: #2e7d32;
-            background: #e8f5e9;
-            padding: 15px;
-            border-radius: 10px;
-            margin-top: 20px;
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('style.css') }}">
 </head>
-<body>
+<body class="centered">
     <div class="container">
         <h1>Baixador de Videos do Mozão</h1>
         <div class="spinner"></div>
-        <div class="message" id="message">O vídeo está sendo preparado para download. Por favor, aguarde...</div>
+        <div class="message" id="message">{% if queue_position and queue_position > 1 %}Aguardando na fila (posição {{ queue_position }})...{% else %}O vídeo está sendo preparado para download. Por favor, aguarde...{% endif %}</div>
         <div id="status"></div>
     </div>
     
@@ -604,6 +3178,42 @@ DOWNLOAD_WAIT_TEMPLATE = '''
         const downloadId = '{{ download_id }}';
         let checkCount = 0;
         const maxChecks = 300; // 5 minutos máximo (1 segundo * 300)
+        let streaming = false;
+        
+        // Atualiza a tela; retorna true quando o download terminou (com ou sem erro)
+        function handleStatus(data) {
+            if (data.stream && data.status === 'downloading' && data.expected_filename && !streaming) {
+                // Modo streaming: o navegador já começa a salvar o arquivo
+                streaming = true;
+                const link = document.createElement('a');
+                link.href = '/stream/' + downloadId;
+                link.download = '';
+                document.body.appendChild(link);
+                link.click();
+            }
+            if (data.status === 'completed' && streaming) {
+                window.location.href = '/success';
+                return true;
+            } else if (data.status === 'completed' && data.batch) {
+                // Playlist concluída: os vídeos estão na lista
+                window.location.href = '/videos';
+                return true;
+            } else if (data.status === 'completed') {
+                // Redirecionar para tela de seleção de pasta
+                window.location.href = '/ready/' + downloadId;
+                return true;
+            } else if (data.status === 'error' || data.status === 'not_found') {
+                document.getElementById('message').textContent = 'Erro no download';
+                document.getElementById('status').innerHTML = '<div class="error">' + data.message + '<br><a href="/">Voltar</a></div>';
+                return true;
+            }
+            if (data.status === 'queued' || data.status === 'transcode_queued' || data.status === 'batch') {
+                // Tempo nas filas e lotes (que podem levar horas) não contam para o limite
+                checkCount--;
+            }
+            document.getElementById('message').textContent = data.message;
+            return false;
+        }
         
         function checkStatus() {
             checkCount++;
@@ -616,13 +3226,7 @@ DOWNLOAD_WAIT_TEMPLATE = '''
             fetch('/check_download/' + downloadId)
                 .then(response => response.json())
                 .then(data => {
-                    if (data.status === 'completed') {
-                        // Redirecionar para tela de seleção de pasta
-                        window.location.href = '/ready/' + downloadId;
-                    } else if (data.status === 'error') {
-                        document.getElementById('message').textContent = 'Erro no download';
-                        document.getElementById('status').innerHTML = '<div class="error">' + data.message + '<br><a href="/">Voltar</a></div>';
-                    } else {
+                    if (!handleStatus(data)) {
                         // Continuar verificando
                         setTimeout(checkStatus, 1000);
                     }
@@ -633,8 +3237,26 @@ DOWNLOAD_WAIT_TEMPLATE = '''
                 });
         }
         
-        // Iniciar verificação após 2 segundos
-        setTimeout(checkStatus, 2000);
+        if (window.EventSource) {
+            // Uma conexão aberta recebendo só as mudanças, em vez de uma requisição por segundo
+            const events = new EventSource('/events/' + downloadId);
+            events.onmessage = function(e) {
+                if (handleStatus(JSON.parse(e.data))) {
+                    events.close();
+                }
+            };
+            events.onerror = function() {
+                // Fim normal da conexão (a cada minuto): o EventSource reconecta
+                if (events.readyState !== EventSource.CLOSED) {
+                    return;
+                }
+                // Conexão recusada: voltar para a verificação periódica
+                setTimeout(checkStatus, 1000);
+            };
+        } else {
+            // Iniciar verificação após 2 segundos
+            setTimeout(checkStatus, 2000);
+        }
     </script>
 </body>
 </html>
@@ -647,90 +3269,14 @@ READY_TEMPLATE = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Vídeo Pronto - Baixador de Videos do Mozão</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #ffeef5 0%, #ffd6e8 100%);
-            min-height: 100vh;
-            padding: 20px;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-        }
-        
-        .container {
-            max-width: 600px;
-            background: white;
-            border-radius: 20px;
-            box-shadow: 0 10px 40px rgba(255, 105, 180, 0.2);
-            padding: 40px;
-            text-align: center;
-        }
-        
-        h1 {
-            color: #ff69b4;
-            font-size: 2em;
-            margin-bottom: 20px;
-        }
-        
-        .message {
-            color: #c2185b;
-            font-size: 1.2em;
-            margin-bottom: 30px;
-        }
-        
-        .btn {
-            background: linear-gradient(135deg, #ff69b4 0%, #ff1493 100%);
-            color: white;
-            padding: 20px 40px;
-            border: none;
-            border-radius: 10px;
-            font-size: 1.3em;
-            font-weight: bold;
-            cursor: pointer;
-            transition: transform 0.2s, box-shadow 0.2s;
-            text-decoration: none;
-            display: inline-block;
-            margin-top: 20px;
-            font-family: inherit;
-        }
-        
-        form {
-            display: inline-block;
-            margin: 0;
-            padding: 0;
-        }
-        
-        .btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 5px 20px rgba(255, 105, 180, 0.4);
-        }
-        
-        .btn:active {
-            transform: translateY(0);
-        }
-        
-        .error {
-            color: #d32f2f;
-            background: #ffebee;
-            padding: 15px;
-            border-radius: 10px;
-            margin-top: 20px;
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('style.css') }}">
 </head>
-<body>
+<body class="centered">
     <div class="container">
         <h1>Baixador de Videos do Mozão</h1>
         <div class="message">O vídeo está pronto! Clique no botão abaixo para escolher onde salvar.</div>
         <form id="downloadForm" method="get" target="_blank" style="display: inline;">
-            <button type="submit" id="downloadBtn" class="btn">📁 Escolher Pasta e Baixar Vídeo</button>
+            <button type="submit" id="downloadBtn" class="btn btn-large">📁 Escolher Pasta e Baixar Vídeo</button>
         </form>
         <div id="status"></div>
     </div>
@@ -786,68 +3332,9 @@ DOWNLOADING_TEMPLATE = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Baixando Vídeo - Baixador de Videos do Mozão</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #ffeef5 0%, #ffd6e8 100%);
-            min-height: 100vh;
-            padding: 20px;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-        }
-        
-        .container {
-            max-width: 600px;
-            background: white;
-            border-radius: 20px;
-            box-shadow: 0 10px 40px rgba(255, 105, 180, 0.2);
-            padding: 40px;
-            text-align: center;
-        }
-        
-        h1 {
-            color: #ff69b4;
-            font-size: 2em;
-            margin-bottom: 20px;
-        }
-        
-        .spinner {
-            border: 4px solid #ffb3d9;
-            border-top: 4px solid #ff69b4;
-            border-radius: 50%;
-            width: 60px;
-            height: 60px;
-            animation: spin 1s linear infinite;
-            margin: 30px auto;
-        }
-        
-        @keyframes spin {
-            0% { transform: rotate(0deg); }
-            100% { transform: rotate(360deg); }
-        }
-        
-        .message {
-            color: #c2185b;
-            font-size: 1.2em;
-            margin-top: 20px;
-        }
-        
-        .timer {
-            color: #ff69b4;
-            font-size: 1.5em;
-            font-weight: bold;
-            margin-top: 20px;
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('style.css') }}">
 </head>
-<body>
+<body class="centered">
     <div class="container">
         <h1>Baixador de Videos do Mozão</h1>
         <div class="spinner"></div>
@@ -884,75 +3371,9 @@ SUCCESS_TEMPLATE = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Download Concluído - Baixador de Videos do Mozão</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #ffeef5 0%, #ffd6e8 100%);
-            min-height: 100vh;
-            padding: 20px;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-        }
-        
-        .container {
-            max-width: 600px;
-            background: white;
-            border-radius: 20px;
-            box-shadow: 0 10px 40px rgba(255, 105, 180, 0.2);
-            padding: 40px;
-            text-align: center;
-        }
-        
-        h1 {
-            color: #ff69b4;
-            font-size: 2em;
-            margin-bottom: 20px;
-        }
-        
-        .success-icon {
-            font-size: 5em;
-            margin: 20px 0;
-        }
-        
-        .message {
-            color: #c2185b;
-            font-size: 1.2em;
-            margin-bottom: 30px;
-        }
-        
-        .btn {
-            background: linear-gradient(135deg, #ff69b4 0%, #ff1493 100%);
-            color: white;
-            padding: 15px 30px;
-            border: none;
-            border-radius: 10px;
-            font-size: 1.2em;
-            font-weight: bold;
-            cursor: pointer;
-            transition: transform 0.2s, box-shadow 0.2s;
-            text-decoration: none;
-            display: inline-block;
-            margin-top: 20px;
-        }
-        
-        .btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 5px 20px rgba(255, 105, 180, 0.4);
-        }
-        
-        .btn:active {
-            transform: translateY(0);
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('style.css') }}">
 </head>
-<body>
+<body class="centered">
     <div class="container">
         <h1>Baixador de Videos do Mozão</h1>
         <div class="success-icon">✅</div>
@@ -964,11 +3385,148 @@ SUCCESS_TEMPLATE = '''
 </html>
 '''
 
+TEMPLATES = {
+    'index.html': HTML_TEMPLATE,
+    'videos.html': VIDEOS_TEMPLATE,
+    'download_wait.html': DOWNLOAD_WAIT_TEMPLATE,
+    'ready.html': READY_TEMPLATE,
+    'downloading.html': DOWNLOADING_TEMPLATE,
+    'success.html': SUCCESS_TEMPLATE,
+}
+
+# Templates compilados uma única vez, na importação, e mantidos no cache do Jinja
+app.jinja_env.loader = ChoiceLoader([DictLoader(TEMPLATES), app.jinja_env.loader])
+app.jinja_env.globals.update(perfis_saida=PERFIS_SAIDA, perfil_padrao=PERFIL_PADRAO)
+for _nome in TEMPLATES:
+    app.jinja_env.get_template(_nome)
+
+_versoes_assets = {}
+
+@app.template_global()
+def asset_url(filename):
+    """URL de um arquivo estático com o hash do conteúdo (cache longo e invalidação automática)"""
+    versao = _versoes_assets.get(filename)
+    if versao is None:
+        with open(os.path.join(app.static_folder, filename), 'rb') as f:
+            versao = hashlib.sha256(f.read()).hexdigest()[:12]
+        _versoes_assets[filename] = versao
+    return url_for('static', filename=filename, v=versao)
+
+@app.after_request
+def cache_assets(response):
+    # Arquivos estáticos com versão na URL nunca mudam
+    if request.endpoint == 'static' and request.args.get('v'):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
+_paginas_prontas = {}
+
+def _pagina_estatica(nome):
+    """
+    Página sem conteúdo dinâmico: renderizada uma vez por processo e servida
+    com ETag (304 quando o navegador já tem a mesma versão)
+    """
+    pronta = _paginas_prontas.get(nome)
+    if pronta is None:
+        corpo = render_template(nome).encode('utf-8')
+        pronta = (corpo, hashlib.sha256(corpo).hexdigest()[:16])
+        _paginas_prontas[nome] = pronta
+    corpo, etag = pronta
+    response = Response(corpo, mimetype='text/html')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.before_request
+def iniciar_cronometro():
+    g.inicio_requisicao = time.perf_counter()
+
+@app.after_request
+def medir_requisicao(response):
+    inicio = g.pop('inicio_requisicao', None)
+    if inicio is not None:
+        # Pelo endpoint (e não pela URL) para não criar uma série por download
+        METRICA_REQUISICOES.labels(
+            endpoint=request.endpoint or 'not_found', method=request.method, status=response.status_code,
+        ).observe(time.perf_counter() - inicio)
+    return response
+
+@app.before_request
+def iniciar_manutencao():
+    storage.ensure_running()
+    if app.config['DOWNLOAD_RUNNER'] == 'inline':
+        scheduler.ensure_running()
+
+def identificar_cliente():
+    """
+    Chave do cliente da requisição (RATE_LIMIT_KEY), usada pelo limite de
+    requisições e pelo rodízio da fila; um hash, para não guardar IPs
+    """
+    if app.config['RATE_LIMIT_KEY'] == 'session':
+        if 'client_id' not in session:
+            session['client_id'] = uuid.uuid4().hex
+        chave = 'session:' + session['client_id']
+    else:
+        chave = 'ip:' + (request.remote_addr or '')
+    return hashlib.sha256(chave.encode('utf-8')).hexdigest()[:16]
+
+def limitar(balde, custo=None):
+    """
+    Aplica o limite LIMITES[balde] por cliente à rota
+    
+    `custo` (opcional) calcula quantas fichas a requisição gasta. As
+    respostas levam X-RateLimit-Limit, X-RateLimit-Remaining e
+    X-RateLimit-Reset (segundos até o balde encher); as recusadas são 429
+    com Retry-After.
+    """
+    def decorador(view):
+        @functools.wraps(view)
+        def envolvida(*args, **kwargs):
+            g.cliente = identificar_cliente()
+            limite = LIMITES[balde]
+            if limite is None:
+                return view(*args, **kwargs)
+            capacidade, periodo = limite
+            # Um pedido maior que o balde cheio passa (e o esvazia) em vez de nunca passar
+            fichas = min(custo(), capacidade) if custo else 1
+            permitido, restantes, reset, espera = rate_limiter.consume(
+                f'{balde}:{g.cliente}', capacidade, periodo, fichas
+            )
+            if permitido:
+                response = app.make_response(view(*args, **kwargs))
+            else:
+                METRICA_LIMITADAS.labels(bucket=balde).inc()
+                response = _resposta_limitada()
+                response.headers['Retry-After'] = str(math.ceil(espera))
+            response.headers['X-RateLimit-Limit'] = str(capacidade)
+            response.headers['X-RateLimit-Remaining'] = str(math.floor(restantes))
+            response.headers['X-RateLimit-Reset'] = str(math.ceil(reset))
+            return response
+        return envolvida
+    return decorador
+
+def _resposta_limitada():
+    """Resposta 429 no formato da rota: JSON na API, página com aviso no formulário"""
+    mensagem = 'Muitas requisições em pouco tempo. Tente novamente em alguns instantes.'
+    if request.path.startswith('/api/'):
+        return app.make_response((jsonify({'error': mensagem}), 429))
+    if request.method == 'POST':
+        flash(mensagem, 'error')
+        return app.make_response((render_template('index.html'), 429))
+    return Response(mensagem, status=429, mimetype='text/plain')
+
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    # Com mensagens pendentes (flash) a página precisa ser renderizada
+    if session.get('_flashes'):
+        return render_template('index.html')
+    return _pagina_estatica('index.html')
 
 @app.route('/download', methods=['POST'])
+@limitar('submit')
 def download():
     url = request.form.get('url', '').strip()
     
@@ -976,100 +3534,701 @@ def download():
         flash('Por favor, forneça uma URL válida.', 'error')
         return redirect(url_for('index'))
     
-    # Validar se é uma URL do YouTube
-    if 'youtube.com' not in url and 'youtu.be' not in url:
+    perfil = request.form.get('profile') or PERFIL_PADRAO
+    if perfil not in PERFIS_SAIDA:
+        flash('Formato de saída inválido.', 'error')
+        return redirect(url_for('index'))
+    
+    # Validar se é uma URL de vídeo, playlist ou canal do YouTube
+    video_id = canonical_video_id(url)
+    lote = video_id is None and is_batch_url(url)
+    if video_id:
+        video_id = chave_do_video(video_id, perfil)
+    if video_id is None and not lote:
         flash('Por favor, forneça uma URL válida do YouTube.', 'error')
         return redirect(url_for('index'))
     
-    # Criar thread para download assíncrono
-    import uuid
-    download_id = str(uuid.uuid4())
+    # Vídeo já baixado e ainda na pasta: entregar sem baixar de novo
+    if video_id:
+        existente = find_cached_download(video_id)
+        if existente:
+            download_status.incr('cache_hits')
+            return redirect(url_for('ready', download_id=existente))
     
-    thread = threading.Thread(target=download_worker, args=(url, download_id))
-    thread.daemon = True
-    thread.start()
+    # Enfileirar o download; se a fila estiver cheia, recusar com 429
+    stream = request.form.get('stream') == '1'
+    download_id, posicao = scheduler.submit(
+        url, str(uuid.uuid4()), video_id, lote=lote, stream=stream, perfil=perfil, cliente=g.cliente,
+    )
+    if posicao is None:
+        flash('Muitos downloads na fila no momento. Tente novamente em alguns instantes.', 'error')
+        response = app.make_response((render_template('index.html'), 429))
+        response.headers['Retry-After'] = '30'
+        return response
     
     # Retornar página de aguardo que verifica o status e inicia download automaticamente
-    return render_template_string(DOWNLOAD_WAIT_TEMPLATE, download_id=download_id)
+    return render_template('download_wait.html', download_id=download_id, queue_position=posicao)
 
 @app.route('/check_download/<download_id>')
 def check_download(download_id):
     """Verifica o status de um download"""
-    if download_id in download_status:
-        status = download_status[download_id].copy()
-        return jsonify(status)
-    return jsonify({'status': 'not_found', 'message': 'Download não encontrado'})
+    return jsonify(_status_publico(download_id))
+
+def _status_publico(download_id):
+    """Status do download acrescido das informações da fila"""
+    return _status_publicos([download_id])[download_id]
+
+def _status_publicos(download_ids):
+    """_status_publico() de vários downloads, com uma leitura de cada tipo"""
+    registros = download_status.get_many(download_ids)
+    fila = scheduler.stats()
+    posicoes = download_status.queue_positions(
+        [i for i, r in registros.items() if r['status'] == 'queued']
+    )
+    agora = time.time()
+    resultado = {}
+    for download_id in download_ids:
+        status = registros.get(download_id)
+        if status is None:
+            resultado[download_id] = {'status': 'not_found', 'message': 'Download não encontrado'}
+            continue
+        status['queue_depth'] = fila['queue_depth']
+        status['active_downloads'] = fila['active']
+        if status.get('children') is not None:
+            # Lote: progresso agregado dos itens no lugar da lista de ids
+            resumo = atualizar_lote(download_id)
+            status = download_status.get(download_id) or status
+            del status['children']
+            status['batch'] = resumo
+            if status['status'] == 'batch':
+                status['message'] = (
+                    f"Baixando playlist: {resumo['completed'] + resumo['error']} de {resumo['total']} vídeos"
+                    f" ({_formatar_bytes(resumo['downloaded_bytes'])})"
+                )
+        if status['status'] == 'queued':
+            status['queue_position'] = posicoes.get(download_id)
+            status['wait_time'] = round(agora - status['queued_at'], 2)
+            if status['queue_position']:
+                status['message'] = f"Aguardando na fila (posição {status['queue_position']})..."
+        resultado[download_id] = status
+    return resultado
+
+# Duração máxima de uma conexão /events: o EventSource reconecta sozinho
+# (após `retry`), sem prender uma thread do gunicorn durante todo o download
+DURACAO_EVENTOS = 60
+# Intervalo entre recálculos da posição na fila e do progresso de lotes em /events
+INTERVALO_FILA_EVENTOS = 5
+
+@app.route('/events/<download_id>')
+def events(download_id):
+    """
+    Acompanha um download via Server-Sent Events
+    
+    Envia um evento a cada mudança de status (progresso, fila, conclusão) e
+    encerra quando o download termina ou após DURACAO_EVENTOS segundos (o
+    navegador reconecta). /check_download continua disponível para clientes
+    sem EventSource.
+    """
+    def gerar():
+        inicio = time.time()
+        yield 'retry: 1000\n\n'
+        registro_anterior = {}
+        anterior = None
+        ultimo_envio = inicio
+        ultimo_calculo = 0
+        while time.time() - inicio < DURACAO_EVENTOS:
+            # Cada ciclo lê só o registro; o status completo (contadores da
+            # fila, posição) é montado quando ele muda ou, na fila e em
+            # lotes, a cada INTERVALO_FILA_EVENTOS
+            registro = download_status.get(download_id)
+            periodico = registro is not None and (
+                registro['status'] == 'queued' or registro.get('children') is not None
+            ) and time.time() - ultimo_calculo >= INTERVALO_FILA_EVENTOS
+            if registro != registro_anterior or periodico:
+                registro_anterior = registro
+                ultimo_calculo = time.time()
+                status = _status_publico(download_id)
+                # wait_time muda a cada leitura; não é motivo para um novo evento
+                chave = {k: v for k, v in status.items() if k != 'wait_time'}
+                if chave != anterior:
+                    anterior = chave
+                    ultimo_envio = time.time()
+                    yield f'data: {json.dumps(status)}\n\n'
+                if status['status'] in ('completed', 'error', 'not_found'):
+                    return
+            if time.time() - ultimo_envio > 15:
+                # Comentário SSE para manter a conexão viva através de proxies
+                ultimo_envio = time.time()
+                yield ': keepalive\n\n'
+            time.sleep(0.5)
+    
+    return Response(
+        stream_with_context(gerar()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/stats')
+def stats():
+    """Contadores de cache, estado da fila e dos registros de jobs"""
+    contadores = download_status.counters()
+    return jsonify({
+        'cache': {
+            'hits': contadores.get('cache_hits', 0),
+            'inflight_hits': contadores.get('cache_inflight_hits', 0),
+            'misses': contadores.get('cache_misses', 0),
+        },
+        'queue': scheduler.stats(),
+        'jobs': {
+            'live': download_status.total(),
+            'evicted': contadores.get('jobs_evicted', 0),
+            'ttl': download_status.ttl,
+            'max': download_status.max_registros,
+        },
+        'storage': storage.stats(),
+    })
+
+class ColetorEstado:
+    """
+    Gauges calculados na hora da coleta, a partir do armazenamento de status
+    e da biblioteca, que já são compartilhados entre processos
+    """
+    
+    def collect(self):
+        fila = scheduler.stats()
+        armazenamento = storage.stats()
+        disco = shutil.disk_usage(app.config['DOWNLOAD_FOLDER'])
+        for nome, descricao, valor in (
+            ('baixador_queue_depth', 'Jobs aguardando na fila', fila['queue_depth']),
+            ('baixador_active_downloads', 'Downloads em andamento', fila['active']),
+            ('baixador_download_workers', 'Downloads simultâneos configurados', fila['workers']),
+            ('baixador_process_threads', 'Threads ativas no processo que respondeu', threading.active_count()),
+            ('baixador_storage_bytes', 'Bytes dos vídeos na pasta de downloads', armazenamento['bytes']),
+            ('baixador_storage_stored_bytes', 'Bytes ocupados (conteúdos repetidos contam uma vez)', armazenamento['stored_bytes']),
+            ('baixador_storage_dedup_saved_bytes', 'Bytes economizados por conteúdos repetidos', armazenamento['dedup_saved_bytes']),
+            ('baixador_storage_files', 'Vídeos na pasta de downloads', armazenamento['files']),
+            ('baixador_storage_high_water_bytes', 'Limite de espaço que dispara a limpeza', armazenamento['high_water']),
+            ('baixador_disk_free_bytes', 'Espaço livre no volume de downloads', disco.free),
+        ):
+            yield GaugeMetricFamily(nome, descricao, value=valor)
+
+class ColetorContainers:
+    """
+    Soma os arquivos de métricas de todos os processos, deste container e dos
+    outros que gravam no mesmo volume (uma pasta por METRICS_INSTANCE)
+    """
+    
+    def collect(self):
+        pastas = {os.path.normpath(os.environ['PROMETHEUS_MULTIPROC_DIR'])}
+        pastas.update(map(os.path.normpath, glob.glob(os.path.join(app.config['METRICS_FOLDER'], '*', ''))))
+        arquivos = [arquivo for pasta in pastas for arquivo in glob.glob(os.path.join(pasta, '*.db'))]
+        return multiprocess.MultiProcessCollector.merge(arquivos, accumulate=True)
+
+@app.route('/metrics')
+def metrics():
+    """Métricas no formato do Prometheus, somadas entre todos os processos"""
+    registro = CollectorRegistry()
+    registro.register(ColetorContainers())
+    registro.register(ColetorEstado())
+    return Response(generate_latest(registro), content_type=CONTENT_TYPE_LATEST)
 
 @app.route('/ready/<download_id>')
 def ready(download_id):
     """Exibe tela de seleção de pasta (Tela 3)"""
-    if download_id not in download_status:
+    status = download_status.get(download_id)
+    if status is None:
         flash('Download não encontrado.', 'error')
         return redirect(url_for('index'))
     
-    status = download_status[download_id]
     if status['status'] != 'completed':
         # Se ainda não estiver pronto, redirecionar para tela de preparação
         return redirect(url_for('index'))
     
-    return render_template_string(READY_TEMPLATE, download_id=download_id)
+    if status.get('batch'):
+        # Playlist: os vídeos ficam na lista da biblioteca
+        return redirect(url_for('videos'))
+    
+    return render_template('ready.html', download_id=download_id)
 
 @app.route('/downloading')
 def downloading():
     """Exibe tela de download em progresso (Tela 4)"""
-    return render_template_string(DOWNLOADING_TEMPLATE)
+    return _pagina_estatica('downloading.html')
 
 @app.route('/success')
 def success():
     """Exibe tela de sucesso (Tela 5)"""
-    return render_template_string(SUCCESS_TEMPLATE)
+    return _pagina_estatica('success.html')
 
 @app.route('/videos')
 def videos():
     try:
-        files = []
-        if os.path.exists(app.config['DOWNLOAD_FOLDER']):
-            for filename in os.listdir(app.config['DOWNLOAD_FOLDER']):
-                filepath = os.path.join(app.config['DOWNLOAD_FOLDER'], filename)
-                if os.path.isfile(filepath) and not filename.endswith('.part'):
-                    files.append(filename)
-        
-        files.sort(reverse=True)  # Mais recentes primeiro
-        return render_template_string(VIDEOS_TEMPLATE, videos=files)
+        # A lista é carregada aos poucos pela página a partir de /api/videos
+        return _pagina_estatica('videos.html')
     except Exception as e:
         flash(f'Erro ao listar vídeos: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+def _caminho_download(filename):
+    """
+    Caminho do arquivo dentro da pasta de downloads, ou None se o nome tentar
+    sair da pasta ou apontar para arquivos internos (ocultos, como .state)
+    """
+    filepath = safe_join(app.config['DOWNLOAD_FOLDER'], filename)
+    if filepath is None or any(parte.startswith('.') for parte in filename.replace('\\', '/').split('/')):
+        return None
+    return filepath
+
+# Tamanho dos blocos lidos do disco ao enviar arquivos
+BLOCO_ENVIO = 256 * 1024
+# Acima disso o cabeçalho Range é ignorado e o arquivo vai inteiro
+MAX_INTERVALOS = 16
+
+def _etag_arquivo(st):
+    """ETag forte a partir de inode, tamanho e mtime"""
+    return f'{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}'
+
+def _parse_range(cabecalho, tamanho):
+    """
+    Interpreta um cabeçalho Range de bytes
+    
+    Returns:
+        list: Intervalos (inicio, fim) inclusivos, ordenados e mesclados;
+        lista vazia se nenhum intervalo puder ser atendido (416) ou None se
+        o cabeçalho deve ser ignorado (resposta completa)
+    """
+    unidade, _, especificacao = cabecalho.partition('=')
+    if unidade.strip().lower() != 'bytes':
+        return None
+    
+    intervalos = []
+    for parte in especificacao.split(','):
+        inicio_str, traco, fim_str = parte.strip().partition('-')
+        if not traco:
+            return None
+        try:
+            if inicio_str == '':
+                # Sufixo: os últimos N bytes
+                sufixo = int(fim_str)
+                if sufixo < 0:
+                    return None
+                if sufixo == 0:
+                    continue
+                inicio, fim = max(tamanho - sufixo, 0), tamanho - 1
+            else:
+                inicio = int(inicio_str)
+                fim = int(fim_str) if fim_str else None
+                if inicio < 0 or (fim is not None and fim < inicio):
+                    return None
+                fim = tamanho - 1 if fim is None else min(fim, tamanho - 1)
+        except ValueError:
+            return None
+        if inicio < tamanho:
+            intervalos.append((inicio, fim))
+    
+    if len(intervalos) > MAX_INTERVALOS:
+        return None
+    
+    mesclados = []
+    for inicio, fim in sorted(intervalos):
+        if mesclados and inicio <= mesclados[-1][1] + 1:
+            mesclados[-1] = (mesclados[-1][0], max(mesclados[-1][1], fim))
+        else:
+            mesclados.append((inicio, fim))
+    return mesclados
+
+def _ler_intervalo(filepath, inicio, fim):
+    """Gera os bytes [inicio, fim] do arquivo em blocos"""
+    with open(filepath, 'rb') as f:
+        f.seek(inicio)
+        restante = fim - inicio + 1
+        while restante > 0:
+            bloco = f.read(min(BLOCO_ENVIO, restante))
+            if not bloco:
+                break
+            restante -= len(bloco)
+            yield bloco
+
+def _range_aplicavel(etag, mtime):
+    """Confere o If-Range: o Range só vale se o arquivo não mudou"""
+    if_range = request.if_range
+    if not request.headers.get('If-Range'):
+        return True
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return int(if_range.date.timestamp()) == int(mtime)
+    return False
+
+def _enviar_arquivo(filepath, filename, mimetype='video/mp4'):
+    """
+    Envia um arquivo da pasta de downloads com suporte a GET condicional
+    (If-None-Match / If-Modified-Since) e a Range / If-Range, incluindo
+    respostas multipart/byteranges
+    """
+    st = os.stat(filepath)
+    return _enviar_conteudo(
+        filename, mimetype, st.st_size, _etag_arquivo(st), st.st_mtime,
+        lambda inicio, fim: _ler_intervalo(filepath, inicio, fim),
+        # Arquivo inteiro: wrap_file permite ao gunicorn usar sendfile
+        lambda: wrap_file(request.environ, open(filepath, 'rb'), BLOCO_ENVIO),
+    )
+
+def _enviar_conteudo(filename, mimetype, tamanho, etag, mtime, ler, inteiro):
+    """
+    Resposta de _enviar_arquivo() para qualquer conteúdo de tamanho conhecido
+    
+    Args:
+        ler: ler(inicio, fim) gera os bytes [inicio, fim] em blocos
+        inteiro: inteiro() retorna o corpo da resposta completa
+    """
+    # Codificar o nome do arquivo para o header
+    encoded_filename = quote(filename.encode('utf-8'))
+    headers = {
+        'Content-Disposition': f"attachment; filename*=UTF-8''{encoded_filename}",
+        'X-Content-Type-Options': 'nosniff',
+        'Accept-Ranges': 'bytes',
+    }
+    
+    def resposta(corpo, status, **kwargs):
+        response = Response(corpo, status=status, headers=headers, **kwargs)
+        response.set_etag(etag)
+        response.last_modified = mtime
+        return response
+    
+    # GET condicional: o cliente já tem essa versão do arquivo
+    if request.if_none_match:
+        if request.if_none_match.contains(etag):
+            return resposta(None, 304)
+    elif request.if_modified_since and int(mtime) <= request.if_modified_since.timestamp():
+        return resposta(None, 304)
+    
+    cabecalho_range = request.headers.get('Range')
+    intervalos = None
+    if cabecalho_range and _range_aplicavel(etag, mtime):
+        intervalos = _parse_range(cabecalho_range, tamanho)
+    
+    if intervalos is None:
+        response = resposta(inteiro(), 200, mimetype=mimetype, direct_passthrough=True)
+        response.content_length = tamanho
+        return response
+    
+    if not intervalos:
+        response = resposta(None, 416)
+        response.headers['Content-Range'] = f'bytes */{tamanho}'
+        return response
+    
+    if len(intervalos) == 1:
+        inicio, fim = intervalos[0]
+        response = resposta(ler(inicio, fim), 206, mimetype=mimetype, direct_passthrough=True)
+        response.headers['Content-Range'] = f'bytes {inicio}-{fim}/{tamanho}'
+        response.content_length = fim - inicio + 1
+        return response
+    
+    # Vários intervalos: multipart/byteranges com tamanho calculado de antemão
+    boundary = uuid.uuid4().hex
+    partes = [
+        (
+            f'\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n'
+            f'Content-Range: bytes {inicio}-{fim}/{tamanho}\r\n\r\n'
+        ).encode('latin-1')
+        for inicio, fim in intervalos
+    ]
+    final = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+    
+    def gerar():
+        for cabecalho, (inicio, fim) in zip(partes, intervalos):
+            yield cabecalho
+            yield from ler(inicio, fim)
+        yield final
+    
+    response = resposta(
+        gerar(), 206, content_type=f'multipart/byteranges; boundary={boundary}', direct_passthrough=True
+    )
+    response.content_length = (
+        sum(len(p) for p in partes) + sum(fim - inicio + 1 for inicio, fim in intervalos) + len(final)
+    )
+    return response
+
+def _delegar_ao_proxy(filename, mimetype='video/mp4'):
+    """
+    Resposta vazia que manda o proxy reverso entregar o arquivo
+    
+    O worker do gunicorn é liberado na hora e o proxy envia o arquivo com
+    sendfile, tratando Range e GET condicional por conta própria. No nginx:
+    
+        location /protected-downloads/ {
+            internal;
+            alias /app/downloads/;
+        }
+    """
+    encoded_filename = quote(filename.encode('utf-8'))
+    response = Response(status=200, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{encoded_filename}"
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    if app.config['FILE_DELIVERY'] == 'x-accel':
+        response.headers['X-Accel-Redirect'] = app.config['X_ACCEL_PREFIX'].rstrip('/') + '/' + quote(filename)
+    else:
+        response.headers['X-Sendfile'] = os.path.join(app.config['X_SENDFILE_ROOT'], filename)
+    return response
+
+# Máximo de vídeos por exportação (/export.zip)
+MAX_ARQUIVOS_ZIP = 500
+# Campos do ZIP acima disso (ou entradas acima de _ZIP64_ENTRADAS) vão nos registros ZIP64
+_ZIP64_LIMITE = 0xFFFFFFFF
+_ZIP64_ENTRADAS = 0xFFFF
+
+def _data_dos(timestamp):
+    """(data, hora) no formato do MS-DOS usado pelos cabeçalhos do ZIP"""
+    t = time.localtime(timestamp)
+    if t.tm_year < 1980:
+        return (1 << 5) | 1, 0
+    return (t.tm_year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday, t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2
+
+class ZipExport:
+    """
+    ZIP sem compressão (store) montado durante o envio a partir dos
+    arquivos da pasta de downloads
+    
+    Sem compressão e com o CRC-32 de cada vídeo já guardado na biblioteca, o
+    tamanho final e a posição de cada byte são conhecidos antes de enviar
+    qualquer coisa: o ZIP é uma sequência de cabeçalhos (montados aqui, em
+    memória, algumas dezenas de bytes por arquivo) e dos próprios vídeos,
+    lidos em blocos de BLOCO_ENVIO. Nada é gravado em disco, a memória não
+    depende do tamanho total e qualquer intervalo (Range) pode ser entregue.
+    """
+    
+    def __init__(self, arquivos):
+        """
+        Args:
+            arquivos: Lista de (nome no ZIP, caminho, os.stat_result, crc32)
+        """
+        self._inicios = []
+        self._partes = []
+        self.tamanho = 0
+        central = []
+        for nome, caminho, st, crc32 in arquivos:
+            nome_bytes = nome.encode('utf-8')
+            data, hora = _data_dos(st.st_mtime)
+            deslocamento = self.tamanho
+            zip64 = st.st_size >= _ZIP64_LIMITE
+            extra = struct.pack('<HHQQ', 1, 16, st.st_size, st.st_size) if zip64 else b''
+            tamanho_campo = 0xFFFFFFFF if zip64 else st.st_size
+            self._adicionar(struct.pack(
+                '<IHHHHHIIIHH', 0x04034b50, 45 if zip64 else 20, 0x0800, 0, hora, data,
+                crc32, tamanho_campo, tamanho_campo, len(nome_bytes), len(extra),
+            ) + nome_bytes + extra)
+            self._adicionar(caminho, st.st_size)
+            
+            # No diretório central o ZIP64 também cobre a posição do cabeçalho local
+            campos64 = [st.st_size, st.st_size] if zip64 else []
+            if deslocamento >= _ZIP64_LIMITE:
+                campos64.append(deslocamento)
+            extra = struct.pack(f'<HH{len(campos64)}Q', 1, 8 * len(campos64), *campos64) if campos64 else b''
+            central.append(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, 3 << 8 | 45, 45 if campos64 else 20, 0x0800, 0, hora, data,
+                crc32, tamanho_campo, tamanho_campo, len(nome_bytes), len(extra), 0, 0, 0,
+                0o100644 << 16, 0xFFFFFFFF if deslocamento >= _ZIP64_LIMITE else deslocamento,
+            ) + nome_bytes + extra)
+        
+        inicio_central = self.tamanho
+        central = b''.join(central)
+        tamanho_central = len(central)
+        fim = b''
+        if len(arquivos) >= _ZIP64_ENTRADAS or inicio_central >= _ZIP64_LIMITE or tamanho_central >= _ZIP64_LIMITE:
+            inicio_fim64 = inicio_central + tamanho_central
+            fim = struct.pack(
+                '<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0,
+                len(arquivos), len(arquivos), tamanho_central, inicio_central,
+            ) + struct.pack('<IIQI', 0x07064b50, 0, inicio_fim64, 1)
+        fim += struct.pack(
+            '<IHHHHIIH', 0x06054b50, 0, 0,
+            min(len(arquivos), 0xFFFF), min(len(arquivos), 0xFFFF),
+            0xFFFFFFFF if tamanho_central >= _ZIP64_LIMITE else tamanho_central,
+            0xFFFFFFFF if inicio_central >= _ZIP64_LIMITE else inicio_central, 0,
+        )
+        self._adicionar(central + fim)
+    
+    def _adicionar(self, conteudo, tamanho=None):
+        """Acrescenta bytes prontos ou um arquivo (caminho, tamanho) ao fim do ZIP"""
+        tamanho = len(conteudo) if tamanho is None else tamanho
+        if tamanho:
+            self._inicios.append(self.tamanho)
+            self._partes.append((conteudo, tamanho))
+            self.tamanho += tamanho
+    
+    def ler(self, inicio, fim):
+        """Gera os bytes [inicio, fim] do ZIP em blocos"""
+        i = bisect.bisect_right(self._inicios, inicio) - 1
+        while inicio <= fim:
+            comeco = self._inicios[i]
+            conteudo, tamanho = self._partes[i]
+            ate = min(fim, comeco + tamanho - 1)
+            if isinstance(conteudo, bytes):
+                yield conteudo[inicio - comeco:ate - comeco + 1]
+            else:
+                yield from _ler_intervalo(conteudo, inicio - comeco, ate - comeco)
+            inicio = ate + 1
+            i += 1
+
+def _codificar_cursor(valor, nome):
+    return base64.urlsafe_b64encode(json.dumps([valor, nome]).encode('utf-8')).decode('ascii')
+
+def _decodificar_cursor(cursor):
+    """(valor da ordenação, nome); ValueError se o cursor não tiver esse formato"""
+    cursor = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    if not isinstance(cursor, list) or len(cursor) != 2:
+        raise ValueError('cursor inválido')
+    valor, nome = cursor
+    # O valor vem de uma coluna da biblioteca (título pode ser nulo)
+    if isinstance(valor, bool) or not isinstance(valor, (int, float, str, type(None))) or not isinstance(nome, str):
+        raise ValueError('cursor inválido')
+    return valor, nome
+
+@app.route('/api/videos')
+def api_videos():
+    """
+    Lista paginada da biblioteca
+    
+    Parâmetros: sort (date, size, title), order (asc, desc), limit (até 200),
+    q (busca no título) e cursor (next_cursor da página anterior).
+    """
+    sort = request.args.get('sort', 'date')
+    if sort not in LibraryIndex.ordenacoes:
+        return jsonify({'error': 'sort inválido'}), 400
+    order = request.args.get('order', 'asc' if sort == 'title' else 'desc')
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    query = request.args.get('q', '').strip() or None
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = _decodificar_cursor(request.args['cursor'])
+        except (ValueError, TypeError):
+            return jsonify({'error': 'cursor inválido'}), 400
+    
+    # Só percorre a pasta se ela mudou desde a última reconciliação
+    library.reconcile(storage.protected_files())
+    # Um item a mais indica se existe próxima página
+    itens = library.search(sort, order != 'asc', limit + 1, after, query)
+    next_cursor = None
+    if len(itens) > limit:
+        itens = itens[:limit]
+        ultimo = itens[-1]
+        next_cursor = _codificar_cursor(ultimo[LibraryIndex.ordenacoes[sort]], ultimo['filename'])
+    for item in itens:
+        item['download_url'] = url_for('download_file', filename=item['filename'])
+    return jsonify({'items': itens, 'next_cursor': next_cursor})
+
+# Máximo de URLs por POST e de ids por GET em /api/jobs
+MAX_ITENS_API = 1000
+
+def _urls_no_pedido():
+    """Custo de um POST /api/jobs no limite: uma ficha por URL"""
+    corpo = request.get_json(silent=True)
+    urls = corpo.get('urls') if isinstance(corpo, dict) else corpo
+    return max(len(urls), 1) if isinstance(urls, list) else 1
+
+@app.route('/api/jobs', methods=['POST'])
+@limitar('submit', custo=_urls_no_pedido)
+def api_submit_jobs():
+    """
+    Enfileira vários downloads de uma vez
+    
+    Corpo JSON: uma lista de URLs ou {"urls": [...], "stream": false, "profile": "video"}
+    (stream: permite acompanhar cada vídeo por /stream/<id>; profile: perfil
+    de saída, um de PERFIS_SAIDA, aplicado a todas as URLs). Cada item da resposta
+    traz a URL, o id do job e o resultado: 'queued' (job novo), 'attached'
+    (vídeo já na fila ou baixando), 'cached' (já baixado), 'invalid' ou
+    'queue_full'.
+    """
+    corpo = request.get_json(silent=True)
+    urls = corpo.get('urls') if isinstance(corpo, dict) else corpo
+    stream = isinstance(corpo, dict) and bool(corpo.get('stream'))
+    perfil = (corpo.get('profile') if isinstance(corpo, dict) else None) or PERFIL_PADRAO
+    if not isinstance(urls, list) or not all(isinstance(u, str) for u in urls):
+        return jsonify({'error': 'envie uma lista de URLs ou {"urls": [...]}'}), 400
+    if perfil not in PERFIS_SAIDA:
+        return jsonify({'error': f"perfil inválido; use um de: {', '.join(PERFIS_SAIDA)}"}), 400
+    if len(urls) > MAX_ITENS_API:
+        return jsonify({'error': f'no máximo {MAX_ITENS_API} URLs por requisição'}), 400
+    
+    itens = []
+    for url in urls:
+        url = url.strip()
+        video_id = canonical_video_id(url) if url else None
+        lote = video_id is None and bool(url) and is_batch_url(url)
+        if video_id:
+            video_id = chave_do_video(video_id, perfil)
+        itens.append({'url': url, 'video_id': video_id, 'lote': lote})
+    
+    # Vídeos já baixados: uma consulta para todos
+    em_cache = find_cached_downloads([i['video_id'] for i in itens if i['video_id']])
+    pedidos = []
+    for item in itens:
+        if item['video_id'] is None and not item['lote']:
+            item.update(id=None, result='invalid', error='URL de vídeo, playlist ou canal do YouTube inválida')
+        elif item['video_id'] in em_cache:
+            item.update(id=em_cache[item['video_id']], result='cached')
+        else:
+            pedidos.append(item)
+    acertos = sum(1 for item in itens if item.get('result') == 'cached')
+    if acertos:
+        download_status.incr('cache_hits', acertos)
+    
+    enviados = scheduler.submit_many([
+        (item['url'], str(uuid.uuid4()), item['video_id'], item['lote'], stream, perfil) for item in pedidos
+    ], cliente=g.cliente)
+    for item, (download_id, posicao, novo) in zip(pedidos, enviados):
+        if posicao is None:
+            item.update(id=None, result='queue_full')
+        else:
+            item.update(id=download_id, result='queued' if novo else 'attached', queue_position=posicao)
+    
+    jobs = [
+        {k: v for k, v in item.items() if k not in ('video_id', 'lote')}
+        for item in itens
+    ]
+    recusados = sum(1 for item in itens if item['result'] == 'queue_full')
+    aceitos = sum(1 for item in itens if item['result'] in ('queued', 'attached', 'cached'))
+    response = jsonify({'jobs': jobs})
+    if recusados:
+        # Sem nenhum aceito, o cliente deve tentar de novo mais tarde
+        response.status_code = 429 if not aceitos else 200
+        response.headers['Retry-After'] = '30'
+    return response
+
+@app.route('/api/jobs')
+def api_jobs_status():
+    """Status de vários jobs: ?ids=a,b,c (ou ids repetido)"""
+    ids = []
+    for valor in request.args.getlist('ids'):
+        ids.extend(i for i in valor.split(',') if i)
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return jsonify({'error': 'informe ids'}), 400
+    if len(ids) > MAX_ITENS_API:
+        return jsonify({'error': f'no máximo {MAX_ITENS_API} ids por requisição'}), 400
+    return jsonify({'jobs': _status_publicos(ids)})
+
 @app.route('/download_file/<path:filename>')
+@limitar('files')
 def download_file(filename):
     try:
         # Decodificar o nome do arquivo se necessário
-        from urllib.parse import unquote
         filename = unquote(filename)
         
         # Não usar secure_filename para preservar o nome original do arquivo
         
-        filepath = os.path.join(app.config['DOWNLOAD_FOLDER'], filename)
+        filepath = _caminho_download(filename)
         
-        if os.path.exists(filepath) and os.path.isfile(filepath):
-            # Usar send_file com as_attachment=True para abrir a janela "Salvar como"
-            # Importar quote para codificar o nome do arquivo corretamente
-            from urllib.parse import quote
-            
-            # Codificar o nome do arquivo para o header
-            encoded_filename = quote(filename.encode('utf-8'))
-            
-            response = send_file(
-                filepath, 
-                as_attachment=True,
-                download_name=filename,
-                mimetype='video/mp4'
-            )
-            # Adicionar headers para forçar download com nome codificado
-            response.headers['Content-Disposition'] = f'attachment; filename*=UTF-8\'\'{encoded_filename}'
-            response.headers['Content-Type'] = 'video/mp4'
-            response.headers['X-Content-Type-Options'] = 'nosniff'
-            return response
+        if filepath and os.path.isfile(filepath):
+            library.touch(filename)
+            # Vídeo ou áudio, conforme o perfil de saída
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            if app.config['FILE_DELIVERY'] in ('x-accel', 'x-sendfile'):
+                return _delegar_ao_proxy(filename, mimetype)
+            # Content-Disposition: attachment abre a janela "Salvar como"
+            return _enviar_arquivo(filepath, filename, mimetype)
         else:
             flash('Arquivo não encontrado.', 'error')
             return redirect(url_for('videos'))
@@ -1077,18 +4236,182 @@ def download_file(filename):
         flash(f'Erro ao baixar arquivo: {str(e)}', 'error')
         return redirect(url_for('videos'))
 
+@app.route('/export.zip')
+@limitar('files')
+def export_zip():
+    """
+    Vários vídeos da biblioteca num único ZIP sem compressão
+    
+    Parâmetro: ids (os 'id' de /api/videos, separados por vírgula). O ZIP é
+    montado durante o envio (ver ZipExport) e aceita Range / If-Range, para
+    retomar exportações interrompidas.
+    """
+    try:
+        ids = list(dict.fromkeys(int(i) for i in request.args.get('ids', '').split(',') if i))
+    except ValueError:
+        ids = []
+    # Erros em texto simples: a página de vídeos usa um link direto e é
+    # estática (sem mensagens flash)
+    if not ids or len(ids) > MAX_ARQUIVOS_ZIP:
+        return Response(
+            f'Selecione de 1 a {MAX_ARQUIVOS_ZIP} vídeos para exportar.', status=400, mimetype='text/plain'
+        )
+    
+    arquivos = []
+    pendentes = 0
+    for registro in library.get_many(ids):
+        filepath = _caminho_download(registro['filename'])
+        try:
+            st = os.stat(filepath) if filepath else None
+        except FileNotFoundError:
+            st = None
+        if st is None:
+            continue
+        if registro['crc32'] is None or registro['size'] != st.st_size:
+            # CRC-32 ainda não calculado pela manutenção (StorageManager.fill_crc32):
+            # ler o vídeo inteiro aqui travaria a requisição
+            if registro['crc32'] is not None:
+                library.set_crc32(registro['filename'], None, st.st_size)
+            pendentes += 1
+            continue
+        arquivos.append((registro['filename'], filepath, st, registro['crc32']))
+    if pendentes:
+        return Response(
+            f'{pendentes} vídeo(s) selecionado(s) ainda estão sendo indexados. '
+            'Tente exportar de novo em alguns minutos.',
+            status=503, mimetype='text/plain', headers={'Retry-After': str(StorageManager.intervalo)},
+        )
+    if not arquivos:
+        return Response('Nenhum dos vídeos selecionados foi encontrado.', status=404, mimetype='text/plain')
+    
+    library.touch(*(nome for nome, _, _, _ in arquivos))
+    exportacao = ZipExport(arquivos)
+    # Muda se qualquer um dos arquivos mudar (ou a seleção); vale para o If-Range
+    etag = hashlib.sha256(
+        '\n'.join(f'{nome}\0{_etag_arquivo(st)}' for nome, _, st, _ in arquivos).encode('utf-8')
+    ).hexdigest()[:32]
+    return _enviar_conteudo(
+        'videos.zip', 'application/zip', exportacao.tamanho, etag,
+        max(st.st_mtime for _, _, st, _ in arquivos),
+        exportacao.ler, lambda: exportacao.ler(0, exportacao.tamanho - 1),
+    )
+
+# Intervalo entre leituras do arquivo ainda crescendo no modo streaming
+INTERVALO_STREAM = 0.25
+# Quanto /stream espera o .part aparecer depois que o download começou
+ESPERA_STREAM = 30
+
+def _abrir_parcial(download_id):
+    """
+    Abre o arquivo .part de um download em modo streaming assim que ele existir
+    
+    O descritor aberto continua válido depois que o yt-dlp renomeia o .part
+    para o nome final, então a leitura segue até o fim sem reabrir o arquivo.
+    
+    Returns:
+        tuple: (arquivo, registro), com arquivo None se o download já terminou
+        ou o .part não apareceu a tempo
+    """
+    limite = time.time() + ESPERA_STREAM
+    while True:
+        status = download_status.get(download_id)
+        if status is None or status['status'] not in ('queued', 'downloading'):
+            return None, status
+        esperado = status.get('expected_filename')
+        if esperado:
+            try:
+                return open(os.path.join(app.config['DOWNLOAD_FOLDER'], esperado + '.part'), 'rb'), status
+            except FileNotFoundError:
+                pass
+        if time.time() >= limite:
+            return None, status
+        time.sleep(INTERVALO_STREAM)
+
+def _acompanhar_parcial(download_id, arquivo):
+    """
+    Gera os bytes do arquivo à medida que o download os grava, até o job terminar
+    
+    Se o download falhar, ou se o conteúdo entregue não for o do arquivo final
+    (o yt-dlp recomeçou com outro formato), a resposta é interrompida com erro
+    para o cliente não ficar com um vídeo truncado achando que está completo.
+    O hash é calculado sobre os bytes enviados e comparado ao do armazenamento
+    por conteúdo, que pode ter trocado o arquivo por um objeto idêntico.
+    """
+    sha256 = hashlib.sha256()
+    with arquivo:
+        while True:
+            bloco = arquivo.read(BLOCO_ENVIO)
+            if bloco:
+                sha256.update(bloco)
+                yield bloco
+                continue
+            status = download_status.get(download_id)
+            if status is not None and status['status'] in ('queued', 'downloading'):
+                time.sleep(INTERVALO_STREAM)
+                continue
+            # Terminou: entrega o que foi gravado depois da última leitura
+            for bloco in iter(lambda: arquivo.read(BLOCO_ENVIO), b''):
+                sha256.update(bloco)
+                yield bloco
+            if status is None or status['status'] != 'completed':
+                completo = False
+            elif status.get('sha256'):
+                completo = sha256.hexdigest() == status['sha256']
+            else:
+                final = _caminho_download(status.get('filename') or '')
+                try:
+                    completo = bool(final) and os.path.samestat(os.fstat(arquivo.fileno()), os.stat(final))
+                except OSError:
+                    completo = False
+            if not completo:
+                raise RuntimeError(f'Streaming do download {download_id} interrompido')
+            return
+
+@app.route('/stream/<download_id>')
+def stream(download_id):
+    """
+    Entrega o vídeo enquanto ele ainda está sendo baixado
+    
+    Só para downloads pedidos em modo streaming (MP4 fragmentado gravado só no
+    fim do arquivo). A cópia continua indo para a biblioteca normalmente; se o
+    download já terminou, redireciona para o arquivo pronto.
+    """
+    arquivo, status = _abrir_parcial(download_id)
+    if arquivo is None:
+        if status is not None and status['status'] == 'completed' and status.get('filename'):
+            return redirect(url_for('download_file', filename=status['filename']))
+        if status is not None and status['status'] in ('queued', 'downloading'):
+            return Response('Download ainda não começou', status=503, headers={'Retry-After': '2'})
+        flash('Download não encontrado.', 'error')
+        return redirect(url_for('index'))
+    if not status.get('stream'):
+        arquivo.close()
+        return Response('Download não está em modo streaming', status=409)
+    
+    encoded_filename = quote(nome_pelo_titulo(status['expected_filename']).encode('utf-8'))
+    headers = {
+        'Content-Disposition': f"attachment; filename*=UTF-8''{encoded_filename}",
+        'X-Content-Type-Options': 'nosniff',
+        'Cache-Control': 'no-store',
+        # O tamanho final não é conhecido, então não há Range nem Content-Length
+        'Accept-Ranges': 'none',
+    }
+    mimetype = mimetypes.guess_type(status['expected_filename'])[0] or 'application/octet-stream'
+    return Response(stream_with_context(_acompanhar_parcial(download_id, arquivo)), mimetype=mimetype, headers=headers)
+
 @app.route('/delete/<filename>', methods=['POST'])
 def delete_file(filename):
     try:
         # Decodificar o nome do arquivo da URL (similar ao download_file)
-        from urllib.parse import unquote
         filename = unquote(filename)
         
         # Não usar secure_filename para preservar o nome original do arquivo
-        filepath = os.path.join(app.config['DOWNLOAD_FOLDER'], filename)
+        filepath = _caminho_download(filename)
         
-        if os.path.exists(filepath) and os.path.isfile(filepath):
-            os.remove(filepath)
+        if filepath and os.path.isfile(filepath):
+            registro = library.get(filename)
+            conteudo.remover(filename, registro and registro['sha256'])
+            library.remove(filename)
             flash(f'Vídeo "{filename}" deletado com sucesso!', 'success')
         else:
             flash('Arquivo não encontrado.', 'error')
@@ -1098,5 +4421,9 @@ def delete_file(filename):
     return redirect(url_for('videos'))
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    if sys.argv[1:2] == ['downloader']:
+        # Pool de downloads separado dos workers web (DOWNLOAD_RUNNER=external)
+        scheduler.run_forever()
+    else:
+        app.run(host='0.0.0.0', port=5000, debug=True)
 
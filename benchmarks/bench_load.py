@@ -0,0 +1,507 @@
+"""
+Benchmark de carga offline
+
+Sobe a aplicação num processo à parte (servidor threaded do Werkzeug, com
+JOB_STORE=memory para os downloads rodarem no mesmo processo) e troca o
+extrator do YouTube por um falso, que aponta os formatos para um servidor
+HTTP local de mídia sintética. Nada sai para a internet.
+
+Cenários:
+  submit    POSTs concorrentes em /download e o tempo até cada job terminar
+  polling   tempestade de GET /check_download/<id>
+  arquivo   transferências completas de um arquivo grande por /download_file
+  videos    /videos e /api/videos (ordenações, busca, paginação) com 10 mil arquivos
+
+Para cada cenário: requisições, vazão, latência p50/p99, erros e RSS do
+servidor (atual e pico). --salvar grava o resultado em JSON e --comparar
+sai com código 1 se a vazão ou o p99 piorarem além da tolerância em relação
+a um resultado salvo antes.
+
+Uso:
+    python benchmarks/bench_load.py [--cenarios submit,polling,arquivo,videos]
+        [--jobs 200] [--concorrencia 20] [--duracao 10] [--workers 4]
+        [--tamanho-mib 8] [--latencia-ms 50] [--falhas 0.0] [--quebrados 0.0]
+        [--formatos auto|progressivo|separado] [--arquivo-mib 256] [--videos 10000]
+        [--salvar resultado.json] [--comparar base.json] [--tolerancia 0.2]
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Vídeos com esse prefixo no id respondem 404 (o job termina em erro)
+PREFIXO_QUEBRADO = 'quebr'
+BLOCO = bytes(64 * 1024)
+
+# --- Servidor de mídia sintética ---------------------------------------------
+
+class ManipuladorMidia(BaseHTTPRequestHandler):
+    """GET /media/<id>.<stream>.<ext>: bytes zerados, com Range, latência e falhas"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _vazio(self, codigo):
+        self.send_response(codigo)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        servidor = self.server
+        time.sleep(servidor.latencia)
+        video_id = os.path.basename(urllib.parse.urlsplit(self.path).path).split('.')[0]
+        if video_id.startswith(PREFIXO_QUEBRADO):
+            return self._vazio(404)
+        if random.random() < servidor.falhas:
+            # 5xx: o yt-dlp tenta de novo (caminho de retry)
+            return self._vazio(503)
+
+        tamanho = servidor.tamanho
+        inicio, fim, codigo = 0, tamanho - 1, 200
+        encontrado = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if encontrado:
+            inicio = int(encontrado[1])
+            fim = min(int(encontrado[2]) if encontrado[2] else fim, tamanho - 1)
+            codigo = 206
+            if inicio >= tamanho:
+                return self._vazio(416)
+
+        self.send_response(codigo)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(fim - inicio + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if codigo == 206:
+            self.send_header('Content-Range', f'bytes {inicio}-{fim}/{tamanho}')
+        self.end_headers()
+        restante = fim - inicio + 1
+        try:
+            while restante > 0:
+                parte = min(len(BLOCO), restante)
+                self.wfile.write(BLOCO[:parte])
+                restante -= parte
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+class ServidorMidia(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, tamanho, latencia, falhas):
+        super().__init__(('127.0.0.1', 0), ManipuladorMidia)
+        self.tamanho = tamanho
+        self.latencia = latencia
+        self.falhas = falhas
+
+# --- Processo da aplicação ---------------------------------------------------
+
+def registrar_extrator_falso(baixador, midia, formatos):
+    """Faz o criar_ydl() da aplicação usar só um extrator que aponta para `midia`"""
+    yt_dlp = baixador.carregar_yt_dlp()
+    from yt_dlp.extractor.common import InfoExtractor
+
+    class BenchIE(InfoExtractor):
+        IE_NAME = 'bench'
+        _VALID_URL = r'https?://(?:www\.)?youtube\.com/watch\?v=(?P<id>[0-9A-Za-z_-]{11})'
+
+        def _real_extract(self, url):
+            video_id = self._match_id(url)
+            if formatos == 'separado':
+                lista = [
+                    {'format_id': '137', 'url': f'{midia}/media/{video_id}.v.mp4', 'ext': 'mp4',
+                     'vcodec': 'avc1.640028', 'acodec': 'none', 'height': 1080},
+                    {'format_id': '140', 'url': f'{midia}/media/{video_id}.a.m4a', 'ext': 'm4a',
+                     'vcodec': 'none', 'acodec': 'mp4a.40.2'},
+                ]
+            else:
+                lista = [
+                    {'format_id': '18', 'url': f'{midia}/media/{video_id}.av.mp4', 'ext': 'mp4',
+                     'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2', 'height': 360},
+                ]
+            return {'id': video_id, 'title': f'Bench {video_id}', 'duration': 60, 'formats': lista}
+
+    def criar_ydl(opcoes):
+        ydl = yt_dlp.YoutubeDL(opcoes, auto_init=False)
+        ydl.add_info_extractor(BenchIE())
+        return ydl
+
+    baixador.criar_ydl = criar_ydl
+
+def servir(argumentos):
+    """Modo --servidor: roda a aplicação no diretório atual até ser encerrado"""
+    sys.path.insert(0, RAIZ)
+    import app as baixador
+    from werkzeug.serving import make_server
+
+    registrar_extrator_falso(baixador, argumentos.midia, argumentos.formatos)
+    make_server('127.0.0.1', argumentos.porta, baixador.app, threaded=True).serve_forever()
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def memoria_mib(pid):
+    """(RSS atual, pico de RSS) do processo em MiB"""
+    valores = {}
+    with open(f'/proc/{pid}/status') as f:
+        for linha in f:
+            chave, _, valor = linha.partition(':')
+            if chave in ('VmRSS', 'VmHWM'):
+                valores[chave] = int(valor.split()[0]) / 1024
+    return valores.get('VmRSS', 0), valores.get('VmHWM', 0)
+
+# --- Cliente de carga --------------------------------------------------------
+
+class Cliente:
+    """Conexão keep-alive com a aplicação, reaberta se cair"""
+
+    def __init__(self, porta):
+        self.porta = porta
+        self.conexao = None
+
+    def requisitar(self, metodo, caminho, corpo=None, headers=None, descartar=False):
+        """
+        Returns:
+            tuple: (status, corpo); com `descartar`, o corpo é só lido e
+            retorna o número de bytes
+        """
+        for tentativa in range(2):
+            if self.conexao is None:
+                self.conexao = http.client.HTTPConnection('127.0.0.1', self.porta, timeout=120)
+            try:
+                self.conexao.request(metodo, caminho, body=corpo, headers=headers or {})
+                resposta = self.conexao.getresponse()
+                if not descartar:
+                    return resposta.status, resposta.read()
+                total = 0
+                while True:
+                    bloco = resposta.read(1024 * 1024)
+                    if not bloco:
+                        return resposta.status, total
+                    total += len(bloco)
+            except (http.client.HTTPException, OSError):
+                self.conexao.close()
+                self.conexao = None
+                if tentativa:
+                    raise
+
+def executar_carga(porta, tarefa, concorrencia, duracao=None, total=None):
+    """
+    Roda tarefa(cliente, i) em `concorrencia` threads, por `duracao` segundos
+    ou até `total` chamadas; a tarefa retorna se deu certo
+
+    Returns:
+        tuple: (latências em segundos, erros, tempo decorrido)
+    """
+    latencias = []
+    erros = 0
+    contador = itertools.count()
+    lock = threading.Lock()
+    fim = time.perf_counter() + duracao if duracao else None
+
+    def trabalhador():
+        nonlocal erros
+        cliente = Cliente(porta)
+        while True:
+            i = next(contador)
+            if (total is not None and i >= total) or (fim is not None and time.perf_counter() >= fim):
+                return
+            inicio = time.perf_counter()
+            try:
+                ok = tarefa(cliente, i)
+            except Exception:
+                ok = False
+            decorrido = time.perf_counter() - inicio
+            with lock:
+                latencias.append(decorrido)
+                if not ok:
+                    erros += 1
+
+    threads = [threading.Thread(target=trabalhador, daemon=True) for _ in range(concorrencia)]
+    inicio = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencias, erros, time.perf_counter() - inicio
+
+def resumo(latencias, erros, decorrido, pid, **extras):
+    rss, pico = memoria_mib(pid)
+    percentis = statistics.quantiles(latencias, n=100) if len(latencias) > 1 else latencias * 99
+    return {
+        'requisicoes': len(latencias),
+        'por_segundo': len(latencias) / decorrido if decorrido else 0,
+        'p50_ms': statistics.median(latencias) * 1000 if latencias else 0,
+        'p99_ms': percentis[98] * 1000 if percentis else 0,
+        'erros': erros,
+        'rss_mib': rss,
+        'pico_rss_mib': pico,
+        **extras,
+    }
+
+# --- Cenários ----------------------------------------------------------------
+
+def cenario_submit(contexto, argumentos):
+    """POST /download concorrentes e, depois, o tempo até cada job terminar"""
+    jobs = {}
+    a_cada = round(1 / argumentos.quebrados) if argumentos.quebrados else 0
+
+    def enviar(cliente, i):
+        prefixo = PREFIXO_QUEBRADO if a_cada and i % a_cada == 0 else 'bench'
+        url = f'https://www.youtube.com/watch?v={prefixo}{i:06d}'
+        status, corpo = cliente.requisitar(
+            'POST', '/download', urllib.parse.urlencode({'url': url}),
+            {'Content-Type': 'application/x-www-form-urlencoded'},
+        )
+        encontrado = re.search(rb"downloadId = '([^']+)'", corpo)
+        if status != 200 or not encontrado:
+            return False
+        jobs[encontrado[1].decode()] = time.perf_counter()
+        return True
+
+    latencias, erros, decorrido = executar_carga(
+        contexto['porta'], enviar, argumentos.concorrencia, total=argumentos.jobs
+    )
+    resultados = {'submit': resumo(latencias, erros, decorrido, contexto['pid'])}
+
+    # Acompanha os jobs até o fim pelo /api/jobs, em lotes
+    cliente = Cliente(contexto['porta'])
+    pendentes = set(jobs)
+    duracoes = []
+    falhas = 0
+    inicio = time.perf_counter()
+    while pendentes:
+        lista = list(pendentes)
+        for n in range(0, len(lista), 100):
+            ids = ','.join(lista[n:n + 100])
+            _, corpo = cliente.requisitar('GET', f'/api/jobs?ids={ids}')
+            agora = time.perf_counter()
+            for download_id, registro in json.loads(corpo)['jobs'].items():
+                if registro['status'] in ('completed', 'error', 'not_found'):
+                    pendentes.discard(download_id)
+                    duracoes.append(agora - jobs[download_id])
+                    falhas += registro['status'] != 'completed'
+        if pendentes:
+            time.sleep(0.2)
+    resultados['download (fim a fim)'] = resumo(
+        duracoes, falhas, time.perf_counter() - inicio, contexto['pid'],
+        mib_por_segundo=(len(duracoes) - falhas) * argumentos.tamanho_mib / (time.perf_counter() - inicio),
+    )
+    contexto['jobs'] = list(jobs)
+    return resultados
+
+def cenario_polling(contexto, argumentos):
+    """Muitos clientes consultando /check_download ao mesmo tempo"""
+    ids = contexto.get('jobs') or ['inexistente']
+
+    def consultar(cliente, i):
+        status, _ = cliente.requisitar('GET', f'/check_download/{ids[i % len(ids)]}')
+        return status == 200
+
+    latencias, erros, decorrido = executar_carga(
+        contexto['porta'], consultar, argumentos.concorrencia, duracao=argumentos.duracao
+    )
+    return {'polling': resumo(latencias, erros, decorrido, contexto['pid'])}
+
+def cenario_arquivo(contexto, argumentos):
+    """Transferências completas do arquivo grande, algumas ao mesmo tempo"""
+    tamanho = argumentos.arquivo_mib * 1024 * 1024
+
+    def baixar(cliente, i):
+        status, recebidos = cliente.requisitar('GET', '/download_file/grande.mp4', descartar=True)
+        return status == 200 and recebidos == tamanho
+
+    concorrencia = min(argumentos.concorrencia, 4)
+    latencias, erros, decorrido = executar_carga(
+        contexto['porta'], baixar, concorrencia, duracao=argumentos.duracao
+    )
+    return {'arquivo': resumo(
+        latencias, erros, decorrido, contexto['pid'],
+        mib_por_segundo=(len(latencias) - erros) * argumentos.arquivo_mib / decorrido,
+    )}
+
+def cenario_videos(contexto, argumentos):
+    """Lista de vídeos com a biblioteca cheia: página, ordenações, busca e paginação"""
+    cliente = Cliente(contexto['porta'])
+    # A primeira consulta reconcilia a biblioteca com a pasta (10 mil arquivos)
+    inicio = time.perf_counter()
+    cliente.requisitar('GET', '/api/videos')
+    primeira = time.perf_counter() - inicio
+
+    consultas = [
+        '/videos',
+        '/api/videos?limit=50',
+        '/api/videos?sort=size&limit=50',
+        '/api/videos?sort=title&limit=200',
+        '/api/videos?q=00042&limit=50',
+    ]
+    _, corpo = cliente.requisitar('GET', '/api/videos?limit=50')
+    cursor = json.loads(corpo).get('next_cursor')
+    if cursor:
+        consultas.append(f'/api/videos?limit=50&cursor={urllib.parse.quote(cursor)}')
+
+    def listar(cliente, i):
+        status, _ = cliente.requisitar('GET', consultas[i % len(consultas)])
+        return status == 200
+
+    latencias, erros, decorrido = executar_carga(
+        contexto['porta'], listar, argumentos.concorrencia, duracao=argumentos.duracao
+    )
+    return {'videos': resumo(latencias, erros, decorrido, contexto['pid'], primeira_ms=primeira * 1000)}
+
+CENARIOS = {
+    'submit': cenario_submit,
+    'polling': cenario_polling,
+    'arquivo': cenario_arquivo,
+    'videos': cenario_videos,
+}
+
+# --- Execução ----------------------------------------------------------------
+
+def preparar_pasta(pasta, argumentos, cenarios):
+    """Cria os arquivos dos cenários antes de a aplicação subir"""
+    downloads = os.path.join(pasta, 'downloads')
+    os.makedirs(downloads)
+    if 'arquivo' in cenarios:
+        with open(os.path.join(downloads, 'grande.mp4'), 'wb') as f:
+            for _ in range(argumentos.arquivo_mib * 16):
+                f.write(BLOCO)
+    if 'videos' in cenarios:
+        for i in range(argumentos.videos):
+            with open(os.path.join(downloads, f'Video {i:05d}.mp4'), 'wb') as f:
+                f.write(BLOCO[:1024 + i % 4096])
+
+def iniciar_aplicacao(pasta, midia, argumentos):
+    porta = _porta_livre()
+    env = dict(
+        os.environ,
+        JOB_STORE='memory',
+        MAX_DOWNLOAD_WORKERS=str(argumentos.workers),
+        MAX_DOWNLOAD_QUEUE=str(10 ** 9),
+        DOWNLOAD_RUNNER='inline',
+        # Todas as requisições vêm do mesmo IP: o limite por cliente mediria só os 429
+        RATE_LIMIT_SUBMIT='0',
+        RATE_LIMIT_FILES='0',
+        PROMETHEUS_MULTIPROC_DIR=os.path.join(pasta, 'metrics'),
+    )
+    os.makedirs(env['PROMETHEUS_MULTIPROC_DIR'])
+    log = open(os.path.join(pasta, 'servidor.log'), 'wb')
+    processo = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--servidor', '--porta', str(porta),
+         '--midia', midia, '--formatos', argumentos.formatos],
+        cwd=pasta, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    cliente = Cliente(porta)
+    limite = time.time() + 60
+    while True:
+        try:
+            if cliente.requisitar('GET', '/')[0] == 200:
+                return processo, porta
+        except OSError:
+            pass
+        if processo.poll() is not None or time.time() > limite:
+            raise RuntimeError(f'a aplicação não subiu; veja {log.name}')
+        time.sleep(0.1)
+
+def imprimir(resultados):
+    print(f"{'cenário':<22} {'req':>7} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'erros':>6} {'RSS MiB':>8} {'pico':>7}  extra")
+    for nome, r in resultados.items():
+        extra = '  '.join(f'{k}={v:.1f}' for k, v in r.items() if k in ('mib_por_segundo', 'primeira_ms'))
+        print(f"{nome:<22} {r['requisicoes']:>7} {r['por_segundo']:>9.1f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f}"
+              f" {r['erros']:>6} {r['rss_mib']:>8.1f} {r['pico_rss_mib']:>7.1f}  {extra}")
+
+def comparar(resultados, caminho, tolerancia):
+    """Regressões de vazão ou p99 em relação a um resultado salvo"""
+    with open(caminho) as f:
+        base = json.load(f)
+    regressoes = []
+    for nome, atual in resultados.items():
+        anterior = base.get(nome)
+        if not anterior:
+            continue
+        if anterior['por_segundo'] and atual['por_segundo'] < anterior['por_segundo'] * (1 - tolerancia):
+            regressoes.append(f"{nome}: vazão {anterior['por_segundo']:.1f} -> {atual['por_segundo']:.1f} req/s")
+        if anterior['p99_ms'] and atual['p99_ms'] > anterior['p99_ms'] * (1 + tolerancia):
+            regressoes.append(f"{nome}: p99 {anterior['p99_ms']:.1f} -> {atual['p99_ms']:.1f} ms")
+    return regressoes
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de carga offline do baixador')
+    parser.add_argument('--servidor', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--porta', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--midia', help=argparse.SUPPRESS)
+    parser.add_argument('--cenarios', default=','.join(CENARIOS))
+    parser.add_argument('--jobs', type=int, default=200)
+    parser.add_argument('--concorrencia', type=int, default=20)
+    parser.add_argument('--duracao', type=float, default=10.0, help='segundos por cenário de tempo fixo')
+    parser.add_argument('--workers', type=int, default=4, help='MAX_DOWNLOAD_WORKERS da aplicação')
+    parser.add_argument('--tamanho-mib', type=float, default=8.0, help='tamanho de cada vídeo sintético')
+    parser.add_argument('--latencia-ms', type=float, default=50.0, help='atraso até o primeiro byte da mídia')
+    parser.add_argument('--falhas', type=float, default=0.0, help='fração de requisições de mídia com 503')
+    parser.add_argument('--quebrados', type=float, default=0.0, help='fração de vídeos cuja mídia dá 404')
+    parser.add_argument('--formatos', choices=('auto', 'progressivo', 'separado'), default='auto')
+    parser.add_argument('--arquivo-mib', type=int, default=256)
+    parser.add_argument('--videos', type=int, default=10_000)
+    parser.add_argument('--salvar')
+    parser.add_argument('--comparar')
+    parser.add_argument('--tolerancia', type=float, default=0.2)
+    argumentos = parser.parse_args()
+
+    if argumentos.servidor:
+        servir(argumentos)
+        return
+
+    if argumentos.formatos == 'auto':
+        # Vídeo e áudio separados precisam do ffmpeg para o merge
+        argumentos.formatos = 'separado' if shutil.which('ffmpeg') else 'progressivo'
+    cenarios = [c for c in argumentos.cenarios.split(',') if c]
+    desconhecidos = set(cenarios) - set(CENARIOS)
+    if desconhecidos:
+        parser.error(f"cenários desconhecidos: {', '.join(sorted(desconhecidos))}")
+
+    midia = ServidorMidia(int(argumentos.tamanho_mib * 1024 * 1024), argumentos.latencia_ms / 1000, argumentos.falhas)
+    threading.Thread(target=midia.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory(prefix='bench-load-') as pasta:
+        preparar_pasta(pasta, argumentos, cenarios)
+        processo, porta = iniciar_aplicacao(pasta, f'http://127.0.0.1:{midia.server_address[1]}', argumentos)
+        try:
+            contexto = {'porta': porta, 'pid': processo.pid}
+            print(f'formatos: {argumentos.formatos}   RSS inicial: {memoria_mib(processo.pid)[0]:.1f} MiB')
+            resultados = {}
+            for nome in cenarios:
+                resultados.update(CENARIOS[nome](contexto, argumentos))
+        finally:
+            processo.terminate()
+            processo.wait()
+            midia.shutdown()
+
+    imprimir(resultados)
+    if argumentos.salvar:
+        with open(argumentos.salvar, 'w') as f:
+            json.dump(resultados, f, indent=2)
+    if argumentos.comparar:
+        regressoes = comparar(resultados, argumentos.comparar, argumentos.tolerancia)
+        for regressao in regressoes:
+            print(f'REGRESSÃO {regressao}')
+        if regressoes:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark de inicialização
+
+Mede, em processos novos:
+  - tempo de importação do app.py (como era antes, com `import yt_dlp` no
+    topo, sob demanda e com PRELOAD_YT_DLP=1);
+  - tempo até a primeira resposta de um gunicorn recém-iniciado
+    (sob demanda e com --preload + PRELOAD_YT_DLP=1);
+  - custo do primeiro YoutubeDL (todos os extratores x só os de EXTRATORES).
+
+Uso:
+    python benchmarks/bench_startup.py [repetições]
+"""
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _executar(codigo, env_extra=None):
+    """Roda `codigo` num interpretador novo e retorna o float que ele imprimir"""
+    env = dict(os.environ, PYTHONPATH=RAIZ, **(env_extra or {}))
+    with tempfile.TemporaryDirectory(prefix='bench-startup-') as pasta:
+        saida = subprocess.run(
+            [sys.executable, '-c', codigo], cwd=pasta, env=env,
+            capture_output=True, text=True, check=True
+        )
+    return float(saida.stdout.strip().splitlines()[-1])
+
+def tempo_importacao(antes=False, preload=False):
+    codigo = (
+        'import time; t = time.perf_counter()\n'
+        + ('import yt_dlp\n' if antes else '')
+        + 'import app\n'
+        'print(time.perf_counter() - t)'
+    )
+    return _executar(codigo, {'PRELOAD_YT_DLP': '1' if preload else '0'})
+
+def tempo_primeiro_ydl(todos):
+    codigo = (
+        'import time, app; t = time.perf_counter()\n'
+        + ('import yt_dlp; yt_dlp.YoutubeDL({"quiet": True})\n' if todos else 'app.preload_yt_dlp()\n')
+        + 'print(time.perf_counter() - t)'
+    )
+    return _executar(codigo)
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def tempo_primeira_resposta(preload=False):
+    """Do início do gunicorn até o primeiro 200 em /"""
+    porta = _porta_livre()
+    comando = [
+        sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{porta}',
+        '--workers', '1', '--worker-class', 'gthread', '--threads', '4', 'app:app'
+    ]
+    if preload:
+        comando.insert(-1, '--preload')
+    env = dict(os.environ, PYTHONPATH=RAIZ, PRELOAD_YT_DLP='1' if preload else '0')
+    with tempfile.TemporaryDirectory(prefix='bench-startup-') as pasta:
+        inicio = time.perf_counter()
+        processo = subprocess.Popen(comando, cwd=pasta, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                try:
+                    with urllib.request.urlopen(f'http://127.0.0.1:{porta}/', timeout=1) as r:
+                        if r.status == 200:
+                            return time.perf_counter() - inicio
+                except OSError:
+                    if processo.poll() is not None:
+                        raise RuntimeError('gunicorn terminou antes de responder')
+                    time.sleep(0.01)
+        finally:
+            processo.terminate()
+            processo.wait()
+
+def _resumo(nome, medicoes):
+    print(f'{nome:<48} mediana {statistics.median(medicoes) * 1000:8.1f} ms   min {min(medicoes) * 1000:8.1f} ms')
+
+def main():
+    repeticoes = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    _resumo('importação (antes: import yt_dlp no topo)', [tempo_importacao(antes=True) for _ in range(repeticoes)])
+    _resumo('importação (yt-dlp sob demanda)', [tempo_importacao() for _ in range(repeticoes)])
+    _resumo('importação (PRELOAD_YT_DLP=1)', [tempo_importacao(preload=True) for _ in range(repeticoes)])
+    _resumo('primeiro YoutubeDL (todos os extratores)', [tempo_primeiro_ydl(True) for _ in range(repeticoes)])
+    _resumo('primeiro YoutubeDL (só EXTRATORES)', [tempo_primeiro_ydl(False) for _ in range(repeticoes)])
+    try:
+        _resumo('gunicorn até a 1ª resposta (sob demanda)', [tempo_primeira_resposta() for _ in range(repeticoes)])
+        _resumo('gunicorn até a 1ª resposta (--preload)', [tempo_primeira_resposta(True) for _ in range(repeticoes)])
+    except (FileNotFoundError, subprocess.SubprocessError, RuntimeError) as e:
+        print(f'gunicorn indisponível: {e}')
+
+if __name__ == '__main__':
+    main()
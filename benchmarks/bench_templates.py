@@ -0,0 +1,69 @@
+"""
+Microbenchmark das páginas HTML
+
+Compara, pelo cliente de teste do Flask, o modo antigo (render_template_string
+a cada requisição, com o CSS embutido em cada página) com o atual (templates
+pré-compilados, CSS num arquivo estático e páginas prontas com ETag).
+
+Uso:
+    python benchmarks/bench_templates.py [segundos por cenário]
+"""
+import os
+import re
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+# A aplicação cria downloads/ no diretório atual
+os.chdir(tempfile.mkdtemp(prefix='bench-templates-'))
+
+import app as baixador  # noqa: E402
+from flask import render_template_string  # noqa: E402
+
+with open(os.path.join(RAIZ, 'static', 'style.css'), encoding='utf-8') as f:
+    CSS = f.read()
+
+# Reconstrói as páginas como eram antes: CSS embutido e template compilado a cada requisição
+ANTIGOS = {
+    nome: re.sub(r'<link rel="stylesheet"[^>]*>', lambda _: f'<style>{CSS}</style>', fonte)
+    for nome, fonte in baixador.TEMPLATES.items()
+}
+
+@baixador.app.route('/bench/antes/<nome>')
+def antes(nome):
+    return render_template_string(ANTIGOS[nome])
+
+PAGINAS = {
+    'index.html': '/',
+    'videos.html': '/videos',
+    'downloading.html': '/downloading',
+    'success.html': '/success',
+}
+
+def medir(client, url, segundos, headers=None):
+    """Requisições por segundo e bytes por resposta"""
+    total = 0
+    tamanho = 0
+    fim = time.perf_counter() + segundos
+    while time.perf_counter() < fim:
+        response = client.get(url, headers=headers)
+        tamanho = len(response.data)
+        total += 1
+    return total / segundos, tamanho
+
+def main():
+    segundos = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    client = baixador.app.test_client()
+
+    print(f"{'página':<18} {'antes req/s':>12} {'depois req/s':>13} {'304 req/s':>10} {'bytes antes':>12} {'bytes depois':>13}")
+    for nome, url in PAGINAS.items():
+        rps_antes, bytes_antes = medir(client, f'/bench/antes/{nome}', segundos)
+        rps_depois, bytes_depois = medir(client, url, segundos)
+        etag = client.get(url).headers.get('ETag')
+        rps_304, _ = medir(client, url, segundos, headers={'If-None-Match': etag})
+        print(f'{nome:<18} {rps_antes:>12.0f} {rps_depois:>13.0f} {rps_304:>10.0f} {bytes_antes:>12} {bytes_depois:>13}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+Verificação das respostas parciais de /download_file com um arquivo grande
+
+Cria um arquivo esparso de vários GiB (não ocupa o disco, só os trechos com
+marcadores) e confere, pelo cliente de teste do Flask, os validadores (ETag,
+Last-Modified, 304), Range de um intervalo, sufixo e aberto, intervalos além
+de 4 GiB (com mais de 4 GiB; o padrão é 5), multipart/byteranges com
+Content-Length exato, If-Range que confere e que não confere, 416 e HEAD.
+Nenhuma resposta completa é lida: só os cabeçalhos.
+
+tests/test_ranges.py faz as mesmas verificações (5 GiB) com o pytest; este
+script serve para conferir à mão, com outro tamanho e medindo o tempo.
+
+Uso:
+    python benchmarks/check_ranges.py [tamanho em GiB]
+
+Sai com código 1 se alguma verificação falhar.
+"""
+import os
+import sys
+import tempfile
+import time
+from email.utils import formatdate
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+# A aplicação cria downloads/ no diretório atual
+os.chdir(tempfile.mkdtemp(prefix='check-ranges-'))
+os.environ.update(JOB_STORE='memory', RATE_LIMIT_FILES='0')
+
+import app as baixador  # noqa: E402
+
+NOME = 'Vídeo grande.mp4'
+QUATRO_GIB = 4 * 1024 ** 3
+falhas = []
+
+def verificar(condicao, descricao):
+    print(f"{'ok  ' if condicao else 'FALHOU'} {descricao}")
+    if not condicao:
+        falhas.append(descricao)
+
+def criar_arquivo(caminho, tamanho, meio):
+    """Arquivo esparso com marcadores aleatórios no início, em `meio` e no fim"""
+    with open(caminho, 'wb') as f:
+        f.truncate(tamanho)
+        for posicao in (0, meio - 32, tamanho - 64):
+            f.seek(posicao)
+            f.write(os.urandom(64))
+
+def trecho(caminho, inicio, fim):
+    with open(caminho, 'rb') as f:
+        f.seek(inicio)
+        return f.read(fim - inicio + 1)
+
+def partes_multipart(response):
+    """[(Content-Range, corpo)] de uma resposta multipart/byteranges"""
+    boundary = response.headers['Content-Type'].split('boundary=', 1)[1].encode('latin-1')
+    partes = []
+    for bloco in response.data.split(b'--' + boundary)[1:]:
+        if bloco.startswith(b'--'):
+            break
+        cabecalhos, _, corpo = bloco[2:].partition(b'\r\n\r\n')
+        faixa = next(
+            linha.split(b':', 1)[1].strip().decode('latin-1')
+            for linha in cabecalhos.split(b'\r\n') if linha.lower().startswith(b'content-range')
+        )
+        partes.append((faixa, corpo[:-2]))
+    return partes
+
+def main():
+    gib = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    tamanho = int(gib * 1024 ** 3)
+    # Os intervalos do meio cruzam 4 GiB quando o arquivo passa disso
+    meio = QUATRO_GIB if tamanho > QUATRO_GIB + 1024 else tamanho // 2
+    caminho = os.path.join(baixador.app.config['DOWNLOAD_FOLDER'], NOME)
+    criar_arquivo(caminho, tamanho, meio)
+    client = baixador.app.test_client()
+    url = '/download_file/' + NOME
+
+    def pedir(metodo='GET', **headers):
+        return client.open(url, method=metodo, headers=headers, buffered=False)
+
+    inicio = time.perf_counter()
+    cabeca = pedir('HEAD')
+    etag = cabeca.headers.get('ETag', '').strip('"')
+    verificar(cabeca.status_code == 200 and cabeca.content_length == tamanho, 'HEAD: 200 com o tamanho total')
+    verificar(cabeca.get_data() == b'', 'HEAD: sem corpo')
+    verificar(cabeca.headers.get('Accept-Ranges') == 'bytes', 'HEAD: Accept-Ranges: bytes')
+    verificar(bool(etag) and bool(cabeca.headers.get('Last-Modified')), 'HEAD: ETag e Last-Modified')
+
+    completo = pedir()
+    verificar(completo.status_code == 200 and completo.content_length == tamanho, 'GET sem Range: 200 com o tamanho total')
+    completo.close()
+
+    verificar(pedir(**{'If-None-Match': f'"{etag}"'}).status_code == 304, 'If-None-Match com o ETag atual: 304')
+    verificar(
+        pedir(**{'If-Modified-Since': cabeca.headers['Last-Modified']}).status_code == 304,
+        'If-Modified-Since com o Last-Modified atual: 304',
+    )
+    verificar(pedir(**{'If-None-Match': '"outro"'}).status_code == 200, 'If-None-Match com outro ETag: 200')
+
+    casos = [
+        ('bytes=0-99', 0, 99, 'intervalo no início'),
+        ('bytes=-100', tamanho - 100, tamanho - 1, 'sufixo (últimos 100 bytes)'),
+        (f'bytes={tamanho - 10}-', tamanho - 10, tamanho - 1, 'intervalo aberto no fim'),
+        (f'bytes={meio - 40}-{meio + 40}', meio - 40, meio + 40, f'intervalo cruzando o byte {meio}'),
+        (f'bytes={tamanho - 5}-{tamanho + 100}', tamanho - 5, tamanho - 1, 'fim além do arquivo é truncado'),
+    ]
+    for faixa, de, ate, descricao in casos:
+        response = pedir(Range=faixa)
+        verificar(
+            response.status_code == 206
+            and response.headers.get('Content-Range') == f'bytes {de}-{ate}/{tamanho}'
+            and response.content_length == ate - de + 1
+            and response.get_data() == trecho(caminho, de, ate),
+            f'Range {descricao}: 206 com os bytes certos',
+        )
+
+    faixas = [(0, 9), (meio - 32, meio + 31), (tamanho - 5, tamanho - 1)]
+    response = pedir(Range='bytes=0-9,' + f'{meio - 32}-{meio + 31},-5')
+    corpo = response.get_data()
+    verificar(
+        response.status_code == 206 and response.headers['Content-Type'].startswith('multipart/byteranges'),
+        'vários intervalos: 206 multipart/byteranges',
+    )
+    verificar(response.content_length == len(corpo), 'multipart: Content-Length igual ao corpo enviado')
+    verificar(
+        partes_multipart(response) == [
+            (f'bytes {de}-{ate}/{tamanho}', trecho(caminho, de, ate)) for de, ate in faixas
+        ],
+        'multipart: cada parte com o Content-Range e os bytes certos',
+    )
+    response = pedir(Range='bytes=0-9,5-19,20-29')
+    verificar(
+        response.status_code == 206 and response.headers.get('Content-Range') == f'bytes 0-29/{tamanho}',
+        'intervalos sobrepostos e contíguos são mesclados',
+    )
+    muitos = ','.join(f'{i * 100}-{i * 100 + 9}' for i in range(baixador.MAX_INTERVALOS + 1))
+    response = pedir(Range=f'bytes={muitos}')
+    verificar(response.status_code == 200, f'mais de {baixador.MAX_INTERVALOS} intervalos: arquivo inteiro')
+    response.close()
+
+    response = pedir(Range='bytes=100-199', **{'If-Range': f'"{etag}"'})
+    verificar(response.status_code == 206, 'If-Range com o ETag atual: 206')
+    response = pedir(Range='bytes=100-199', **{'If-Range': '"versao-antiga"'})
+    verificar(
+        response.status_code == 200 and response.content_length == tamanho,
+        'If-Range com outro ETag: 200 com o arquivo inteiro',
+    )
+    response.close()
+    response = pedir(Range='bytes=100-199', **{'If-Range': formatdate(0, usegmt=True)})
+    verificar(response.status_code == 200, 'If-Range com outra data: 200')
+    response.close()
+
+    response = pedir(Range=f'bytes={tamanho}-')
+    verificar(
+        response.status_code == 416 and response.headers.get('Content-Range') == f'bytes */{tamanho}',
+        'intervalo além do fim: 416 com Content-Range bytes */tamanho',
+    )
+    response = pedir(Range='linhas=0-9')
+    verificar(response.status_code == 200, 'unidade desconhecida: Range ignorado')
+    response.close()
+
+    # Validadores mudam com o arquivo: a retomada não mistura versões
+    os.utime(caminho, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+    response = pedir(Range='bytes=0-9', **{'If-Range': f'"{etag}"'})
+    verificar(response.status_code == 200, 'arquivo alterado: If-Range antigo devolve o arquivo inteiro')
+    response.close()
+
+    verificar(
+        client.get('/download_file/.state/jobs.sqlite3').status_code == 302
+        and client.get('/download_file/../app.py').status_code == 302,
+        'arquivos ocultos e fora da pasta não são entregues',
+    )
+
+    print(f'{gib:g} GiB, {time.perf_counter() - inicio:.2f} s')
+    if falhas:
+        print(f'{len(falhas)} verificação(ões) falharam')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
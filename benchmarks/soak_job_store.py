@@ -0,0 +1,95 @@
+"""
+Teste de resistência do armazenamento de status em memória
+
+Envia muitos jobs sintéticos pelo scheduler, com o download substituído por
+um stub instantâneo (metade conclui, metade falha), e acompanha o RSS do
+processo e a quantidade de registros vivos e descartados. Com JOB_TTL e
+MAX_TRACKED_JOBS o RSS deve ficar estável; sem limites (--sem-limite) ele
+cresce com o número de jobs.
+
+Uso:
+    python benchmarks/soak_job_store.py [jobs] [--sem-limite]
+
+Sai com código 1 se o RSS final passar de 10% acima do medido após o
+primeiro quinto dos jobs.
+"""
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+# A aplicação cria downloads/ no diretório atual
+os.chdir(tempfile.mkdtemp(prefix='soak-jobs-'))
+
+SEM_LIMITE = '--sem-limite' in sys.argv
+os.environ.update(
+    JOB_STORE='memory',
+    JOB_TTL='0' if SEM_LIMITE else '2',
+    MAX_TRACKED_JOBS='0' if SEM_LIMITE else '2000',
+    MAX_DOWNLOAD_WORKERS='4',
+    MAX_DOWNLOAD_QUEUE=str(10 ** 9),
+)
+
+import app as baixador  # noqa: E402
+
+# Jobs aguardando na fila durante o envio (o scheduler não é o alvo aqui)
+MAX_PENDENTES = 200
+TOLERANCIA = 0.10
+
+def baixar_stub(url, pasta_destino='downloads', progresso=None, formato_anterior=None, streaming=False,
+                perfil=baixador.PERFIL_PADRAO):
+    numero = int(url.rsplit('=', 1)[1])
+    if numero % 2:
+        return {'success': False, 'error': 'falha sintética'}
+    return {
+        'success': True,
+        'title': f'Video {numero}',
+        'filename': f'video-{numero}.mp4',
+        'video_id': None,
+        'duration': 60,
+        'format': '18 - 640x360',
+    }
+
+def rss_mib():
+    with open('/proc/self/statm') as f:
+        paginas = int(f.read().split()[1])
+    return paginas * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+def main():
+    argumentos = [a for a in sys.argv[1:] if not a.startswith('--')]
+    total = int(argumentos[0]) if argumentos else 100_000
+    baixador.baixar_video_youtube = baixar_stub
+    # Sem arquivos de verdade: a biblioteca e o LRU ficam fora da medição
+    baixador.library.add = lambda *args, **kwargs: None
+    baixador.storage.evict_if_needed = lambda: []
+    status = baixador.download_status
+    scheduler = baixador.scheduler
+    scheduler.intervalo_fila = 0.01
+    scheduler.ensure_running()
+
+    amostras = []
+    inicio = time.perf_counter()
+    print(f"{'jobs':>8} {'vivos':>8} {'descartados':>12} {'RSS MiB':>9}")
+    for i in range(1, total + 1):
+        while status.count('queued') >= MAX_PENDENTES:
+            time.sleep(0.001)
+        scheduler.submit(f'https://www.youtube.com/watch?v={i}', str(uuid.uuid4()))
+        if i % (total // 10) == 0:
+            amostras.append(rss_mib())
+            descartados = status.counters().get('jobs_evicted', 0)
+            print(f'{i:>8} {status.total():>8} {descartados:>12} {amostras[-1]:>9.1f}')
+    duracao = time.perf_counter() - inicio
+    print(f'{total / duracao:.0f} jobs/s')
+
+    referencia = amostras[1]
+    crescimento = (amostras[-1] - referencia) / referencia
+    print(f'RSS: {referencia:.1f} MiB -> {amostras[-1]:.1f} MiB ({crescimento:+.1%})')
+    if crescimento > TOLERANCIA:
+        print('RSS cresceu além da tolerância')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
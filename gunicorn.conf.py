@@ -0,0 +1,16 @@
+"""
+Configuração do gunicorn (lida automaticamente do diretório de trabalho)
+
+O app é sempre carregado no processo mestre: é ele que prepara a pasta de
+métricas do container (ver PROMETHEUS_MULTIPROC_DIR no app.py) antes de
+criar os workers, que a herdam pronta.
+"""
+
+preload_app = True
+
+def child_exit(server, worker):
+    """Worker encerrado (reciclado ou morto pelo --timeout)"""
+    # Importado só aqui: o prometheus_client escolhe o modo multiprocesso na
+    # importação, que precisa acontecer depois de o app definir a pasta
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
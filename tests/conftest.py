@@ -0,0 +1,20 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+@pytest.fixture(scope='session')
+def baixador(tmp_path_factory):
+    """O módulo app, importado num diretório temporário (ele cria downloads/ no diretório atual)"""
+    pasta = tmp_path_factory.mktemp('app')
+    anterior = os.getcwd()
+    os.chdir(pasta)
+    os.environ.update(JOB_STORE='memory', RATE_LIMIT_FILES='0', DOWNLOAD_RUNNER='worker')
+    try:
+        yield importlib.import_module('app')
+    finally:
+        os.chdir(anterior)
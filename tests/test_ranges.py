@@ -0,0 +1,141 @@
+"""
+Respostas parciais de /download_file com um arquivo esparso maior que 4 GiB
+
+As mesmas verificações de benchmarks/check_ranges.py (que continua como
+verificação manual, com tamanho configurável), rodando com o pytest.
+"""
+import os
+import time
+from email.utils import formatdate
+
+import pytest
+
+NOME = 'Vídeo grande.mp4'
+QUATRO_GIB = 4 * 1024 ** 3
+TAMANHO = 5 * 1024 ** 3
+URL = '/download_file/' + NOME
+
+@pytest.fixture
+def arquivo(baixador):
+    """Arquivo esparso com marcadores aleatórios no início, perto de 4 GiB e no fim"""
+    caminho = os.path.join(baixador.app.config['DOWNLOAD_FOLDER'], NOME)
+    with open(caminho, 'wb') as f:
+        f.truncate(TAMANHO)
+        for posicao in (0, QUATRO_GIB - 32, TAMANHO - 64):
+            f.seek(posicao)
+            f.write(os.urandom(64))
+    yield caminho
+    os.remove(caminho)
+
+@pytest.fixture
+def pedir(baixador, arquivo):
+    client = baixador.app.test_client()
+    
+    def pedir(metodo='GET', **headers):
+        # Sem buffer: as respostas completas (5 GiB) nunca são lidas
+        return client.open(URL, method=metodo, headers=headers, buffered=False)
+    return pedir
+
+def trecho(caminho, inicio, fim):
+    with open(caminho, 'rb') as f:
+        f.seek(inicio)
+        return f.read(fim - inicio + 1)
+
+def partes_multipart(response):
+    """[(Content-Range, corpo)] de uma resposta multipart/byteranges"""
+    boundary = response.headers['Content-Type'].split('boundary=', 1)[1].encode('latin-1')
+    partes = []
+    for bloco in response.get_data().split(b'--' + boundary)[1:]:
+        if bloco.startswith(b'--'):
+            break
+        cabecalhos, _, corpo = bloco[2:].partition(b'\r\n\r\n')
+        faixa = next(
+            linha.split(b':', 1)[1].strip().decode('latin-1')
+            for linha in cabecalhos.split(b'\r\n') if linha.lower().startswith(b'content-range')
+        )
+        partes.append((faixa, corpo[:-2]))
+    return partes
+
+def test_head(pedir):
+    response = pedir('HEAD')
+    assert response.status_code == 200
+    assert response.content_length == TAMANHO
+    assert response.get_data() == b''
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers.get('ETag') and response.headers.get('Last-Modified')
+
+def test_get_sem_range(pedir):
+    response = pedir()
+    assert response.status_code == 200
+    assert response.content_length == TAMANHO
+    response.close()
+
+def test_validadores_304(pedir):
+    cabeca = pedir('HEAD')
+    assert pedir(**{'If-None-Match': cabeca.headers['ETag']}).status_code == 304
+    assert pedir(**{'If-Modified-Since': cabeca.headers['Last-Modified']}).status_code == 304
+    response = pedir(**{'If-None-Match': '"outro"'})
+    assert response.status_code == 200
+    response.close()
+
+@pytest.mark.parametrize('faixa, de, ate', [
+    ('bytes=0-99', 0, 99),
+    ('bytes=-100', TAMANHO - 100, TAMANHO - 1),
+    (f'bytes={TAMANHO - 10}-', TAMANHO - 10, TAMANHO - 1),
+    (f'bytes={QUATRO_GIB - 40}-{QUATRO_GIB + 40}', QUATRO_GIB - 40, QUATRO_GIB + 40),
+    (f'bytes={TAMANHO - 5}-{TAMANHO + 100}', TAMANHO - 5, TAMANHO - 1),
+], ids=['inicio', 'sufixo', 'aberto', 'cruzando-4gib', 'alem-do-fim'])
+def test_um_intervalo(pedir, arquivo, faixa, de, ate):
+    response = pedir(Range=faixa)
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes {de}-{ate}/{TAMANHO}'
+    assert response.content_length == ate - de + 1
+    assert response.get_data() == trecho(arquivo, de, ate)
+
+def test_multipart(pedir, arquivo):
+    faixas = [(0, 9), (QUATRO_GIB - 32, QUATRO_GIB + 31), (TAMANHO - 5, TAMANHO - 1)]
+    response = pedir(Range=f'bytes=0-9,{QUATRO_GIB - 32}-{QUATRO_GIB + 31},-5')
+    assert response.status_code == 206
+    assert response.headers['Content-Type'].startswith('multipart/byteranges')
+    corpo = response.get_data()
+    assert response.content_length == len(corpo)
+    assert partes_multipart(response) == [
+        (f'bytes {de}-{ate}/{TAMANHO}', trecho(arquivo, de, ate)) for de, ate in faixas
+    ]
+
+def test_intervalos_mesclados(pedir):
+    response = pedir(Range='bytes=0-9,5-19,20-29')
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 0-29/{TAMANHO}'
+
+def test_intervalos_demais(baixador, pedir):
+    muitos = ','.join(f'{i * 100}-{i * 100 + 9}' for i in range(baixador.MAX_INTERVALOS + 1))
+    response = pedir(Range=f'bytes={muitos}')
+    assert response.status_code == 200
+    response.close()
+
+def test_if_range(pedir):
+    etag = pedir('HEAD').headers['ETag']
+    assert pedir(Range='bytes=100-199', **{'If-Range': etag}).status_code == 206
+    for validador in ('"versao-antiga"', formatdate(0, usegmt=True)):
+        response = pedir(Range='bytes=100-199', **{'If-Range': validador})
+        assert response.status_code == 200
+        assert response.content_length == TAMANHO
+        response.close()
+
+def test_if_range_arquivo_alterado(pedir, arquivo):
+    etag = pedir('HEAD').headers['ETag']
+    os.utime(arquivo, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+    response = pedir(Range='bytes=0-9', **{'If-Range': etag})
+    assert response.status_code == 200
+    response.close()
+
+def test_416(pedir):
+    response = pedir(Range=f'bytes={TAMANHO}-')
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{TAMANHO}'
+
+def test_unidade_desconhecida(pedir):
+    response = pedir(Range='linhas=0-9')
+    assert response.status_code == 200
+    response.close()